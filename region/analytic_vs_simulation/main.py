@@ -0,0 +1,122 @@
+'''
+Cross-check of the analytic loop-coil field (lfwu.loop_coil) against the FEMM exports of max_guaranteed_region/data.
+
+The analytic coil has no ferrite core, so the magnitudes are compared through their ratio (the core's gain) and
+the lobes each with their own threshold, taken as in max_guaranteed_region/main.py at theta = 0 and r = r_m[-1].
+The script exits with an error if the analytic field is further from FEMM than the tolerances below.
+Run it from anywhere: python analytic_vs_simulation/main.py
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# The shared compute code lives in region/lfwu
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from lfwu.field_cache import load_field_set
+from lfwu.engine import field_module_angle, guaranteed_lobe
+from lfwu.loop_coil import coil_field_set
+
+data_dir 	= os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'max_guaranteed_region', 'data' )
+
+lines_n 	= 100
+min_dist_m	= 0.1	# Below this the near field of the coil (and its core) dominates, the ratios are only taken from here on.
+thetas_d 	= [ 0, 15, 30, 45, 60, 75, 90 ]
+alphas_d 	= thetas_d
+phis_d 		= [ 0, 45, 90 ]
+
+# Geometry of the coil in simulation/model.FEM: mean radius, turns and length, in meters.
+coil_radius_m 	= 0.0071
+coil_turns 		= 82
+coil_length_m 	= 0.045
+
+# Guaranteed lobe of the analytic coil with the settings above. The check fails if the engine drifts from it.
+reference_lobe 	= [ 0.3151, 0.3110, 0.2989, 0.2828, 0.2989, 0.3110, 0.3151 ]
+tolerance 		= 1e-3
+
+# Accepted mismatch with FEMM past min_dist_m. Without the ferrite core the analytic field is only close in shape:
+# today the gain spreads by 0.16 at most, the median gamma error reaches 13 deg (at 75 deg) and the lobes scaled
+# by the gain are 7 to 17% longer. The 45 deg line is left out of the gain and gamma checks: its norm_ and tan_
+# exports are the same file.
+max_gain_spread 	= 0.2 		# Standard deviation over mean of the gain, on each line.
+max_gamma_err_d 	= 15 		# Median gamma error on each line, in degrees.
+max_lobe_ratio_err 	= 0.25 		# | analytic lobe / FEMM lobe - 1 |, the analytic field scaled by each line's gain.
+trusted_d 			= [ t for t in thetas_d if t != 45 ]
+
+
+##############################################
+#### FEMM AND ANALYTIC FIELDS ################
+##############################################
+
+femm 	= load_field_set( data_dir, thetas_d )
+r 		= np.asarray( femm.r )[:, :lines_n]
+r_m 	= r[-1]
+
+start 	= time.perf_counter()
+coil 	= coil_field_set( thetas_d, r, coil_radius_m, coil_turns, coil_length_m )
+elapsed = time.perf_counter() - start
+
+( B_femm, gamma_femm_r ) 	= field_module_angle( np.asarray( femm.B_et )[:, :lines_n], np.asarray( femm.B_er )[:, :lines_n] )
+( B_coil, gamma_coil_r ) 	= field_module_angle( coil.B_et, coil.B_er )
+
+
+##############################################
+#### COMPARISON ##############################
+##############################################
+
+far 		= r >= min_dist_m
+gain 		= np.where( far, B_femm / B_coil, np.nan )
+gamma_err_d = np.where( far, np.degrees( np.abs( gamma_femm_r - gamma_coil_r ) ), np.nan )
+
+print( "analytic field: %.1f ms for %d points" % ( elapsed*1e3, B_coil.size ) )
+print( "theta (deg)   gain   gain spread   median gamma error (deg)" )
+for ( theta_d, g, e ) in zip( thetas_d, gain, gamma_err_d ):
+	print( "%11d %6.1f %12.3f %20.2f" % ( theta_d, np.nanmedian( g ), np.nanstd( g ) / np.nanmean( g ), np.nanmedian( e ) ) )
+
+lobe_femm = guaranteed_lobe( B_femm, gamma_femm_r, r_m, thetas_d, alphas_d, phis_d, B_femm[0][lines_n-1] ).guar_lobe
+lobe_coil = guaranteed_lobe( B_coil, gamma_coil_r, r_m, thetas_d, alphas_d, phis_d, B_coil[0][lines_n-1] ).guar_lobe
+print( "guar_lobe FEMM:     ", np.round( lobe_femm, 4 ) )
+print( "guar_lobe analytic: ", np.round( lobe_coil, 4 ) )
+
+
+##############################################
+#### DESIGN SWEEP ############################
+##############################################
+
+# Every combination of radius and turns in a single call.
+radii_m = np.linspace( 0.004, 0.012, 9 )[:, None]
+turns 	= np.array([ 20, 40, 60, 82, 100 ])[None, :]
+
+start 	= time.perf_counter()
+sweep 	= coil_field_set( thetas_d, r, radii_m, turns, coil_length_m )
+elapsed = time.perf_counter() - start
+print( "design sweep: %d geometries in %.1f ms" % ( radii_m.size*turns.size, elapsed*1e3 ) )
+
+
+##############################################
+#### CHECKS ##################################
+##############################################
+
+trusted 	= [ thetas_d.index( t ) for t in trusted_d ]
+spread 		= np.nanstd( gain, axis = 1 ) / np.nanmean( gain, axis = 1 )
+median_err 	= np.nanmedian( gamma_err_d, axis = 1 )
+# Each line's magnitudes brought to FEMM's by its median gain, so that only the shape is compared.
+B_scaled 	= B_coil * np.nanmedian( gain, axis = 1 )[:, None]
+lobe_scaled = guaranteed_lobe( B_scaled, gamma_coil_r, r_m, thetas_d, alphas_d, phis_d, B_scaled[0][lines_n-1] ).guar_lobe
+lobe_ratio 	= lobe_scaled / lobe_femm
+print( "guar_lobe analytic scaled by the gain / FEMM: ", np.round( lobe_ratio, 3 ) )
+
+failures = []
+if np.abs( lobe_coil - reference_lobe ).max() > tolerance:
+	failures.append( "the analytic guar_lobe drifted from the reference: %s" % np.round( lobe_coil, 4 ) )
+for i in trusted:
+	if spread[i] > max_gain_spread:
+		failures.append( "gain spread %.3f at theta = %d deg (max %g)" % ( spread[i], thetas_d[i], max_gain_spread ) )
+	if median_err[i] > max_gamma_err_d:
+		failures.append( "median gamma error %.2f deg at theta = %d deg (max %g)" % ( median_err[i], thetas_d[i], max_gamma_err_d ) )
+if np.abs( lobe_ratio - 1 ).max() > max_lobe_ratio_err:
+	failures.append( "scaled lobe ratio to FEMM %s (max error %g)" % ( np.round( lobe_ratio, 3 ), max_lobe_ratio_err ) )
+if failures:
+	sys.exit( "\n".join( failures ) )
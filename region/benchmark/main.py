@@ -0,0 +1,259 @@
+'''
+Benchmark and golden-output checks of the region pipeline.
+
+Golden checks: the guar_lobe (and resizing) of the shipped max_guaranteed_region/data and the lobes of
+measurement_vs_simulation must match golden.json, recorded from the baseline scripts. The outputs changed on
+purpose (the detected near-field skip, the fine phi sweep) are listed apart there, with their reasons. The
+campaign summary of measured.csv alone must match compare(), the guaranteed volume must not depend on psi
+along the reader's axis, and the spline basis of the plots the spline of
+each lobe, to 1e-14.
+
+Benchmark: the stages of the pipeline on synthetic dipole fields of every combination of --radial samples and
+--angles (uniform from 0 to 90 deg), with the reader rotated in 15 deg steps and 3 tag orientations. Wall time and
+peak allocations (tracemalloc, which sees the NumPy buffers) are reported per stage. Stages whose largest array
+would exceed --max-mb, and loader runs over --max-rows text rows, are skipped.
+
+	/region$ python benchmark/main.py [--golden-only] [--radial 100 1000 ...] [--angles 7 91 ...] [--json report.json]
+The exit code is 1 if a golden check fails.
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+
+# The shared compute code lives in region/lfwu
+sys.path.insert( 0, os.path.join( HERE, '..' ) )
+from lfwu.campaigns import load_campaigns, summarize
+from lfwu.engine import deg_2_rad, field_module_angle, rotate_reader, project_on_tag, last_crossing, lobe_curve
+from lfwu.field_cache import load_field_set
+from lfwu.fitting import decay, fit_decay, near_field_cutoff
+from lfwu.measurement import measured_lobe, field_directions, compare
+from lfwu.region import field_set, guaranteed_region
+from lfwu.volume import field_volume
+
+
+PHIS_D 		= [ 0, 45, 90 ]
+ALPHA_STEP 	= 15 		# Rotation step of the reader, in degrees.
+CURVE_N 	= 100 		# Thresholds of the threshold-curve stage.
+
+STAGES 		= [ 'load (parse)', 'load (cached)', 'module and angle', 'rotating the reader', 'rotating the tag', 'threshold',
+	'time flattening + min', 'threshold curve (%d Bth)' % CURVE_N, 'near-field cutoff', 'fit decay', 'get_lobe',
+	'lobe smoothing (spline)', 'measured directions' ]
+
+
+##############################################
+#### GOLDEN CHECKS ###########################
+##############################################
+
+def _close( name, value, golden, failures, rtol = 1e-12 ):
+	if not np.allclose( value, golden, rtol = rtol, atol = 0 ):
+		failures.append( "%s: %s != %s" % ( name, np.asarray( value ).tolist(), golden ) )
+
+def golden_checks():
+	'''
+	Returns the list of failed checks (empty if all passed).
+	'''
+	with open( os.path.join( HERE, 'golden.json' ) ) as f:
+		golden = json.load( f )
+	failures 	= []
+	( rtol, fit_rtol ) = ( golden['rtol'], golden['fit_rtol'] )
+	base 		= golden['region']
+	now 		= { k: v['value'] for ( k, v ) in golden['intentional'].items() if not k.startswith( '_' ) }
+
+	field 	= field_set( os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ) )
+	region 	= guaranteed_region( field )
+	for key in [ 'guar_lobe', 'guar_lobe_real', 'Bth' ]:
+		_close( 'region.' + key, getattr( region, key ), base[key], failures, rtol )
+	# The baseline's fit, with its hard-coded skip.
+	( A, _ ) = fit_decay( region.r_m[base['skip']:], region.B[0][base['skip']:] )
+	_close( 'region.A (skip %d)' % base['skip'], A, base['A'], failures, fit_rtol )
+	_close( 'region.Bth_real (skip %d)' % base['skip'], decay( region.max_dist_m, A ), base['Bth_real'], failures, fit_rtol )
+
+	_close( 'region.skip', region.skip, now['region.skip'], failures, rtol )
+	_close( 'region.A', region.A, now['region.A'], failures, rtol )
+	_close( 'region.Bth_real', decay( region.max_dist_m, region.A ), now['region.Bth_real'], failures, rtol )
+
+	region 	= guaranteed_region( field, phi_step_d = 0.1 )
+	for key in [ 'guar_lobe', 'worst_phi_d' ]:
+		_close( 'region_phi_step_0.1.' + key, getattr( region, key ), now['region_phi_step_0.1.' + key], failures, rtol )
+
+	folder 	= os.path.join( HERE, '..', 'measurement_vs_simulation' )
+	comp 	= compare( os.path.join( folder, 'measured.csv' ), os.path.join( folder, 'simulated.csv' ) )
+	_close( 'compare.lobe_meas', comp.meas.lobe, golden['compare']['lobe_meas'], failures, fit_rtol )
+	_close( 'compare.lobe_sim', comp.sim.lobe, golden['compare']['lobe_sim'], failures, fit_rtol )
+	_close( 'compare.Vth_max_dist_vpp', comp.meas.th_max_dist, golden['compare']['Vth_max_dist_vpp'], failures, fit_rtol )
+
+	# A single campaign of the same file must give what compare() gives.
+	table 	= summarize( load_campaigns( [ os.path.join( folder, 'measured.csv' ) ], os.path.join( folder, 'simulated.csv' ) ) )[0]
+	_close( 'campaigns.lobe', table['lobe'], comp.meas.lobe.tolist(), failures, rtol )
+	_close( 'campaigns.Vth_max_dist', table['Vth_max_dist'], comp.meas.th_max_dist, failures, rtol )
+	_close( 'campaigns.A_ratio', table['A_ratio'], ( comp.meas.A / comp.sim.A ).tolist(), failures, rtol )
+	_close( 'campaigns.lobe_max_err', table['lobe_max_err'], np.abs( comp.meas.lobe - comp.sim.lobe ).max(), failures, rtol )
+
+	# Along the reader's axis (theta = 0 and 180 deg) every psi is the same point.
+	volume = field_volume( field )
+	for row in ( 0, -1 ):
+		if np.ptp( volume.r_max[row] ) > 0:
+			failures.append( "volume.r_max at theta = %g deg depends on psi: %s" % ( volume.thetas_d[row], volume.r_max[row].tolist() ) )
+
+	# The spline basis against the spline of each lobe, to the tolerance of lobe_basis().
+	from scipy.interpolate import make_interp_spline
+	from lfwu.plots import lobe_polar
+	for lobe in ( comp.meas.lobe, comp.sim.lobe, region.guar_lobe ):
+		angles_r 	= np.linspace( 0, np.pi/2, len( lobe ) )
+		( X_, Y_ ) 	= lobe_polar( angles_r, lobe )
+		if np.abs( Y_ - make_interp_spline( angles_r, lobe )( X_ ) ).max() > 1e-14*np.abs( lobe ).max():
+			failures.append( "lobe_basis: more than 1e-14 away from make_interp_spline" )
+	return failures
+
+
+##############################################
+#### SYNTHETIC DATA ##########################
+##############################################
+
+def synthetic_field( angles_n, radial_n, r_min = 0.004, r_max = 0.4 ):
+	'''
+	Components (B_et, B_er) of a unit dipole along the axis, shape (angles_n, radial_n), and the distances.
+	'''
+	thetas_r 	= np.linspace( 0, 90, angles_n )[:, None] * deg_2_rad
+	r_m 		= np.linspace( r_min, r_max, radial_n )
+	B_er 		= 2*np.cos( thetas_r ) / r_m**3
+	B_et 		= np.sin( thetas_r ) / r_m**3
+	return ( B_et, np.abs( B_er ), r_m )
+
+def write_exports( data_dir, thetas_d, r_m, B_et, B_er ):
+	# Same layout as the FEMM exports: r, |B|, re, im, tab separated.
+	for ( theta_d, b_et, b_er ) in zip( thetas_d, B_et, B_er ):
+		for ( name, values ) in ( ( 'norm_', b_et ), ( 'tan_', b_er ) ):
+			np.savetxt( os.path.join( data_dir, name + str( theta_d ) + 'deg.txt' ),
+				np.column_stack([ r_m, values, values, np.zeros_like( values ) ]), fmt = '%.8e', delimiter = '\t' )
+
+
+##############################################
+#### BENCHMARK ###############################
+##############################################
+
+def _measure( fn, *args ):
+	tracemalloc.start()
+	start 	= time.perf_counter()
+	out 	= fn( *args )
+	elapsed = time.perf_counter() - start
+	( _, peak ) = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return ( out, elapsed, peak )
+
+def benchmark_scale( angles_n, radial_n, max_bytes, max_rows ):
+	'''
+	Runs every stage for one synthetic scale. Returns a list of ( stage, seconds, peak bytes ), with None for the
+	skipped stages.
+	'''
+	rows 	= []
+	# The rotation index works on any unit, so the angles are given as grid indices: exact, whatever the step.
+	step 	= ( angles_n - 1 ) * ALPHA_STEP // 90 if ( angles_n - 1 ) * ALPHA_STEP % 90 == 0 else 1
+	thetas 	= list( range( angles_n ) )
+	alphas 	= thetas[::step]
+	size 	= len( PHIS_D ) * len( alphas ) * angles_n * radial_n * 8
+
+	def stage( name, fn, *args, cost = 0 ):
+		if cost > max_bytes:
+			rows.append( ( name, None, None ) )
+			return None
+		( out, elapsed, peak ) = _measure( fn, *args )
+		rows.append( ( name, elapsed, peak ) )
+		return out
+
+	# The field, its module and its angle must fit to run anything at this scale.
+	if 4 * angles_n * radial_n * 8 > max_bytes:
+		return [ ( name, None, None ) for name in STAGES ]
+	( B_et, B_er, r_m ) = synthetic_field( angles_n, radial_n )
+
+	if 2*angles_n*radial_n <= max_rows:
+		with tempfile.TemporaryDirectory() as data_dir:
+			thetas_d = [ round( t, 6 ) for t in np.linspace( 0, 90, angles_n ) ]
+			write_exports( data_dir, thetas_d, r_m, B_et, B_er )
+			stage( 'load (parse)', load_field_set, data_dir, thetas_d, None, False )
+			stage( 'load (cached)', lambda: np.asarray( load_field_set( data_dir, thetas_d ).B_et ).sum() )
+	else:
+		rows += [ ( name, None, None ) for name in STAGES[0:2] ]
+
+	( B, gamma_r ) 	= stage( 'module and angle', field_module_angle, B_et, B_er, cost = 2*B_et.nbytes )
+	rotated 		= stage( 'rotating the reader', rotate_reader, B, gamma_r, thetas, alphas, cost = size // len( PHIS_D ) * 2 )
+	if rotated is not None:
+		B_rot_tag 	= stage( 'rotating the tag', project_on_tag, rotated[0], rotated[1], PHIS_D, cost = size*2 )
+		if B_rot_tag is not None:
+			crossing = stage( 'threshold', last_crossing, B_rot_tag, B[0][-1], cost = size )
+			lobe 	 = stage( 'time flattening + min', lambda: r_m[ crossing ].max( axis = 1 ).min( axis = 0 ) )
+			del B_rot_tag
+		else:
+			rows += [ ( name, None, None ) for name in STAGES[5:7] ]
+		stage( 'threshold curve (%d Bth)' % CURVE_N, lobe_curve, rotated[0], rotated[1], r_m, PHIS_D, B[0][-1]*np.geomspace( 0.1, 10, CURVE_N ), cost = size*3 )
+		del rotated
+	else:
+		rows += [ ( name, None, None ) for name in STAGES[4:8] ]
+
+	stage( 'near-field cutoff', near_field_cutoff, r_m, B, cost = 6*B.nbytes )
+	stage( 'fit decay', fit_decay, r_m, B, cost = 2*B.nbytes )
+	stage( 'get_lobe', measured_lobe, np.tile( r_m, angles_n ), B.ravel(), 5, angles_n, radial_n, cost = 4*B.nbytes )
+	stage( 'lobe smoothing (spline)', _spline, angles_n, len( PHIS_D ) * len( alphas ) )
+	stage( 'measured directions', field_directions, np.repeat( np.linspace( 0, np.pi/2, angles_n ), radial_n ), B_et.ravel(), B_er.ravel(), cost = 4*B.nbytes )
+	return rows
+
+def _spline( angles_n, lobes_n = 1 ):
+	# Every lobe of a figure at once, as plot_region() does. The first call at each angles_n builds the basis.
+	from lfwu.plots import lobe_polar
+	angles_r = np.linspace( 0, np.pi/2, angles_n )
+	return lobe_polar( angles_r, 1 + 0.1*np.cos( angles_r )*np.linspace( 0.5, 1, lobes_n )[:, None] )
+
+
+##############################################
+#### COMMAND LINE ############################
+##############################################
+
+def main( argv = None ):
+	parser = argparse.ArgumentParser( description = __doc__.split('\n')[1] )
+	parser.add_argument( '--golden-only', action = 'store_true', help = 'only run the golden checks' )
+	parser.add_argument( '--radial', type = int, nargs = '+', default = [ 100, 1000, 10000, 100000, 1000000 ] )
+	parser.add_argument( '--angles', type = int, nargs = '+', default = [ 7, 91, 901, 3601 ] )
+	parser.add_argument( '--max-mb', type = float, default = 1024, help = 'skip the stages whose largest arrays exceed this' )
+	parser.add_argument( '--max-rows', type = int, default = 2000000, help = 'skip the loader beyond this number of text rows' )
+	parser.add_argument( '--json', default = None, help = 'write the results to this file' )
+	args = parser.parse_args( argv )
+
+	failures = golden_checks()
+	print( "golden checks: %s" % ( 'passed' if not failures else 'FAILED' ) )
+	for failure in failures:
+		print( "\t" + failure )
+	report = { 'golden_failures': failures, 'scales': [] }
+
+	if not args.golden_only:
+		_spline( 7 ) 	# So that scipy's import is not timed.
+		print( "%8s %9s  %-28s %12s %12s" % ( 'angles', 'radial', 'stage', 'time (ms)', 'peak (MB)' ) )
+		for angles_n in args.angles:
+			for radial_n in args.radial:
+				rows = benchmark_scale( angles_n, radial_n, args.max_mb * 2**20, args.max_rows )
+				if all( elapsed is None for ( _, elapsed, _ ) in rows ):
+					continue
+				for ( name, elapsed, peak ) in rows:
+					if elapsed is None:
+						print( "%8d %9d  %-28s %12s %12s" % ( angles_n, radial_n, name, 'skipped', '' ) )
+					else:
+						print( "%8d %9d  %-28s %12.2f %12.2f" % ( angles_n, radial_n, name, elapsed*1e3, peak / 2**20 ) )
+				report['scales'].append({ 'angles': angles_n, 'radial': radial_n,
+					'stages': [ { 'stage': name, 'seconds': elapsed, 'peak_bytes': peak } for ( name, elapsed, peak ) in rows ] })
+
+	if args.json:
+		with open( args.json, 'w' ) as f:
+			json.dump( report, f, indent = 1 )
+	return 1 if failures else 0
+
+
+if __name__ == '__main__':
+	sys.exit( main() )
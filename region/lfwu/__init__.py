@@ -0,0 +1,27 @@
+'''
+Shared compute code for the region scripts (max_guaranteed_region and
+measurement_vs_simulation). Only NumPy is imported; the figures are in
+lfwu.plots and the command line in python -m lfwu.
+'''
+
+from .loader import read_columns, load_field_profile, load_measured, load_simulated
+from .field_cache import FieldSet, load_field_set
+from .engine import LobeResult, SweepResult, field_module_angle, rotate_reader, tag_projection, project_on_tag, last_crossing, guaranteed_lobe, guaranteed_lobe_sweep, phi_grid, \
+	lobe_from_rotation, sweep_from_rotation, suffix_max, crossing_curve, lobe_curve
+from .rotation import RotationTable, rotation_table, field_at, rotate_reader_continuous
+from .fitting import decay, decay_inv, fit_decay, Cutoff, near_field_cutoff
+from .femm import AnsSolution, MeshField, iter_ans, read_ans, mesh_field, locate, field_at_points, field_set_from_ans
+from .loop_coil import mu_0, ellipke, loop_field, coil_field, coil_field_set
+from .runner import param_grid, run_grid, table_dtype, write_table
+from .stage_cache import StageCache, cached
+from .region import Region, field_set, guaranteed_region
+from .volume import Volume, orientation_grid, solid_angles, field_vectors, swept_field, guaranteed_volume, field_volume, cross_section
+from .lookup import LookupTable, build_lookup, save_lookup, load_lookup, lookup_r_max, lookup_guar_lobe, is_guaranteed
+from .herd import Herd, ReaderPath, ReaderPass, GridIndex, random_herd, serpentine, reader_path, grid_index, grid_candidates, reach, reader_pass, field_reader_pass
+from .ble import Advertising, Scanner, Reception, airtime, beacon_advertising, collisions, reception
+from .lifetime import CurrentProfile, NRF52840_PROFILE, Battery, Lifetime, coin_cell, event_charge, wake_charge, pass_wake_stats, scheduled_wakes, trace_wakes, \
+	depletion_time, fleet_lifetime, trace_lifetime
+from .measurement import MeasuredLobe, Comparison, measured_lobe, field_directions, compare
+from .campaigns import Campaigns, campaign_paths, load_campaigns, summary_dtype, angle_errors, summarize, write_summary
+from .uncertainty import Interval, LobeBootstrap, interval, bootstrap_fits, bootstrap_lobe, bootstrap_guar_lobe
+from . import profiling
@@ -0,0 +1,298 @@
+'''
+Command line entry point, from region/:
+	python -m lfwu region [--data-dir DIR] [--lines-n N] [--phis 0 45 90] ... [--no-plot] [--svg PATH] [--json]
+	python -m lfwu volume [--data-dir DIR] [--max-tilt 90] [--theta-step 10] ... [--no-plot] [--svg PATH] [--json]
+	python -m lfwu lookup TABLE [--build [--data-dir DIR] ...] [--theta 30] [--phi 45] [--dist 2.5] [--bth B] [--json]
+	python -m lfwu compare [--measured CSV] [--simulated CSV] [--no-plot] [--svg PATH] [--json]
+	python -m lfwu herd [--tags N] [--pen 50 20] [--lane 10] [--speeds 0.5 1 2] [--json]
+	python -m lfwu ble [--tags 10 100 1000] [--trials 1000] [--scan-window 0.1] [--json]
+	python -m lfwu lifetime [--fleet 100000] [--passes-per-day 1] [--adv-duration 10] [--trace CSV] [--json]
+	python -m lfwu campaigns DIR [--simulated CSV] [--data-dir DIR] [--out SUMMARY.csv] [--json]
+With --no-plot neither matplotlib nor scipy are imported.
+'''
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+
+
+def _parser():
+	parser = argparse.ArgumentParser( prog = 'python -m lfwu', description = 'LF wake-up region computations.' )
+	commands = parser.add_subparsers( dest = 'command', required = True )
+
+	region = commands.add_parser( 'region', help = 'maximum guaranteed region (max_guaranteed_region/main.py)' )
+	region.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ), help = 'directory of the FEMM exports' )
+	region.add_argument( '--ans', default = None, help = 'sample the field from this FEMM solution instead' )
+	region.add_argument( '--lines-n', type = int, default = 100, help = 'number of lines used from the simulated values' )
+	region.add_argument( '--phis', type = float, nargs = '+', default = [ 0, 45, 90 ], help = 'tag orientations, in degrees' )
+	region.add_argument( '--max-dist', type = float, default = 5, help = 'max distance at which the tag woke up, in meters' )
+	region.add_argument( '--bth', type = float, default = None, help = 'threshold, in Tesla (default: the field on the axis at the last line)' )
+	region.add_argument( '--phi-step', type = float, default = 0, help = 'step of the fine sweep over the tag orientations, in degrees' )
+	region.add_argument( '--alpha-steps', type = int, default = 0, help = 'time steps of the continuous rotation of the reader' )
+	region.add_argument( '--pivot', type = float, default = 0.5, help = 'distance from the pivot to the coil, in meters' )
+	region.add_argument( '--cache', default = None, help = 'keep the results of each stage in this directory and reuse the unchanged ones' )
+	region.add_argument( '--cache-mb', type = float, default = 256, help = 'size bound of the stage cache, least recently used entries are evicted' )
+
+	volume = commands.add_parser( 'volume', help = '3D guaranteed volume, tag orientations over the sphere (lfwu/volume.py)' )
+	volume.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ), help = 'directory of the FEMM exports' )
+	volume.add_argument( '--lines-n', type = int, default = 100, help = 'number of lines used from the simulated values' )
+	volume.add_argument( '--max-dist', type = float, default = 5, help = 'max distance at which the tag woke up, in meters' )
+	volume.add_argument( '--bth', type = float, default = None, help = 'threshold, in Tesla (default: the field on the axis at the last line)' )
+	volume.add_argument( '--theta-step', type = float, default = 10, help = 'step of the tag positions from the reader axis, in degrees' )
+	volume.add_argument( '--psi-step', type = float, default = 10, help = 'step of the tag positions about the reader axis, in degrees' )
+	volume.add_argument( '--tilt-step', type = float, default = 15, help = 'step of the tag orientations over the sphere, in degrees' )
+	volume.add_argument( '--max-tilt', type = float, default = 90, help = 'max tilt of the tag axis out of the swing plane, in degrees' )
+	volume.add_argument( '--alpha-step', type = float, default = 15, help = 'time step of the reader swing from 0 to 90 deg, in degrees' )
+	volume.add_argument( '--pivot', type = float, default = 0.5, help = 'distance from the pivot to the coil, in meters' )
+	volume.add_argument( '--sections', type = float, nargs = '+', default = [ 0, 90 ], help = 'azimuths of the meridian sections, in degrees' )
+	volume.add_argument( '--max-mb', type = float, default = 256, help = 'bound of the arrays of each evaluated chunk' )
+
+	lookup = commands.add_parser( 'lookup', help = 'build or query a guaranteed-lobe lookup table (lfwu/lookup.py)' )
+	lookup.add_argument( 'table', help = 'the .npz table file' )
+	lookup.add_argument( '--build', action = 'store_true', help = 'build the table (from --data-dir) and save it first' )
+	lookup.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ), help = 'directory of the FEMM exports' )
+	lookup.add_argument( '--lines-n', type = int, default = 100, help = 'number of lines used from the simulated values' )
+	lookup.add_argument( '--max-dist', type = float, default = 5, help = 'max distance at which the tag woke up, in meters' )
+	lookup.add_argument( '--theta-step', type = float, default = 1, help = 'step of the table over the tag angle, in degrees' )
+	lookup.add_argument( '--phi-step', type = float, default = 1, help = 'step of the table over the tag orientation, in degrees' )
+	lookup.add_argument( '--theta', type = float, nargs = '+', default = [], help = 'tag angles to query, in degrees' )
+	lookup.add_argument( '--phi', type = float, default = None, help = 'tag orientation to query, in degrees (default: any)' )
+	lookup.add_argument( '--dist', type = float, default = None, help = 'also tell whether the wake-up is guaranteed at this distance, in meters' )
+	lookup.add_argument( '--bth', type = float, default = None, help = 'threshold, in Tesla (default: the middle of the table)' )
+	lookup.add_argument( '--json', action = 'store_true', help = 'print the results as json' )
+	lookup.add_argument( '--profile', default = None, help = "write a per-stage time and memory report to this file ('-' for stderr)" )
+
+	compare = commands.add_parser( 'compare', help = 'measurement vs simulation (measurement_vs_simulation/main.py)' )
+	compare.add_argument( '--measured', default = os.path.join( HERE, '..', 'measurement_vs_simulation', 'measured.csv' ) )
+	compare.add_argument( '--simulated', default = os.path.join( HERE, '..', 'measurement_vs_simulation', 'simulated.csv' ) )
+	compare.add_argument( '--max-dist', type = float, default = 5, help = 'max distance at which the tag woke up, in meters' )
+	compare.add_argument( '--bootstrap', type = int, default = 0, help = 'confidence intervals of the lobes from this many resampled fits' )
+	compare.add_argument( '--method', default = 'residuals', choices = [ 'residuals', 'pairs', 'parametric' ], help = 'resampling of the fits' )
+	compare.add_argument( '--level', type = float, default = 0.95, help = 'confidence level of the intervals' )
+	compare.add_argument( '--workers', type = int, default = 1, help = 'processes for the resampling' )
+	compare.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ),
+		help = 'FEMM exports for the interval of the guaranteed lobe, with the threshold moved by the 0 deg fit' )
+
+	herd = commands.add_parser( 'herd', help = 'reader passes over a herd, read ratio vs walking speed (lfwu/herd.py)' )
+	herd.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ), help = 'directory of the FEMM exports' )
+	herd.add_argument( '--lines-n', type = int, default = 100, help = 'number of lines used from the simulated values' )
+	herd.add_argument( '--max-dist', type = float, default = 5, help = 'max distance at which the tag woke up, in meters' )
+	herd.add_argument( '--bth', type = float, default = None, help = 'threshold, in Tesla (default: the field on the axis at the last line)' )
+	herd.add_argument( '--tags', type = int, default = 1000, help = 'number of tags, at random positions and orientations' )
+	herd.add_argument( '--pen', type = float, nargs = 2, default = [ 50, 20 ], help = 'size of the pen, in meters' )
+	herd.add_argument( '--lane', type = float, default = 10, help = 'distance between the lanes the handler walks, in meters' )
+	herd.add_argument( '--speeds', type = float, nargs = '+', default = [ 0.5, 1, 1.5, 2 ], help = 'walking speeds, in m/s' )
+	herd.add_argument( '--dt', type = float, default = 0.05, help = 'time step, in seconds' )
+	herd.add_argument( '--swing', type = float, default = 90, help = 'amplitude of the swing, in degrees' )
+	herd.add_argument( '--swing-period', type = float, default = 1, help = 'period of the swing, in seconds' )
+	herd.add_argument( '--aim', type = float, default = -45, help = 'start of the swing from the walking direction, in degrees' )
+	herd.add_argument( '--pivot', type = float, default = 0.5, help = 'distance from the pivot to the coil, in meters' )
+	herd.add_argument( '--seed', type = int, default = None, help = 'seed of the random herd' )
+	herd.add_argument( '--json', action = 'store_true', help = 'print the results as json' )
+	herd.add_argument( '--profile', default = None, help = "write a per-stage time and memory report to this file ('-' for stderr)" )
+
+	ble = commands.add_parser( 'ble', help = 'reception of the advertisements of many tags woken up at once (lfwu/ble.py)' )
+	ble.add_argument( '--tags', type = int, nargs = '+', default = [ 10, 100, 1000 ], help = 'numbers of tags woken up together' )
+	ble.add_argument( '--trials', type = int, default = 1000, help = 'Monte Carlo trials' )
+	ble.add_argument( '--horizon', type = float, default = 2, help = 'time each tag advertises after its wake-up, in seconds' )
+	ble.add_argument( '--wake-spread', type = float, default = 0, help = 'the wake-ups are uniform over this time, in seconds' )
+	ble.add_argument( '--interval', type = float, default = 0.1, help = 'advertising interval, in seconds (NON_CONNECTABLE_ADV_INTERVAL)' )
+	ble.add_argument( '--scan-interval', type = float, default = 0.1, help = 'scan interval of the reader, in seconds' )
+	ble.add_argument( '--scan-window', type = float, default = 0.1, help = 'scan window of the reader, in seconds' )
+	ble.add_argument( '--p-rx', type = float, default = 1, help = 'probability of receiving a packet without collision' )
+	ble.add_argument( '--workers', type = int, default = 1, help = 'processes for the trials' )
+	ble.add_argument( '--seed', type = int, default = None, help = 'seed of the trials' )
+	ble.add_argument( '--json', action = 'store_true', help = 'print the results as json' )
+	ble.add_argument( '--profile', default = None, help = "write a per-stage time and memory report to this file ('-' for stderr)" )
+
+	lifetime = commands.add_parser( 'lifetime', help = 'battery lifetime of a fleet from its wake-ups (lfwu/lifetime.py)' )
+	lifetime.add_argument( '--fleet', type = int, default = 100000, help = 'number of tags' )
+	lifetime.add_argument( '--trace', default = None, help = 'csv of logged wake-ups ( tag, time in s ) instead of the reader passes' )
+	lifetime.add_argument( '--trace-days', type = float, default = 365, help = 'time covered by the trace, repeated until the batteries are empty' )
+	lifetime.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ), help = 'directory of the FEMM exports' )
+	lifetime.add_argument( '--pen-tags', type = int, default = 1000, help = 'tags of the simulated pen, sampled for the fleet' )
+	lifetime.add_argument( '--pen', type = float, nargs = 2, default = [ 50, 20 ], help = 'size of the pen, in meters' )
+	lifetime.add_argument( '--lane', type = float, default = 10, help = 'distance between the lanes the handler walks, in meters' )
+	lifetime.add_argument( '--speed', type = float, default = 1, help = 'walking speed, in m/s' )
+	lifetime.add_argument( '--pass-samples', type = int, default = 4, help = 'passes simulated, the animals placed again each time' )
+	lifetime.add_argument( '--passes-per-day', type = float, default = 1, help = 'reader passes over the pen per day' )
+	lifetime.add_argument( '--false-wakes-per-day', type = float, default = 0, help = 'wake-ups by anything but the reader, per day' )
+	lifetime.add_argument( '--adv-duration', type = float, default = 10, help = 'advertising time after each wake-up, in seconds' )
+	lifetime.add_argument( '--capacity-mah', type = float, default = 225, help = 'battery capacity, in mAh' )
+	lifetime.add_argument( '--sleep-ua', type = float, default = 2, help = 'current between wake-ups, in uA' )
+	lifetime.add_argument( '--seed', type = int, default = None, help = 'seed of the herd and the wake-ups' )
+	lifetime.add_argument( '--json', action = 'store_true', help = 'print the results as json' )
+	lifetime.add_argument( '--profile', default = None, help = "write a per-stage time and memory report to this file ('-' for stderr)" )
+
+	campaigns = commands.add_parser( 'campaigns', help = 'every measured csv of a directory vs the simulation, in one summary (lfwu/campaigns.py)' )
+	campaigns.add_argument( 'directory', help = 'directory of the campaigns, in the measured.csv format' )
+	campaigns.add_argument( '--pattern', default = '*.csv', help = 'file names of the campaigns in the directory' )
+	campaigns.add_argument( '--simulated', default = os.path.join( HERE, '..', 'measurement_vs_simulation', 'simulated.csv' ) )
+	campaigns.add_argument( '--data-dir', default = os.path.join( HERE, '..', 'max_guaranteed_region', 'data' ),
+		help = 'FEMM exports for the simulated field angle (empty: no angle errors)' )
+	campaigns.add_argument( '--max-dist', type = float, default = 5, help = 'max distance at which the tag woke up, in meters' )
+	campaigns.add_argument( '--tol', type = float, default = 0.5, help = 'largest distance between a measured point and its simulated one, in cm' )
+	campaigns.add_argument( '--out', default = None, help = 'write the summary table to this csv' )
+	campaigns.add_argument( '--json', action = 'store_true', help = 'print the results as json' )
+	campaigns.add_argument( '--profile', default = None, help = "write a per-stage time and memory report to this file ('-' for stderr)" )
+
+	for command in ( region, volume, compare ):
+		command.add_argument( '--no-plot', action = 'store_true', help = 'batch mode: compute and print only' )
+		command.add_argument( '--svg', default = None, help = 'save the figure to this file' )
+		command.add_argument( '--no-show', action = 'store_true', help = 'do not open the figure window' )
+		command.add_argument( '--json', action = 'store_true', help = 'print the results as json' )
+		command.add_argument( '--profile', default = None, help = "write a per-stage time and memory report to this file ('-' for stderr)" )
+	return parser
+
+
+def _print( results, as_json ):
+	if as_json:
+		print( json.dumps( { k: np.asarray( v ).tolist() for ( k, v ) in results.items() } ) )
+	else:
+		for ( k, v ) in results.items():
+			print( "%s: \t%s" % ( k, v ) )
+
+
+def main( argv = None ):
+	args = _parser().parse_args( argv )
+	if args.profile:
+		from . import profiling
+		profiling.enable( args.profile )
+
+	if args.command == 'region':
+		from .region import field_set, guaranteed_region
+		cache = None
+		if args.cache:
+			from .stage_cache import StageCache
+			cache = StageCache( args.cache, int( args.cache_mb * 2**20 ) )
+		field 	= field_set( args.data_dir, lines_n = args.lines_n, ans_file = args.ans, cache = cache )
+		result 	= guaranteed_region( field, args.lines_n, args.phis, args.max_dist, args.bth, args.phi_step, args.alpha_steps, args.pivot, cache = cache )
+		results = { 'guar_lobe': result.guar_lobe, 'guar_lobe_real': result.guar_lobe_real, 'Bth': result.Bth, 'near_field_cutoff': result.r_m[result.skip] }
+		if result.worst_phi_d is not None:
+			results['worst_phi_d'] = result.worst_phi_d
+		if not args.no_plot:
+			from .plots import plot_region
+			plot_region( result, args.svg, not args.no_show )
+	elif args.command == 'volume':
+		from .region import field_set
+		from .volume import field_volume, cross_section
+		field 	= field_set( args.data_dir, lines_n = args.lines_n )
+		result 	= field_volume( field, args.lines_n, args.max_dist, args.bth, args.theta_step, args.psi_step, args.tilt_step, args.max_tilt,
+			args.alpha_step, args.pivot, int( args.max_mb * 2**20 ) )
+		results = { 'volume_m3': result.volume, 'orientations': len( result.normals ) }
+		for psi_d in args.sections:
+			( angles_d, r_max ) = cross_section( result, psi_d )
+			results['section_%g_angles_d' % psi_d] = angles_d
+			results['section_%g_m' % psi_d] = r_max
+		if not args.no_plot:
+			from .plots import plot_volume
+			plot_volume( result, args.svg, not args.no_show, args.sections )
+	elif args.command == 'lookup':
+		from .lookup import build_lookup, save_lookup, load_lookup, lookup_r_max, lookup_guar_lobe
+		if args.build:
+			from .region import field_set
+			table = build_lookup( field_set( args.data_dir, lines_n = args.lines_n ), args.lines_n, args.max_dist, args.theta_step, args.phi_step )
+			save_lookup( args.table, table )
+		table 	= load_lookup( args.table )
+		results = { 'Bth_range': [ float( table.Bths[0] ), float( table.Bths[-1] ) ] }
+		if args.theta:
+			if args.phi is None:
+				r_max = lookup_guar_lobe( table, args.theta, args.bth )
+			else:
+				r_max = lookup_r_max( table, args.theta, args.phi, args.bth )
+			results['r_max_m'] = r_max
+			if args.dist is not None:
+				results['guaranteed'] = args.dist <= r_max
+	elif args.command == 'herd':
+		from .region import field_set
+		from .herd import random_herd, serpentine, reader_path, field_reader_pass
+		field 	= field_set( args.data_dir, lines_n = args.lines_n )
+		tags 	= random_herd( args.tags, args.pen, seed = args.seed )
+		results = { 'speeds_mps': args.speeds, 'read_ratio': [], 'pass_s': [], 'median_wake_s': [] }
+		for speed in args.speeds:
+			path 	= reader_path( serpentine( args.pen, args.lane ), speed, args.dt, args.swing, args.swing_period, args.aim, pivot_dist_m = args.pivot )
+			result 	= field_reader_pass( field, tags, path, args.lines_n, args.max_dist, args.bth )
+			results['read_ratio'].append( float( result.woken.mean() ) )
+			results['pass_s'].append( float( path.t_s[-1] ) )
+			results['median_wake_s'].append( float( np.median( result.wake_t_s[result.woken] ) ) if result.woken.any() else None )
+	elif args.command == 'ble':
+		from .ble import Scanner, beacon_advertising, reception
+		advertising = beacon_advertising( args.interval )
+		results 	= { 'tags': args.tags, 'read_ratio': [], 'collided': [], 'first_read_median_s': [], 'first_read_p90_s': [] }
+		for n in args.tags:
+			wake_s 	= np.random.default_rng( args.seed ).uniform( 0, args.wake_spread, n )
+			result 	= reception( n, args.trials, advertising, Scanner( args.scan_interval, args.scan_window ), args.horizon, wake_s, args.p_rx,
+				args.seed, workers = args.workers )
+			read 	= result.first_read_s[ np.isfinite( result.first_read_s ) ]
+			results['read_ratio'].append( float( result.read_ratio.mean() ) )
+			results['collided'].append( float( result.collided.mean() ) )
+			results['first_read_median_s'].append( float( np.median( read ) ) if len( read ) else None )
+			results['first_read_p90_s'].append( float( np.percentile( read, 90 ) ) if len( read ) else None )
+	elif args.command == 'lifetime':
+		from .lifetime import NRF52840_PROFILE, coin_cell, pass_wake_stats, fleet_lifetime, trace_lifetime
+		profile = NRF52840_PROFILE._replace( sleep_a = args.sleep_ua * 1e-6 )
+		battery = coin_cell( args.capacity_mah )
+		if args.trace:
+			from .loader import read_columns
+			( tags, times_s ) 	= read_columns( args.trace, 2, sep = ',' )
+			result 				= trace_lifetime( tags.astype( int ), times_s, args.fleet, args.trace_days * 86400, adv_duration_s = args.adv_duration,
+				profile = profile, battery = battery )
+		else:
+			from .region import field_set
+			from .herd import random_herd, serpentine, reader_path, field_reader_pass
+			field 	= field_set( args.data_dir )
+			path 	= reader_path( serpentine( args.pen, args.lane ), args.speed )
+			seeds 	= np.random.SeedSequence( args.seed ).spawn( args.pass_samples + 1 )
+			passes 	= [ field_reader_pass( field, random_herd( args.pen_tags, args.pen, seed = s ), path ) for s in seeds[1:] ]
+			( probability, wakes_per_pass ) = pass_wake_stats( passes, args.adv_duration )
+			# Each tag of the fleet behaves as a tag of the simulated pen.
+			pick 	= np.random.default_rng( seeds[0] ).integers( 0, args.pen_tags, args.fleet )
+			result 	= fleet_lifetime( probability[pick], wakes_per_pass[pick], args.passes_per_day, args.false_wakes_per_day, args.adv_duration, profile, battery,
+				seed = args.seed )
+		( p5, p50, p95 ) = np.percentile( result.years, [ 5, 50, 95 ] )
+		results = { 'years_p5': float( p5 ), 'years_median': float( p50 ), 'years_p95': float( p95 ), 'over_5_years': float( np.mean( result.years >= 5 ) ),
+			'wakes_per_day': float( result.wakes_per_day.mean() ), 'mean_current_ua': float( result.mean_current_a.mean() * 1e6 ) }
+	elif args.command == 'campaigns':
+		from .campaigns import campaign_paths, load_campaigns, summarize, write_summary
+		paths 	= campaign_paths( args.directory, args.pattern, exclude = [ args.simulated ] )
+		data 	= load_campaigns( paths, args.simulated, args.tol )
+		field 	= None
+		if args.data_dir:
+			from .region import field_set
+			field = field_set( args.data_dir )
+		table 	= summarize( data, args.max_dist, field = field )
+		if args.out:
+			write_summary( args.out, table, np.unique( data.t_r * 180/np.pi ).round( 6 ) )
+		results = { name: table[name] for name in table.dtype.names }
+	else:
+		from .measurement import compare
+		result 	= compare( args.measured, args.simulated, args.max_dist )
+		results = { 'lobe_meas': result.meas.lobe, 'lobe_sim': result.sim.lobe, 'Vth_max_dist_vpp': result.meas.th_max_dist, 'perr': result.meas.perr }
+		if args.bootstrap:
+			from .region import field_set
+			from .uncertainty import bootstrap_lobe, bootstrap_guar_lobe
+			options = dict( n = args.bootstrap, method = args.method, level = args.level, workers = args.workers )
+			for ( name, module ) in ( ( 'lobe_meas', result.m ), ( 'lobe_sim', result.m_sim ) ):
+				boot = bootstrap_lobe( result.r_m, module, args.max_dist, **options )
+				results[name + '_low'] 	= boot.lobe.low
+				results[name + '_high'] = boot.lobe.high
+				if name == 'lobe_meas':
+					results['Vth_max_dist_vpp_interval'] = [ float( boot.th_max_dist.low ), float( boot.th_max_dist.high ) ]
+					guar = bootstrap_guar_lobe( field_set( args.data_dir ), boot.A[:, 0], result.meas.A[0], level = args.level )
+					results.update( guar_lobe = guar.estimate, guar_lobe_low = guar.low, guar_lobe_high = guar.high )
+		if not args.no_plot:
+			from .plots import plot_comparison
+			plot_comparison( result, args.svg, not args.no_show )
+
+	_print( results, args.json )
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit( main() )
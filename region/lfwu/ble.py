@@ -0,0 +1,167 @@
+'''
+Reception of the BLE advertisements of many tags woken up at once.
+
+Once woken up, each tag runs software/main.c: non-connectable scannable advertising every
+NON_CONNECTABLE_ADV_INTERVAL, with the beacon (m_beacon_info) as manufacturer specific data. Every advertising
+event sends the same packet on the channels 37, 38 and 39, one after the other, and the link layer delays each
+event by a random advDelay of 0 to 10 ms. The scanner (the reader) listens to one channel at a time, a
+scan window every scan interval, going through the three channels. It scans passively: the scan responses (the
+device name) are never requested, but the advertiser still waits for a request after each packet.
+
+A packet is read if it is entirely inside a scan window on its channel and no other tag's packet overlaps it
+on that channel (no capture effect). The channels of an event are a fixed gap apart for every tag, so two
+packets overlap on channel 38 or 39 iff they do on 37: the collisions are found once on the event times. An
+event collides iff another one starts less than an airtime before or after it, which is found without sorting
+by putting the events in slots one airtime wide and keeping the first and last start of each slot.
+
+Every tag and trial is one array computation, in chunks of trials of at most about max_bytes (as the bootstrap of
+uncertainty.py, each chunk has its own random stream, so the result does not depend on how many processes run
+them).
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from .profiling import stage
+
+
+# From software/main.c.
+ADV_INTERVAL_S 		= 0.100 				# NON_CONNECTABLE_ADV_INTERVAL
+BEACON_INFO_LENGTH 	= 0x17 					# APP_BEACON_INFO_LENGTH, the size of m_beacon_info
+# Advertising data: the flags AD structure (length, type, flags) and the manufacturer specific data one
+# (length, type, company identifier, m_beacon_info).
+ADV_DATA_LENGTH 	= 3 + 2 + 2 + BEACON_INFO_LENGTH
+
+ADV_DELAY_MAX_S 	= 0.010 				# advDelay, drawn for every advertising event
+T_IFS_S 			= 150e-6 				# Inter frame space
+SCAN_REQ_LENGTH 	= 12 					# ScanA and AdvA
+
+
+# interval_s: 		Advertising interval.
+# adv_delay_max_s: 	The advDelay of each event is uniform from 0 to this.
+# airtime_s: 		Duration of each advertising packet.
+# channel_gap_s: 	Time from the start of the packet on a channel to the next one in the same event.
+Advertising = namedtuple( 'Advertising', [ 'interval_s', 'adv_delay_max_s', 'airtime_s', 'channel_gap_s' ] )
+
+# interval_s, window_s: 	The scanner listens window_s of every interval_s, each time on the next channel.
+Scanner = namedtuple( 'Scanner', [ 'interval_s', 'window_s' ] )
+
+# first_read_s: 	Time from each tag's wake-up to its first packet read, inf if none. Shape (trial, tag)
+# read_ratio: 		Fraction of the tags read within horizon_s, in each trial. Shape (trial,)
+# collided: 		Fraction of the advertising events that collided, in each trial. Shape (trial,)
+Reception = namedtuple( 'Reception', [ 'first_read_s', 'read_ratio', 'collided' ] )
+
+
+##############################################
+#### PACKETS #################################
+##############################################
+
+def airtime( pdu_payload_length, phy_mbps = 1 ):
+	'''
+	Time on air of a legacy advertising channel packet with pdu_payload_length bytes after the PDU header:
+	preamble, access address, header, payload and CRC. On the 2M PHY the preamble is 2 bytes.
+	'''
+	preamble = 1 if phy_mbps == 1 else 2
+	return ( preamble + 4 + 2 + pdu_payload_length + 3 ) * 8e-6 / phy_mbps
+
+def beacon_advertising( interval_s = ADV_INTERVAL_S, adv_data_length = ADV_DATA_LENGTH, adv_delay_max_s = ADV_DELAY_MAX_S, phy_mbps = 1 ):
+	'''
+	The Advertising of main.c: ADV_SCAN_IND packets (AdvA and the advertising data). Being scannable, after each
+	packet the advertiser listens for a SCAN_REQ before moving to the next channel.
+	'''
+	packet = airtime( 6 + adv_data_length, phy_mbps )
+	return Advertising( interval_s, adv_delay_max_s, packet, packet + T_IFS_S + airtime( SCAN_REQ_LENGTH, phy_mbps ) )
+
+
+##############################################
+#### COLLISIONS ##############################
+##############################################
+
+def collisions( starts_s, airtime_s ):
+	'''
+	Whether each packet overlaps another one of the same row (last axis), starts_s being their start times, all
+	packets lasting airtime_s. Shape of starts_s.
+	'''
+	starts 	= np.asarray( starts_s, dtype = float )
+	if not starts.size:
+		return np.zeros( starts.shape, dtype = bool )
+	rows 	= starts.reshape( -1, starts.shape[-1] )
+	slot 	= ( ( rows - rows.min( axis = 1, keepdims = True ) ) * ( 1 / airtime_s ) ).astype( np.int64 )
+	width 	= int( slot.max() ) + 3
+	# One range of slots per row, with an empty slot on each side.
+	slot 	+= 1 + np.arange( len( rows ) )[:, None]*width
+	flat 	= slot.ravel()
+	t 		= rows.ravel()
+
+	count 	= np.bincount( flat, minlength = len( rows )*width )
+	first 	= np.full( len( rows )*width, np.inf )
+	last 	= np.full( len( rows )*width, -np.inf )
+	np.minimum.at( first, flat, t )
+	np.maximum.at( last, flat, t )
+
+	# Another packet in the same slot always overlaps; in the slots next to it, only if it is close enough.
+	hit = ( count[flat] > 1 ) | ( t - last[flat - 1] < airtime_s ) | ( first[flat + 1] - t < airtime_s )
+	return hit.reshape( starts.shape )
+
+
+##############################################
+#### RECEPTION ###############################
+##############################################
+
+def _trials( wake_s, trials, advertising, scanner, events, p_rx, seed ):
+	# Reception of every tag in trials trials. Returns ( first_read_s (trial, tag), collided (trial,) ).
+	rng 	= np.random.default_rng( seed )
+	n 		= len( wake_s )
+	delays 	= rng.uniform( 0, advertising.adv_delay_max_s, ( trials, n, events ) )
+	starts 	= wake_s[:, None] + np.arange( events )*advertising.interval_s + np.cumsum( delays, axis = -1 )
+	hit 	= collisions( starts.reshape( trials, -1 ), advertising.airtime_s ).reshape( starts.shape )
+
+	# The scanner starts at a random point of its cycle: window k of the cycle listens to channel 37 + k. The
+	# packet on channel c is read if it fits in window c (past the end of the cycle it would be in window 0 of
+	# the next one, but those packets are not on channel 37).
+	offset 	= rng.uniform( 0, 3*scanner.interval_s, ( trials, 1, 1 ) )
+	phase 	= np.mod( starts + offset, 3*scanner.interval_s )
+	read 	= np.full( starts.shape, np.inf )
+	for channel in ( 2, 1, 0 ):
+		t 		= phase + channel*( advertising.channel_gap_s - scanner.interval_s )
+		ok 		= ( t >= 0 ) & ( t + advertising.airtime_s <= scanner.window_s ) & ~hit
+		if p_rx < 1:
+			ok &= rng.random( starts.shape ) < p_rx
+		# Going from the last channel to the first, the earliest packet read of each event is the one left.
+		read[ok] = channel*advertising.channel_gap_s
+	return ( ( starts + read ).min( axis = -1 ) - wake_s, hit.mean( axis = ( 1, 2 ) ) )
+
+def _trials_chunk( args ):
+	return _trials( *args )
+
+def reception( n_tags, trials = 1000, advertising = None, scanner = Scanner( 0.1, 0.1 ), horizon_s = 2, wake_s = None, p_rx = 1,
+		seed = None, max_bytes = 1 << 28, workers = 1 ):
+	'''
+	The Reception of n_tags tags woken up at wake_s (shape (n_tags,), all at 0 by default) and advertising as
+	advertising (beacon_advertising() by default) for horizon_s after it, over trials independent trials.
+	p_rx is the probability that a packet without collision is received (the link budget).
+	The chunks of trials have their own random streams, spawned from seed, and go through a pool of workers
+	processes when workers > 1.
+	'''
+	if advertising is None:
+		advertising = beacon_advertising()
+	wake_s 	= np.zeros( n_tags ) if wake_s is None else np.asarray( wake_s, dtype = float )
+	events 	= int( np.ceil( horizon_s / advertising.interval_s ) )
+	# About ten float64 arrays of the shape (trial, tag, event) at a time.
+	chunk 	= max( 1, int( max_bytes // ( 80 * max( 1, n_tags * events ) ) ) )
+	sizes 	= [ min( chunk, trials - start ) for start in range( 0, trials, chunk ) ]
+	seeds 	= np.random.SeedSequence( seed ).spawn( len( sizes ) )
+	tasks 	= [ ( wake_s, size, advertising, scanner, events, p_rx, s ) for ( size, s ) in zip( sizes, seeds ) ]
+
+	with stage( 'BLE RECEPTION' ):
+		if workers > 1 and len( tasks ) > 1:
+			from concurrent.futures import ProcessPoolExecutor
+			with ProcessPoolExecutor( max_workers = workers ) as pool:
+				results = list( pool.map( _trials_chunk, tasks ) )
+		else:
+			results = [ _trials_chunk( task ) for task in tasks ]
+	first_read 	= np.concatenate([ r[0] for r in results ]) if results else np.empty( ( 0, n_tags ) )
+	collided 	= np.concatenate([ r[1] for r in results ]) if results else np.empty( 0 )
+	first_read[ first_read > horizon_s ] = np.inf
+	return Reception( first_read, np.isfinite( first_read ).mean( axis = 1 ), collided )
@@ -0,0 +1,179 @@
+'''
+Many measurement campaigns against the simulation at once.
+
+measurement_vs_simulation/main.py compares one measured.csv with simulated.csv. Here every csv of a directory
+(in the measured.csv format) is read one after the other into a single (campaign, point) array, each row put
+on the points of the simulated grid: a measured point goes to the simulated one at the same angle and nearest
+distance (the files do not always agree on the last digit, e.g. 30 and 30.1 cm), and points of the grid the
+campaign does not have are NaN. The distances each campaign measured are kept: the lobes are computed on them,
+as compare() does for a single file, and the missing points are left out of the fits.
+
+The metrics are then computed for every campaign in the same array operations, measured_lobe() included, and
+summarize() returns them as one structured array with a row per campaign (see write_summary()):
+* ratio: measured over simulated module (the median over the points, and the spread of its logarithm),
+  in units of the measurement per Tesla: the calibration of the probe, so its spread matters more than its value.
+* angle error: angle of the measured field minus the simulated one, both wrt the reader's axis. simulated.csv
+  only has the module, so the simulated angle comes from the FEMM exports (a FieldSet) and is NaN without one.
+* A ratio: fitted decay coefficient of each angle over the one fitted on the simulation.
+* Vth_max_dist: value of the 0 deg fit at max_dist_m, and the normalized lobe it gives.
+'''
+
+import glob
+import os
+import warnings
+from collections import namedtuple
+
+import numpy as np
+from numpy import pi
+
+from .loader import load_measured, load_simulated
+from .measurement import ANGLES_N, BLOCK_N, measured_lobe
+from .profiling import stage
+from .rotation import rotation_table, field_at
+
+
+# names: 	File name of each campaign. Shape (campaign,)
+# r_m, t_r: Distances (in meters) and angles (in radians) of the simulated grid. Shape (point,)
+# r_meas_m: Distance (in meters) at which each campaign measured the point, NaN where missing. Shape (campaign, point)
+# v, u: 	Measured components of each campaign on the grid, NaN where missing. Shape (campaign, point)
+# m_sim: 	Simulated module on the grid. Shape (point,)
+# matched: 	Whether the campaign has the point. Shape (campaign, point)
+Campaigns = namedtuple( 'Campaigns', [ 'names', 'r_m', 't_r', 'r_meas_m', 'v', 'u', 'm_sim', 'matched' ] )
+
+
+##############################################
+#### READING AND ALIGNING ####################
+##############################################
+
+def _grid_index( r_cm, theta_d, sim_r_cm, sim_theta_d, tol_cm ):
+	# Index of the simulated point at the same angle and nearest distance (within tol_cm) of each point, or -1.
+	# A loop over the few angles; the points of each one are located in its distances with a single searchsorted.
+	index = np.full( len( r_cm ), -1 )
+	for t in np.unique( sim_theta_d ):
+		rows 	= np.flatnonzero( sim_theta_d == t )
+		rows 	= rows[ np.argsort( sim_r_cm[rows] ) ]
+		here 	= np.flatnonzero( np.isclose( theta_d, t ) )
+		r 		= sim_r_cm[rows]
+		pos 	= np.searchsorted( r, r_cm[here] )
+		lo 		= np.maximum( pos - 1, 0 )
+		hi 		= np.minimum( pos, len( r ) - 1 )
+		near 	= np.where( np.abs( r[hi] - r_cm[here] ) < np.abs( r[lo] - r_cm[here] ), hi, lo )
+		ok 		= np.abs( r[near] - r_cm[here] ) <= tol_cm
+		index[here[ok]] = rows[near[ok]]
+	return index
+
+def campaign_paths( directory, pattern = '*.csv', exclude = () ):
+	'''
+	The csv files of directory matching pattern, sorted, without the ones in exclude.
+	'''
+	exclude = { os.path.realpath( p ) for p in exclude }
+	return [ p for p in sorted( glob.glob( os.path.join( directory, pattern ) ) ) if os.path.realpath( p ) not in exclude ]
+
+def load_campaigns( paths, simulated_path, tol_cm = 0.5 ):
+	'''
+	Reads the measured csv files of paths one at a time and aligns them on the grid of simulated_path.
+	Returns Campaigns.
+	'''
+	with stage( 'GETTING SIMULATED VALUES' ):
+		( sim_r_cm, sim_theta_d, m_sim ) = load_simulated( simulated_path )
+
+	with stage( 'GETTING MEASURED VALUES' ):
+		shape 	= ( len( paths ), len( m_sim ) )
+		r_meas 	= np.full( shape, np.nan )
+		v 		= np.full( shape, np.nan )
+		u 		= np.full( shape, np.nan )
+		for ( i, path ) in enumerate( paths ):
+			( r_cm, theta_d, v_i, u_i ) = load_measured( path )
+			index 	= _grid_index( r_cm, theta_d, sim_r_cm, sim_theta_d, tol_cm )
+			found 	= index >= 0
+			r_meas[i, index[found]] = r_cm[found]
+			v[i, index[found]] = v_i[found]
+			u[i, index[found]] = u_i[found]
+
+	names = np.array([ os.path.basename( p ) for p in paths ])
+	return Campaigns( names, sim_r_cm*0.01, sim_theta_d*pi/180, r_meas*0.01, v, u, m_sim, ~np.isnan( v ) )
+
+
+##############################################
+#### METRICS #################################
+##############################################
+
+def summary_dtype( n_angles, name_len = 64 ):
+	return np.dtype([
+		( 'name', 			'U%d' % name_len ),
+		( 'points', 		int ),						# Points of the simulated grid the campaign has
+		( 'ratio', 			float ),					# Median of measured / simulated module
+		( 'ratio_spread', 	float ),					# Standard deviation of log( measured / simulated )
+		( 'angle_rms_d', 	float ),					# RMS of the field angle error, in degrees (NaN without a FieldSet)
+		( 'angle_max_d', 	float ),					# Largest absolute field angle error, in degrees
+		( 'Vth_max_dist', 	float ),					# Value of the 0 deg fit at max_dist_m (Vpp)
+		( 'lobe_max_err', 	float ),					# Largest difference between the measured and simulated lobes
+		( 'A_ratio', 		float, ( n_angles, ) ),		# Fitted A of each angle over the simulated one
+		( 'lobe', 			float, ( n_angles, ) ),		# Normalized lobe, as measured_lobe()
+	])
+
+def angle_errors( campaigns, field ):
+	'''
+	Angle of each campaign's measured field minus the simulated one (from the FieldSet field), both wrt the
+	reader's axis, in [-pi/2, pi/2]. Shape (campaign, point)
+	'''
+	table 			= rotation_table( field.r, field.B_et, field.B_er, list( field.thetas_d ) )
+	( B_er, B_et ) 	= field_at( table, campaigns.r_m, campaigns.t_r )
+	sim 			= campaigns.t_r + np.arctan( B_et / B_er )
+	# The measured components are magnitudes, so only the angle folded in [0, pi/2] is seen (the same direction
+	# with either sign, and its mirror image about the axis): the simulated one is folded the same way.
+	sim 			= np.abs( ( sim + pi/2 ) % pi - pi/2 )
+	meas 			= np.arctan2( campaigns.u, campaigns.v )
+	return meas - sim
+
+def summarize( campaigns, max_dist_m = 5, skip = 1, field = None, angles_n = ANGLES_N, block_n = BLOCK_N ):
+	'''
+	The metrics of every campaign (see summary_dtype()). field is the FieldSet for the angle errors.
+	'''
+	with stage( 'CAMPAIGN METRICS' ):
+		m 		= np.hypot( campaigns.u, campaigns.v )
+		ratio 	= m / campaigns.m_sim
+		log_r 	= np.log( ratio )
+		if field is None:
+			err_d = np.full( m.shape, np.nan )
+		else:
+			err_d = angle_errors( campaigns, field ) * 180/pi
+
+	# Both lobes on the distances and points of each campaign, as compare() (campaigns without any point only
+	# give NaN).
+	with stage( 'GENERATING THE LOBE' ), np.errstate( invalid = 'ignore', divide = 'ignore' ), warnings.catch_warnings():
+		warnings.simplefilter( 'ignore', RuntimeWarning )
+		meas 	= measured_lobe( campaigns.r_meas_m, m, max_dist_m, angles_n, block_n, skip )
+		sim 	= measured_lobe( campaigns.r_meas_m, campaigns.m_sim, max_dist_m, angles_n, block_n, skip )
+
+	table = np.zeros( len( campaigns.names ), dtype = summary_dtype( angles_n, max( [ 1 ] + [ len( n ) for n in campaigns.names ] ) ) )
+	if not len( table ):
+		return table
+	# Campaigns without any point only give NaN: the warnings of their empty reductions are not errors.
+	with np.errstate( invalid = 'ignore', divide = 'ignore' ), warnings.catch_warnings():
+		warnings.simplefilter( 'ignore', RuntimeWarning )
+		table['name'] 			= campaigns.names
+		table['points'] 		= campaigns.matched.sum( axis = 1 )
+		table['ratio'] 			= np.nanmedian( ratio, axis = 1 )
+		table['ratio_spread'] 	= np.nanstd( log_r, axis = 1 )
+		table['angle_rms_d'] 	= np.sqrt( np.nanmean( err_d**2, axis = 1 ) )
+		table['angle_max_d'] 	= np.nanmax( np.abs( err_d ), axis = 1 )
+		table['Vth_max_dist'] 	= meas.th_max_dist
+		table['lobe_max_err'] 	= np.nanmax( np.abs( meas.lobe - sim.lobe ), axis = 1 )
+		table['A_ratio'] 		= meas.A / sim.A
+		table['lobe'] 			= meas.lobe
+	return table
+
+def write_summary( path, table, thetas_d ):
+	'''
+	Writes the table of summarize() as a csv, with an A_ratio and a lobe column per angle thetas_d.
+	'''
+	fields 	= [ 'ratio', 'ratio_spread', 'angle_rms_d', 'angle_max_d', 'Vth_max_dist', 'lobe_max_err' ]
+	header 	= [ 'name', 'points' ] + fields
+	header += [ 'A_ratio_%g' % t for t in thetas_d ] + [ 'lobe_%g' % t for t in thetas_d ]
+	with open( path, 'w' ) as f:
+		f.write( ','.join( header ) + '\n' )
+		for row in table:
+			values = [ row['name'], str( row['points'] ) ] + [ repr( float( row[k] ) ) for k in fields ]
+			values += [ repr( float( v ) ) for v in row['A_ratio'] ] + [ repr( float( v ) ) for v in row['lobe'] ]
+			f.write( ','.join( values ) + '\n' )
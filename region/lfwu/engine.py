@@ -0,0 +1,243 @@
+'''
+Guaranteed-lobe engine.
+
+Same pipeline as the ROTATING theta READER, ROTATING THE TAG, TIME FLATTENING and MINIMUM LOBE sections of
+max_guaranteed_region/main.py, but over broadcast arrays instead of dictionaries keyed by str(angle).
+The axes are always ordered (phi, alpha, theta, r).
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from numpy import pi
+
+
+rad_2_deg 	= 180/pi
+deg_2_rad	= pi/180
+
+# r_max_rot_tag: 	Lobe edge for each tag orientation and time step. Shape (phi, alpha, theta)
+# r_max_flat_time: 	Max of the above over time. Shape (phi, theta)
+# guar_lobe: 		Min of the above over the tag orientations. Shape (theta,)
+LobeResult = namedtuple( 'LobeResult', [ 'r_max_rot_tag', 'r_max_flat_time', 'guar_lobe' ] )
+
+
+##############################################
+#### FIELD ###################################
+##############################################
+
+def field_module_angle( B_et, B_er ):
+	'''
+	Returns the field module B and its angle gamma wrt e_r (in radians), for arrays of any shape.
+	'''
+	B 		= np.sqrt( B_et**2 + B_er**2 )
+	gamma_r = np.arctan( B_et / B_er )
+	return ( B, gamma_r )
+
+
+##############################################
+#### ROTATING THE READER #####################
+##############################################
+
+def rotation_index( thetas_d, alphas_d ):
+	'''
+	For each time step alpha and angle theta, the index in thetas_d of the original profile that ends up at
+	theta once the reader is rotated alpha (i.e. the profile of |theta - alpha|). Shape (alpha, theta).
+	Every |theta - alpha| must be one of thetas_d.
+	'''
+	thetas 	= np.asarray( thetas_d )
+	swype 	= np.abs( thetas[None, :] - np.asarray( alphas_d )[:, None] )
+	order 	= np.argsort( thetas )
+	pos 	= np.clip( np.searchsorted( thetas, swype, sorter = order ), 0, len( thetas ) - 1 )
+	index 	= order[pos]
+	if np.any( thetas[index] != swype ):
+		raise ValueError( "the rotation angles must map thetas_d onto itself, missing %s" % np.unique( swype[thetas[index] != swype] ) )
+	return index
+
+def rotate_reader( B, gamma_r, thetas_d, alphas_d ):
+	'''
+	B and gamma_r have shape (theta, r). Returns B_rot and gamma_rot_r with shape (alpha, theta, r).
+	'''
+	index = rotation_index( thetas_d, alphas_d )
+	return ( B[index], gamma_r[index] )
+
+
+##############################################
+#### ROTATING THE TAG ########################
+##############################################
+
+def tag_projection( B, gamma_r, phis_d ):
+	'''
+	The B through a tag oriented phi (in degrees) is B*sin(|phi - gamma|). Element-wise, with broadcasting.
+	'''
+	diff = np.abs( phis_d - gamma_r*rad_2_deg )*deg_2_rad
+	return B*np.sin( diff )
+
+def project_on_tag( B_rot, gamma_rot_r, phis_d ):
+	'''
+	B_rot and gamma_rot_r have shape (alpha, theta, r). Returns shape (phi, alpha, theta, r).
+	'''
+	phis = np.asarray( phis_d, dtype = float )[:, None, None, None]
+	return tag_projection( B_rot[None], gamma_rot_r[None], phis )
+
+def last_crossing( B_tag, Bth ):
+	'''
+	Index of the last r (last axis) where B_tag > Bth, or 0 if there is none.
+	'''
+	above 	= B_tag > Bth
+	n 		= above.shape[-1]
+	last 	= n - 1 - np.argmax( above[..., ::-1], axis = -1 )
+	return np.where( above.any( axis = -1 ), last, 0 )
+
+
+def suffix_max( B_tag ):
+	'''
+	Running maximum of B_tag from the far end of the last axis (r): at each r, the highest B_tag from there on.
+	It is non-increasing in r, and B_tag has a crossing past r for a threshold iff suffix_max( B_tag ) there is
+	above it. NaNs are ignored.
+	'''
+	return np.fmax.accumulate( B_tag[..., ::-1], axis = -1 )[..., ::-1]
+
+def crossing_curve( B_tag, Bths ):
+	'''
+	last_crossing() of B_tag for every threshold of Bths at once. Returns shape B_tag.shape[:-1] + (len(Bths),).
+	Each sample of the suffix maximum is placed once among the sorted thresholds (the number of thresholds it is
+	above). Since the suffix maximum is non-increasing, the number of samples above threshold k is then the count
+	of samples placed past k, a suffix sum of their histogram.
+	'''
+	Bths 	= np.asarray( Bths, dtype = float ).ravel()
+	order 	= np.argsort( Bths, kind = 'stable' )
+	peak 	= suffix_max( B_tag )
+	n 		= peak.shape[-1]
+	k 		= len( Bths )
+
+	above 	= np.searchsorted( Bths[order], peak, side = 'left' ) 	# Number of thresholds strictly below each sample
+	above 	= np.where( np.isnan( peak ), 0, above ).reshape( -1, n )
+	profile = np.arange( above.shape[0] )[:, None]
+	hist 	= np.bincount( ( profile*( k + 1 ) + above ).ravel(), minlength = above.shape[0]*( k + 1 ) ).reshape( -1, k + 1 )
+	count 	= np.cumsum( hist[:, ::-1], axis = 1 )[:, ::-1][:, 1:]		# Samples above each sorted threshold
+
+	crossing 			= np.empty_like( count )
+	crossing[:, order] 	= np.maximum( count - 1, 0 )
+	return crossing.reshape( peak.shape[:-1] + ( k, ) )
+
+
+##############################################
+#### THE WHOLE PIPELINE ######################
+##############################################
+
+def lobe_from_rotation( B_rot, gamma_rot_r, r_m, phis_d, Bth ):
+	'''
+	B_rot and gamma_rot_r have shape (alpha, theta, r), from rotate_reader() or rotate_reader_continuous(),
+	and are sampled at the distances r_m. Returns a LobeResult.
+	'''
+	B_rot_tag 			= project_on_tag( B_rot, gamma_rot_r, phis_d )
+	r_max_rot_tag 		= np.asarray( r_m )[ last_crossing( B_rot_tag, Bth ) ]
+	r_max_flat_time 	= r_max_rot_tag.max( axis = 1 )
+	guar_lobe 			= r_max_flat_time.min( axis = 0 )
+	return LobeResult( r_max_rot_tag, r_max_flat_time, guar_lobe )
+
+def lobe_curve( B_rot, gamma_rot_r, r_m, phis_d, Bths ):
+	'''
+	lobe_from_rotation() for every threshold of Bths in a single pass (see crossing_curve()).
+	Returns a LobeResult whose arrays have a leading threshold axis, e.g. guar_lobe with shape (Bth, theta).
+	'''
+	B_rot_tag 			= project_on_tag( B_rot, gamma_rot_r, phis_d )
+	r_max_rot_tag 		= np.moveaxis( np.asarray( r_m )[ crossing_curve( B_rot_tag, Bths ) ], -1, 0 )
+	r_max_flat_time 	= r_max_rot_tag.max( axis = 2 )
+	guar_lobe 			= r_max_flat_time.min( axis = 1 )
+	return LobeResult( r_max_rot_tag, r_max_flat_time, guar_lobe )
+
+def guaranteed_lobe( B, gamma_r, r_m, thetas_d, alphas_d, phis_d, Bth ):
+	'''
+	B and gamma_r have shape (theta, r) and are sampled at the distances r_m.
+	Returns a LobeResult.
+	'''
+	( B_rot, gamma_rot_r ) = rotate_reader( B, gamma_r, thetas_d, alphas_d )
+	return lobe_from_rotation( B_rot, gamma_rot_r, r_m, phis_d, Bth )
+
+
+##############################################
+#### FINE SWEEP OVER THE TAG ORIENTATION #####
+##############################################
+
+# guar_lobe: 	Min over phi of the lobe edge flattened over time. Shape (theta,)
+# worst_phi_d: 	Tag orientation (in degrees) giving that minimum. Shape (theta,)
+# n_evaluated: 	Number of (phi, alpha, theta) profiles for which the crossing was actually computed.
+SweepResult = namedtuple( 'SweepResult', [ 'guar_lobe', 'worst_phi_d', 'n_evaluated' ] )
+
+def phi_grid( step_d, start_d = 0, stop_d = 90 ):
+	'''
+	Tag orientations from start_d to stop_d (both included) every step_d degrees.
+	'''
+	n = int( round( ( stop_d - start_d ) / step_d ) ) + 1
+	return np.linspace( start_d, stop_d, n )
+
+def _coarse_to_fine( n ):
+	# 0, then every 2^k-th index for decreasing k, so that the first chunks already span the whole range.
+	i 		= np.arange( n )
+	lowbit 	= i & -i
+	level 	= np.where( i == 0, n, lowbit )
+	return np.argsort( -level, kind = 'stable' )
+
+def guaranteed_lobe_sweep( B, gamma_r, r_m, thetas_d, alphas_d, phis_d, Bth, chunk = 64 ):
+	'''
+	Same guar_lobe as guaranteed_lobe() for any number of tag orientations phis_d, without keeping the whole
+	(phi, alpha, theta, r) array. See sweep_from_rotation().
+	'''
+	( B_rot, gamma_rot_r ) = rotate_reader( B, gamma_r, thetas_d, alphas_d )
+	return sweep_from_rotation( B_rot, gamma_rot_r, r_m, phis_d, Bth, chunk )
+
+def sweep_from_rotation( B_rot, gamma_rot_r, r_m, phis_d, Bth, chunk = 64 ):
+	'''
+	Same guar_lobe as lobe_from_rotation() for any number of tag orientations phis_d.
+	A running per-theta minimum of r_max_flat_time is kept. Since r_max_flat_time is a max over alpha, a
+	(phi, theta) profile is dropped as soon as one of its time steps reaches that minimum. The time steps are
+	tried in the order that most often did so for that theta, and the orientations are visited coarse to fine
+	so that the minimum is low early on.
+	r_m must be increasing. Returns a SweepResult.
+	'''
+	( n_alphas, n_thetas, _ ) 	= B_rot.shape
+	phis 						= np.asarray( phis_d, dtype = float )
+
+	best 		= np.full( n_thetas, np.iinfo( np.intp ).max )	# Running minimum, as an index of r_m
+	worst_phi 	= np.full( n_thetas, np.nan )
+	hits 		= np.zeros( ( n_thetas, n_alphas ), dtype = int )	# How often each alpha decided a profile
+	n_evaluated = 0
+
+	order = _coarse_to_fine( len( phis ) )
+	for start in range( 0, len( phis ), chunk ):
+		chunk_phis 	= phis[ order[start:start + chunk] ]
+		ranking 	= np.argsort( -hits, axis = 1, kind = 'stable' )
+
+		# Every (phi, theta) profile of the chunk, flattened.
+		( i_phi, i_theta ) 	= np.divmod( np.arange( len( chunk_phis )*n_thetas ), n_thetas )
+		flat 				= np.zeros( len( i_phi ), dtype = np.intp )
+		flat_alpha 			= np.zeros( len( i_phi ), dtype = int )
+		alive 				= np.arange( len( i_phi ) )
+
+		for k in range( n_alphas ):
+			th 			= i_theta[alive]
+			i_alpha 	= ranking[th, k]
+			B_tag 		= tag_projection( B_rot[i_alpha, th], gamma_rot_r[i_alpha, th], chunk_phis[ i_phi[alive] ][:, None] )
+			crossing 	= last_crossing( B_tag, Bth )
+			n_evaluated += len( alive )
+
+			higher 					= crossing > flat[alive]
+			flat[ alive[higher] ] 		= crossing[higher]
+			flat_alpha[ alive[higher] ] = i_alpha[higher]
+
+			reached = flat[alive] >= best[th]
+			np.add.at( hits, ( th[reached], i_alpha[reached] ), 1 )
+			alive = alive[~reached]
+			if len( alive ) == 0:
+				break
+
+		# What is left went through every time step and lowers the minimum of its theta.
+		if len( alive ):
+			th = i_theta[alive]
+			np.add.at( hits, ( th, flat_alpha[alive] ), 1 )
+			np.minimum.at( best, th, flat[alive] )
+			lowest = flat[alive] == best[th]
+			worst_phi[ th[lowest] ] = chunk_phis[ i_phi[ alive[lowest] ] ]
+
+	return SweepResult( np.asarray( r_m )[best], worst_phi, n_evaluated )
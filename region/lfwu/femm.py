@@ -0,0 +1,323 @@
+'''
+Direct access to the FEMM solution (simulation/model.ans), instead of the "Plot X-Y and export" steps.
+
+The .ans file keeps the problem definition as "[Key] = value" lines and, after "[Solution]", the mesh:
+* the number of nodes and one line per node: x (= r), y (= z), potential (real, imaginary), marker
+* the number of elements and one line per triangle: its 3 node indices, its block label and 3 more fields
+* the circuit results
+
+iter_ans() streams those sections in chunks and only parses the ones asked for, so large refined meshes can be
+read with bounded memory.
+
+In axisymmetric problems FEMM keeps the flux 2.pi.r.A_phi as the nodal potential. The field of each
+first-order triangle is constant:
+	B_r = -d(flux)/dz / (2.pi.r) 		B_z = d(flux)/dr / (2.pi.r)
+and, as FEMM does when smoothing, it is averaged into the nodes and interpolated barycentrically.
+'''
+
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+from numpy import pi
+
+from .engine import deg_2_rad
+from .field_cache import FieldSet
+
+
+# header: 	Dictionary with the "[Key] = value" lines before the solution.
+# x, y: 	Node coordinates (r and z in axisymmetric problems). Shape (n_nodes,)
+# A: 		Complex nodal potential. Shape (n_nodes,)
+# elements: Node indices of each triangle. Shape (n_elements, 3)
+# labels: 	Block label of each triangle. Shape (n_elements,)
+# circuits: Rows of the circuit results, as they are in the file. Shape (n_circuits, n_cols)
+AnsSolution = namedtuple( 'AnsSolution', [ 'header', 'x', 'y', 'A', 'elements', 'labels', 'circuits' ] )
+
+SECTIONS 		= ( 'header', 'nodes', 'elements', 'circuits' )
+NODE_COLS 		= 5
+ELEMENT_COLS 	= 7
+
+
+##############################################
+#### READING THE FILE ########################
+##############################################
+
+def _header_value( value ):
+	value = value.strip()
+	try:
+		return float( value )
+	except ValueError:
+		return value.strip('"')
+
+def _parse_rows( lines, n_cols, dtype = float ):
+	# All the rows are converted in a single call, the text splitting is the only per-line work.
+	values = np.array( ' '.join( lines ).split(), dtype = dtype )
+	if values.size != len( lines )*n_cols:
+		raise ValueError( "expected %d columns in %d rows, found %d values" % ( n_cols, len( lines ), values.size ) )
+	return values.reshape( len( lines ), n_cols )
+
+def _skip( f, n ):
+	for _ in islice( f, n ):
+		pass
+
+def _count( f, path ):
+	line = f.readline()
+	if not line:
+		raise ValueError( "%s: truncated solution" % path )
+	return int( line )
+
+def _stream_rows( f, n, n_cols, chunk, dtype = float ):
+	for start in range( 0, n, chunk ):
+		lines = list( islice( f, min( chunk, n - start ) ) )
+		yield _parse_rows( lines, n_cols, dtype )
+
+def iter_ans( path, sections = SECTIONS, chunk = 1 << 16 ):
+	'''
+	Streams a FEMM .ans file, parsing only the requested sections (any of SECTIONS).
+	Yields ( section, value ):
+	* ( 'header', dict ) once, with the "[Key] = value" lines before the solution
+	* ( 'nodes', rows ) with up to chunk rows of x, y, potential (real, imaginary), marker at a time
+	* ( 'elements', rows ) with up to chunk integer rows of 3 node indices, block label and 3 more fields
+	* ( 'circuits', rows ) once
+	The lines of the sections that are not requested are skipped without being parsed, and the file is not
+	read past the last requested section, so memory stays bounded by chunk whatever the size of the mesh.
+	'''
+	wanted 	= set( sections )
+	unknown = wanted - set( SECTIONS )
+	if unknown:
+		raise ValueError( "unknown sections %s" % sorted( unknown ) )
+	last 	= max( SECTIONS.index( s ) for s in wanted )
+
+	with open( path ) as f:
+		header = {}
+		for line in f:
+			if line.startswith( '[Solution]' ):
+				break
+			if line.startswith( '[' ) and '=' in line:
+				( key, value ) = line.split( '=', 1 )
+				header[ key.strip().strip( '[]' ) ] = _header_value( value )
+		else:
+			raise ValueError( "%s: no [Solution] section" % path )
+		if 'header' in wanted:
+			yield ( 'header', header )
+		if last == 0:
+			return
+
+		n_nodes = _count( f, path )
+		if 'nodes' in wanted:
+			for rows in _stream_rows( f, n_nodes, NODE_COLS, chunk ):
+				yield ( 'nodes', rows )
+		else:
+			_skip( f, n_nodes )
+		if last == 1:
+			return
+
+		n_elements = _count( f, path )
+		if 'elements' in wanted:
+			for rows in _stream_rows( f, n_elements, ELEMENT_COLS, chunk, dtype = np.int64 ):
+				yield ( 'elements', rows )
+		else:
+			_skip( f, n_elements )
+		if last == 2:
+			return
+
+		n_circuits 	= _count( f, path )
+		lines 		= list( islice( f, n_circuits ) )
+		yield ( 'circuits', np.array([ [ float( v ) for v in line.split() ] for line in lines ]) )
+
+def read_ans( path, sections = SECTIONS, chunk = 1 << 16 ):
+	'''
+	Loads the requested sections of a FEMM .ans file (see iter_ans()). Returns an AnsSolution, with None in
+	the fields of the sections that were not requested.
+	'''
+	header 		= None
+	nodes 		= []
+	elements 	= []
+	circuits 	= None
+	for ( section, value ) in iter_ans( path, sections, chunk ):
+		if section == 'header':
+			header = value
+		elif section == 'nodes':
+			nodes.append( value )
+		elif section == 'elements':
+			elements.append( value )
+		else:
+			circuits = value
+
+	( x, y, A ) = ( None, None, None )
+	if 'nodes' in sections:
+		nodes 		= np.concatenate( nodes ) if nodes else np.zeros( ( 0, NODE_COLS ) )
+		( x, y, A ) = ( nodes[:, 0].copy(), nodes[:, 1].copy(), nodes[:, 2] + 1j*nodes[:, 3] )
+	( tri, labels ) = ( None, None )
+	if 'elements' in sections:
+		elements 		= np.concatenate( elements ) if elements else np.zeros( ( 0, ELEMENT_COLS ), dtype = np.int64 )
+		( tri, labels ) = ( np.ascontiguousarray( elements[:, :3] ), elements[:, 3].copy() )
+
+	return AnsSolution( header, x, y, A, tri, labels, circuits )
+
+
+##############################################
+#### FIELD OF THE MESH #######################
+##############################################
+
+# The mesh, the triangle-location index and the nodal field of a solution.
+# cell: 				Side of the square cells of the index.
+# origin, shape: 		Lower-left corner and number of cells (along x, along y) of the index.
+# cell_start, cell_elements: 	Elements overlapping each cell, in CSR form.
+# inv: 					Inverse of the affine map of each triangle, to get its barycentric coordinates.
+# B_r, B_z: 			Smoothed complex field at the nodes.
+MeshField = namedtuple( 'MeshField', [ 'x', 'y', 'elements', 'cell', 'origin', 'shape', 'cell_start', 'cell_elements', 'inv', 'B_r', 'B_z' ] )
+
+def _element_field( x, y, flux, elements ):
+	( xs, ys, fs ) = ( x[elements], y[elements], flux[elements] )
+	# Gradient of the linear flux over each triangle.
+	dx1 	= xs[:, 1] - xs[:, 0]
+	dx2 	= xs[:, 2] - xs[:, 0]
+	dy1 	= ys[:, 1] - ys[:, 0]
+	dy2 	= ys[:, 2] - ys[:, 0]
+	df1 	= fs[:, 1] - fs[:, 0]
+	df2 	= fs[:, 2] - fs[:, 0]
+	det 	= dx1*dy2 - dx2*dy1
+	dfdx 	= ( df1*dy2 - df2*dy1 ) / det
+	dfdy 	= ( df2*dx1 - df1*dx2 ) / det
+	r 		= xs.mean( axis = 1 )
+	return ( -dfdy / ( 2*pi*r ), dfdx / ( 2*pi*r ), np.abs( det ) / 2 )
+
+def _smooth( values, area, elements, n_nodes ):
+	# Area-weighted average over the triangles around each node.
+	total 	= np.zeros( n_nodes, dtype = values.dtype )
+	weight 	= np.zeros( n_nodes )
+	for k in range( 3 ):
+		np.add.at( total, elements[:, k], values*area )
+		np.add.at( weight, elements[:, k], area )
+	return total / np.where( weight > 0, weight, 1 )
+
+def _bucket( x, y, elements, cells_per_element ):
+	xs 		= x[elements]
+	ys 		= y[elements]
+	area 	= np.abs( ( xs[:, 1] - xs[:, 0] )*( ys[:, 2] - ys[:, 0] ) - ( xs[:, 2] - xs[:, 0] )*( ys[:, 1] - ys[:, 0] ) ) / 2
+	# The cells are sized after the typical (median) triangle.
+	cell 	= np.sqrt( np.median( area ) * cells_per_element )
+	origin 	= np.array([ x.min(), y.min() ])
+	shape 	= ( int( ( x.max() - origin[0] ) / cell ) + 1, int( ( y.max() - origin[1] ) / cell ) + 1 )
+
+	i0 		= ( ( xs.min( axis = 1 ) - origin[0] ) / cell ).astype( int )
+	i1 		= ( ( xs.max( axis = 1 ) - origin[0] ) / cell ).astype( int )
+	j0 		= ( ( ys.min( axis = 1 ) - origin[1] ) / cell ).astype( int )
+	j1 		= ( ( ys.max( axis = 1 ) - origin[1] ) / cell ).astype( int )
+	( nx, ny ) = ( i1 - i0 + 1, j1 - j0 + 1 )
+
+	# Every (element, cell) pair of the bounding box of each element, enumerated without a Python loop.
+	count 	= nx*ny
+	elem 	= np.repeat( np.arange( len( elements ) ), count )
+	k 		= np.arange( count.sum() ) - np.repeat( np.cumsum( count ) - count, count )
+	ci 		= i0[elem] + k % nx[elem]
+	cj 		= j0[elem] + k // nx[elem]
+	cells 	= ci*shape[1] + cj
+
+	order 		= np.argsort( cells, kind = 'stable' )
+	cell_start 	= np.searchsorted( cells[order], np.arange( shape[0]*shape[1] + 1 ) )
+	return ( cell, origin, shape, cell_start, elem[order] )
+
+def mesh_field( solution, cells_per_element = 4 ):
+	'''
+	Builds the MeshField of an axisymmetric AnsSolution: the smoothed nodal field and a uniform grid of
+	buckets with the triangles overlapping each cell (cells of about cells_per_element median triangles).
+	'''
+	( x, y, elements ) = ( solution.x, solution.y, solution.elements )
+
+	( B_r, B_z, area ) 	= _element_field( x, y, solution.A, elements )
+	B_r_nodes 			= _smooth( B_r, area, elements, len( x ) )
+	B_z_nodes 			= _smooth( B_z, area, elements, len( x ) )
+
+	( cell, origin, shape, cell_start, cell_elements ) = _bucket( x, y, elements, cells_per_element )
+
+	xs 	= x[elements]
+	ys 	= y[elements]
+	T 	= np.stack([ np.stack([ xs[:, 1] - xs[:, 0], xs[:, 2] - xs[:, 0] ], axis = -1 ),
+					 np.stack([ ys[:, 1] - ys[:, 0], ys[:, 2] - ys[:, 0] ], axis = -1 ) ], axis = 1 )
+	inv = np.linalg.inv( T )
+
+	return MeshField( x, y, elements, cell, origin, shape, cell_start, cell_elements, inv, B_r_nodes, B_z_nodes )
+
+def locate( mesh, px, py, eps = 1e-9 ):
+	'''
+	Triangle containing each point, and its barycentric coordinates. Points outside the mesh get -1.
+	Returns (element, weights) with shapes (n,) and (n, 3).
+	'''
+	px 		= np.ravel( np.asarray( px, dtype = float ) )
+	py 		= np.ravel( np.asarray( py, dtype = float ) )
+	element = np.full( len( px ), -1 )
+	weights = np.zeros( ( len( px ), 3 ) )
+
+	ci 		= np.floor( ( px - mesh.origin[0] ) / mesh.cell ).astype( int )
+	cj 		= np.floor( ( py - mesh.origin[1] ) / mesh.cell ).astype( int )
+	inside 	= ( ci >= 0 ) & ( ci < mesh.shape[0] ) & ( cj >= 0 ) & ( cj < mesh.shape[1] )
+	pending = np.flatnonzero( inside )
+	cells 	= ci[pending]*mesh.shape[1] + cj[pending]
+	start 	= mesh.cell_start[cells]
+	count 	= mesh.cell_start[cells + 1] - start
+
+	# The k-th candidate of every pending point is tested at once, until each point finds its triangle.
+	k = 0
+	while len( pending ):
+		has 	= count > k
+		( pending, start, count ) = ( pending[has], start[has], count[has] )
+		if not len( pending ):
+			break
+		e 	= mesh.cell_elements[start + k]
+		p0 	= mesh.elements[e, 0]
+		d 	= np.stack([ px[pending] - mesh.x[p0], py[pending] - mesh.y[p0] ], axis = -1 )
+		l12 = np.einsum( 'nij,nj->ni', mesh.inv[e], d )
+		l0 	= 1 - l12.sum( axis = 1 )
+		hit = ( l0 >= -eps ) & ( l12 >= -eps ).all( axis = 1 )
+
+		element[ pending[hit] ] = e[hit]
+		weights[ pending[hit] ] = np.column_stack([ l0[hit], l12[hit] ])
+		( pending, start, count ) = ( pending[~hit], start[~hit], count[~hit] )
+		k += 1
+
+	return ( element, weights )
+
+def field_at_points( mesh, r, z, chunk = 1 << 18 ):
+	'''
+	Complex (B_r, B_z) at the points (r, z), interpolated barycentrically from the smoothed nodal field.
+	Points are processed in batches of chunk. Points outside the mesh get NaN.
+	'''
+	r 		= np.asarray( r, dtype = float )
+	( r, z ) = np.broadcast_arrays( r, np.asarray( z, dtype = float ) )
+	shape 	= r.shape
+	( r, z ) = ( r.ravel(), z.ravel() )
+	B_r 	= np.full( r.size, np.nan, dtype = complex )
+	B_z 	= np.full( r.size, np.nan, dtype = complex )
+
+	for start in range( 0, r.size, chunk ):
+		stop 				= min( start + chunk, r.size )
+		( element, w ) 		= locate( mesh, r[start:stop], z[start:stop] )
+		found 				= element >= 0
+		nodes 				= mesh.elements[ element[found] ]
+		idx 				= np.arange( start, stop )[found]
+		B_r[idx] 			= ( mesh.B_r[nodes]*w[found] ).sum( axis = 1 )
+		B_z[idx] 			= ( mesh.B_z[nodes]*w[found] ).sum( axis = 1 )
+
+	return ( B_r.reshape( shape ), B_z.reshape( shape ) )
+
+
+##############################################
+#### SAMPLING THE LINES OF data/ #############
+##############################################
+
+def field_set_from_ans( mesh, center_rz, thetas_d, r_m ):
+	'''
+	The same FieldSet that load_field_set() reads from the FEMM exports, sampled directly from the mesh along
+	the lines traced from center_rz (the coil's center) at the angles thetas_d (from the coil's axis, z) and
+	distances r_m.
+	As in the exports, B_er and B_et are the magnitudes of the (complex) tangential and normal components.
+	'''
+	thetas 	= np.asarray( thetas_d, dtype = float )[:, None] * deg_2_rad
+	r 		= np.asarray( r_m, dtype = float )[None, :]
+	( B_r, B_z ) = field_at_points( mesh, center_rz[0] + r*np.sin( thetas ), center_rz[1] + r*np.cos( thetas ) )
+
+	B_er = np.abs( B_r*np.sin( thetas ) + B_z*np.cos( thetas ) )
+	B_et = np.abs( B_r*np.cos( thetas ) - B_z*np.sin( thetas ) )
+	return FieldSet( list( thetas_d ), np.broadcast_to( r, B_er.shape ), B_et, B_er )
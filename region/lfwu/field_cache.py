@@ -0,0 +1,157 @@
+'''
+Binary cache of the simulated angle set.
+
+Parsing the 2 x len(thetas) FEMM text exports of data/ is done once. The r, B_et and B_er columns of every
+theta are stacked in a single .npy file which later runs memory-map instead of re-parsing the text.
+A .json manifest next to it keeps the fingerprint (size, mtime and sha1) of every source file.
+The store is rebuilt when a size changes, or when an mtime changes and the contents hash changed too.
+'''
+
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from .loader import field_profile_path, load_field_profile
+
+
+CACHE_DIR 	= '.cache'
+CACHE_NAME 	= 'field_set'
+
+# r: 		Distances over e_r in which the simulation obtained values, in meters, one row per theta
+# 			(FEMM does not place the points of every line at exactly the same distances). Shape (len(thetas_d), n)
+# B_et: 	Magnetic field on versor e_theta (in Tesla), one row per theta. Shape (len(thetas_d), n)
+# B_er: 	Magnetic field on versor e_r (in Tesla), one row per theta. Shape (len(thetas_d), n)
+# source: 	What the values were computed from (e.g. the fingerprints of the exports), for the stage cache to key
+# 			on instead of hashing the arrays. None when unknown.
+FieldSet = namedtuple( 'FieldSet', [ 'thetas_d', 'r', 'B_et', 'B_er', 'source' ], defaults = ( None, ) )
+
+
+##############################################
+#### FINGERPRINTS ############################
+##############################################
+
+def _source_files( data_dir, thetas_d ):
+	files = []
+	for theta_d in thetas_d:
+		files.append( field_profile_path( data_dir, 'norm_' + str( theta_d ) ) )
+		files.append( field_profile_path( data_dir, 'tan_' + str( theta_d ) ) )
+	return files
+
+def _sha1( path ):
+	h = hashlib.sha1()
+	with open( path, 'rb' ) as f:
+		for chunk in iter( lambda: f.read( 1 << 20 ), b'' ):
+			h.update( chunk )
+	return h.hexdigest()
+
+def fingerprint( path, with_hash = True ):
+	st = os.stat( path )
+	fp = { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns }
+	if with_hash:
+		fp['sha1'] = _sha1( path )
+	return fp
+
+def _is_fresh( manifest, data_dir, thetas_d ):
+	'''
+	Returns (fresh, touched). touched is True when some mtime moved but the contents did not, so the
+	manifest should be rewritten to skip the hashing next time.
+	'''
+	if manifest.get( 'thetas_d' ) != [ str( t ) for t in thetas_d ]:
+		return ( False, False )
+
+	touched = False
+	for path in _source_files( data_dir, thetas_d ):
+		old = manifest['files'].get( os.path.basename( path ) )
+		if old is None:
+			return ( False, False )
+		new = fingerprint( path, with_hash = False )
+		if new['size'] != old['size']:
+			return ( False, False )
+		if new['mtime_ns'] != old['mtime_ns']:
+			if _sha1( path ) != old['sha1']:
+				return ( False, False )
+			old['mtime_ns'] = new['mtime_ns']
+			touched = True
+	return ( True, touched )
+
+
+##############################################
+#### BUILDING AND LOADING ####################
+##############################################
+
+def _parse( data_dir, thetas_d ):
+	r 		= []
+	B_et 	= []
+	B_er 	= []
+	for theta_d in thetas_d:
+		theta = str( theta_d )
+		values 	= load_field_profile( data_dir, 'norm_' + theta )
+		r.append( values[0] )
+		B_et.append( values[1] )
+		values 	= load_field_profile( data_dir, 'tan_' + theta )
+		B_er.append( values[1] )
+	return np.vstack( r + B_et + B_er )
+
+def _write( cache_dir, stacked, manifest ):
+	os.makedirs( cache_dir, exist_ok = True )
+	npy_path 	= os.path.join( cache_dir, CACHE_NAME + '.npy' )
+	json_path 	= os.path.join( cache_dir, CACHE_NAME + '.json' )
+	# Written to temporary files and then moved, so a concurrent run never maps a half-written store.
+	np.save( npy_path + '.tmp.npy', stacked )
+	os.replace( npy_path + '.tmp.npy', npy_path )
+	_write_manifest( json_path, manifest )
+
+def _write_manifest( json_path, manifest ):
+	with open( json_path + '.tmp', 'w' ) as f:
+		json.dump( manifest, f, indent = 1 )
+	os.replace( json_path + '.tmp', json_path )
+
+def _split( stacked, thetas_d, manifest ):
+	n = len( thetas_d )
+	# The contents of the exports identify the field, whatever their mtimes.
+	source = { name: fp['sha1'] for ( name, fp ) in manifest['files'].items() }
+	return FieldSet( list( thetas_d ), stacked[:n], stacked[n:2*n], stacked[2*n:], source )
+
+
+def load_field_set( data_dir, thetas_d, cache_dir = None, mmap = True ):
+	'''
+	Returns the FieldSet for the angles thetas_d (in degrees) found in data_dir, using the binary cache
+	in cache_dir (data_dir/.cache by default) when it is up to date with the text files.
+	With mmap the arrays are read-only memory maps of the cache.
+	If the cache cannot be written (e.g. read-only data_dir) the parsed values are returned anyway.
+	'''
+	if cache_dir is None:
+		cache_dir = os.path.join( data_dir, CACHE_DIR )
+	npy_path 	= os.path.join( cache_dir, CACHE_NAME + '.npy' )
+	json_path 	= os.path.join( cache_dir, CACHE_NAME + '.json' )
+
+	try:
+		with open( json_path ) as f:
+			manifest = json.load( f )
+		( fresh, touched ) = _is_fresh( manifest, data_dir, thetas_d )
+	except ( OSError, ValueError, KeyError ):
+		( fresh, touched ) = ( False, False )
+
+	if fresh and os.path.exists( npy_path ):
+		if touched:
+			try:
+				_write_manifest( json_path, manifest )
+			except OSError:
+				pass
+		return _split( np.load( npy_path, mmap_mode = 'r' if mmap else None ), thetas_d, manifest )
+
+	stacked = _parse( data_dir, thetas_d )
+	manifest = {
+		'thetas_d'	: [ str( t ) for t in thetas_d ],
+		'files'		: { os.path.basename( p ): fingerprint( p ) for p in _source_files( data_dir, thetas_d ) },
+	}
+	try:
+		_write( cache_dir, stacked, manifest )
+	except OSError:
+		return _split( stacked, thetas_d, manifest )
+	if mmap:
+		stacked = np.load( npy_path, mmap_mode = 'r' )
+	return _split( stacked, thetas_d, manifest )
@@ -0,0 +1,105 @@
+'''
+Fitting of the far-field decay B = a.r^-n (n = 3 for the coil's dipole field).
+
+The model is linear in its only parameter a, so the least-squares fit has a closed form and any number of
+curves (angles, datasets...) are fitted at once along the last axis, with no iterative optimizer.
+The coefficients and standard errors are the ones scipy.optimize.curve_fit returns for the same model.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from .profiling import stage
+
+
+def decay( x, a, n = 3 ):
+	return a*( x**( -n ) )
+
+def decay_inv( y, a, n = 3 ):
+	return ( a/y )**( 1/n )
+
+
+def fit_decay( x, y, n = 3 ):
+	'''
+	Fits y = a.x^-n along the last axis. x and y must broadcast together, e.g. x with shape (m,) and y with
+	shape (datasets, angles, m).
+	Samples where x or y is NaN (missing points) are left out of their curve's fit.
+	Returns (A, perr), the coefficients a and their standard errors, with the shape of y minus its last axis.
+	'''
+	with stage( 'curve fitting' ):
+		basis 		= np.asarray( x, dtype = float )**( -n )
+		y 			= np.asarray( y, dtype = float )
+		( basis, y ) = np.broadcast_arrays( basis, y )
+		missing 	= np.isnan( basis ) | np.isnan( y )
+		if missing.any():
+			( basis, y ) = ( np.where( missing, 0, basis ), np.where( missing, 0, y ) )
+		m 			= y.shape[-1] - missing.sum( axis = -1 )
+
+		sxx 	= np.einsum( '...i,...i->...', basis, basis )
+		sxy 	= np.einsum( '...i,...i->...', basis, y )
+		with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+			A 		= sxy / sxx
+
+			# Residual variance with m - 1 degrees of freedom, as curve_fit does (absolute_sigma = False).
+			resid 	= y - A[..., None]*basis
+			s2 		= np.einsum( '...i,...i->...', resid, resid ) / np.maximum( m - 1, 1 )
+			perr 	= np.where( m > 1, np.sqrt( s2 / sxx ), np.inf )
+	return ( A, perr )
+
+
+##############################################
+#### NEAR-FIELD CUTOFF #######################
+##############################################
+
+# index: 	First sample used in the fit of each curve. Shape of y minus its last axis, as the rest.
+# r: 		Distance of that sample.
+# A, perr: 	Fitted coefficient and its standard error using the samples from index on.
+# residual: Relative residual of that fit, sqrt( sum( (y - a.x^-n)^2 ) / sum( y^2 ) ).
+Cutoff = namedtuple( 'Cutoff', [ 'index', 'r', 'A', 'perr', 'residual' ] )
+
+def _suffix_sum( a ):
+	return np.cumsum( a[..., ::-1], axis = -1 )[..., ::-1]
+
+def near_field_cutoff( x, y, n = 3, tol = 0.05, min_points = 3 ):
+	'''
+	Close to the coil the field does not follow the a.x^-n model yet. For each curve along the last axis (x
+	increasing), finds the first sample k such that fitting the samples from k on leaves a relative residual
+	below tol. Every candidate k is evaluated at once from suffix sums, so each one costs O(1).
+	Candidates with fewer than min_points samples or with x <= 0 among them are not considered. If no
+	candidate reaches tol, the one with the lowest residual is taken. Samples where x or y is NaN are left out.
+	Returns a Cutoff.
+	'''
+	with stage( 'curve fitting' ):
+		return _near_field_cutoff( x, y, n, tol, min_points )
+
+def _near_field_cutoff( x, y, n, tol, min_points ):
+	( x, y ) 	= np.broadcast_arrays( np.asarray( x, dtype = float ), np.asarray( y, dtype = float ) )
+	missing 	= np.isnan( x ) | np.isnan( y )
+	used 		= ( x > 0 ) & ~missing
+	positive 	= used | missing
+	basis 		= np.where( used, np.where( used, x, 1 )**( -n ), 0 )
+	y 			= np.where( missing, 0, y )
+
+	sxx 	= _suffix_sum( basis*basis )
+	sxy 	= _suffix_sum( basis*y )
+	syy 	= _suffix_sum( y*y )
+	count 	= _suffix_sum( ~missing*1 )
+
+	valid 	= ( count >= max( min_points, 2 ) ) & np.logical_and.accumulate( positive[..., ::-1], axis = -1 )[..., ::-1]
+	valid 	&= ( sxx > 0 ) & ( syy > 0 )
+	sxx 	= np.where( valid, sxx, 1 )
+	syy 	= np.where( valid, syy, 1 )
+
+	A 			= sxy / sxx
+	rss 		= np.maximum( syy - sxy*A, 0 )
+	residual 	= np.where( valid, np.sqrt( rss / syy ), np.inf )
+	perr 		= np.sqrt( rss / ( np.maximum( count, 2 ) - 1 ) / sxx )
+
+	below 	= residual < tol
+	index 	= np.where( below.any( axis = -1 ), below.argmax( axis = -1 ), residual.argmin( axis = -1 ) )
+
+	def at_index( a ):
+		return np.take_along_axis( a, index[..., None], axis = -1 )[..., 0]
+
+	return Cutoff( index, at_index( x ), at_index( A ), at_index( perr ), at_index( residual ) )
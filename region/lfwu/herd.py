@@ -0,0 +1,248 @@
+'''
+Reader passes over a herd.
+
+A handler walks a pen with the reader, swinging it as the alpha rotation of max_guaranteed_region/main.py: the
+reader turns alpha about a pivot (the handler's arm) pivot_dist_m behind its coil. The tags are anywhere in the
+pen, each with its position and the unit axis of its coil, and a tag wakes up at the first time step its flux
+|B.n| is above Bth (the sin-projection of the planar model: in the swing plane, |B.n| = B*|sin(phi - gamma)|).
+
+Geometry (lab frame, in meters): the pen is the floor plane (x, y) and z is up. The reader's axis stays
+horizontal, at the angle heading + aim_d + alpha(t) from x, alpha going from 0 to swing_d and back every
+swing_period_s. The field is the one of the RotationTable (see volume.field_vectors()), resized as the planar
+lobe so that the last line is at max_dist_m.
+
+Only the tags that can be reached are evaluated. Past reach_m (the farthest the field module is above Bth, in
+any direction) no tag can wake up, so the tags are put in a uniform grid of cells of reach_m / 2 on the floor,
+and at each time step only the tags of the 5 x 5 cells around the coil's cell, and within reach_m of it, are
+evaluated. The (step, tag) pairs of many steps are evaluated as one array, in chunks of about max_pairs.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from numpy import pi
+
+from .engine import deg_2_rad
+from .profiling import stage
+from .rotation import rotation_table
+from .volume import field_vectors
+
+
+# positions_m: 	Position of each tag. Shape (N, 3)
+# normals: 		Unit axis of each tag's coil. Shape (N, 3)
+Herd = namedtuple( 'Herd', [ 'positions_m', 'normals' ] )
+
+# t_s: 		Time of each step. Shape (T,)
+# pivot_m: 	Position of the pivot (the handler's arm). Shape (T, 3)
+# axis_r: 	Angle of the reader's axis from x, in the floor plane (in radians). Shape (T,)
+# coil_m: 	Position of the coil's center. Shape (T, 3)
+ReaderPath = namedtuple( 'ReaderPath', [ 't_s', 'pivot_m', 'axis_r', 'coil_m' ] )
+
+# wake_t_s: 	Time of the first wake-up of each tag, inf if it never woke up. Shape (N,)
+# dwell_s: 		Time each tag spent above Bth. Shape (N,)
+# woken: 		Whether each tag woke up. Shape (N,)
+# candidates: 	Number of (step, tag) pairs within reach_m, the only ones evaluated.
+# reach_m: 		Distance past which no tag can wake up.
+ReaderPass = namedtuple( 'ReaderPass', [ 'wake_t_s', 'dwell_s', 'woken', 'candidates', 'reach_m' ] )
+
+# origin_m: 	Corner of the first cell. Shape (2,)
+# cell_m: 		Side of the cells.
+# shape: 		( nx, ny ) cells.
+# order: 		Tags sorted by cell. Shape (N,)
+# starts: 		Position in order of the first tag of each cell, and the end. Shape (nx*ny + 1,)
+GridIndex = namedtuple( 'GridIndex', [ 'origin_m', 'cell_m', 'shape', 'order', 'starts' ] )
+
+
+##############################################
+#### HERD AND PATH ###########################
+##############################################
+
+def random_herd( n, pen_m = ( 50, 20 ), height_m = ( 0.8, 1.6 ), max_tilt_d = 30, seed = None ):
+	'''
+	n tags at uniform positions of a pen_m = ( x, y ) pen, at heights between height_m. Their axes point to any
+	direction about z, tilted up or down at most max_tilt_d (ear tags on standing animals). Returns a Herd.
+	'''
+	rng 	= np.random.default_rng( seed )
+	xy 		= rng.uniform( 0, 1, ( n, 2 ) ) * np.asarray( pen_m, dtype = float )
+	z 		= rng.uniform( height_m[0], height_m[1], n )
+	yaw 	= rng.uniform( 0, 2*pi, n )
+	tilt 	= rng.uniform( -max_tilt_d, max_tilt_d, n ) * deg_2_rad
+	normals = np.column_stack([ np.cos( yaw )*np.cos( tilt ), np.sin( yaw )*np.cos( tilt ), np.sin( tilt ) ])
+	return Herd( np.column_stack([ xy, z ]), normals )
+
+def serpentine( pen_m = ( 50, 20 ), lane_m = 10 ):
+	'''
+	Waypoints of a walk through a pen_m = ( x, y ) pen along x, in lanes lane_m apart starting lane_m/2 from the
+	side. Shape (K, 2)
+	'''
+	lanes 	= np.arange( lane_m / 2, pen_m[1], lane_m )
+	ends 	= np.array([ [ 0, pen_m[0] ], [ pen_m[0], 0 ] ] * ( len( lanes ) // 2 + 1 ), dtype = float )[:len( lanes )]
+	return np.column_stack([ ends.ravel(), np.repeat( lanes, 2 ) ])
+
+def reader_path( waypoints_m, speed_mps = 1, dt_s = 0.05, swing_d = 90, swing_period_s = 1, aim_d = -45, height_m = 1.2, pivot_dist_m = 0.5 ):
+	'''
+	The ReaderPath of a handler walking the polyline waypoints_m (shape (K, 2), on the floor) at speed_mps, one step
+	every dt_s. The reader is held at height_m and swung from aim_d to aim_d + swing_d (in degrees, from the
+	walking direction, counterclockwise) and back every swing_period_s.
+	'''
+	waypoints 	= np.asarray( waypoints_m, dtype = float )
+	legs 		= np.diff( waypoints, axis = 0 )
+	lengths 	= np.hypot( legs[:, 0], legs[:, 1] )
+	along 		= np.concatenate([ [ 0 ], np.cumsum( lengths ) ])
+
+	t 		= np.arange( 0, along[-1] / speed_mps + dt_s / 2, dt_s )
+	s 		= np.minimum( t * speed_mps, along[-1] )
+	leg 	= np.clip( np.searchsorted( along, s, side = 'right' ) - 1, 0, len( legs ) - 1 )
+	w 		= ( ( s - along[leg] ) / np.where( lengths[leg] > 0, lengths[leg], 1 ) )[:, None]
+	xy 		= waypoints[leg] + w*legs[leg]
+
+	# alpha is a triangle wave: 0 to swing_d in the first half of the period, and back.
+	phase 	= np.mod( t / swing_period_s, 1 )
+	alpha 	= swing_d * ( 1 - np.abs( 2*phase - 1 ) )
+	axis 	= np.arctan2( legs[leg, 1], legs[leg, 0] ) + ( aim_d + alpha ) * deg_2_rad
+
+	pivot 	= np.column_stack([ xy, np.full( len( t ), float( height_m ) ) ])
+	coil 	= pivot + pivot_dist_m * np.column_stack([ np.cos( axis ), np.sin( axis ), np.zeros( len( t ) ) ])
+	return ReaderPath( t, pivot, axis, coil )
+
+
+##############################################
+#### SPATIAL INDEX ###########################
+##############################################
+
+def grid_index( xy_m, cell_m ):
+	'''
+	GridIndex of the floor positions xy_m (shape (N, 2)) in square cells of side cell_m.
+	'''
+	xy 		= np.asarray( xy_m, dtype = float )
+	origin 	= xy.min( axis = 0 ) if len( xy ) else np.zeros( 2 )
+	cells 	= np.floor( ( xy - origin ) / cell_m ).astype( np.int64 )
+	shape 	= tuple( int( n ) for n in ( cells.max( axis = 0 ) + 1 if len( xy ) else ( 1, 1 ) ) )
+	cell 	= cells[:, 0]*shape[1] + cells[:, 1]
+	order 	= np.argsort( cell, kind = 'stable' )
+	starts 	= np.searchsorted( cell[order], np.arange( shape[0]*shape[1] + 1 ) )
+	return GridIndex( origin, float( cell_m ), shape, order, starts )
+
+def _cell_ranges( index, xy_m, span ):
+	# Start in order and number of tags of the cells up to span cells around each point. Shapes (T, (2*span + 1)^2)
+	( nx, ny ) 	= index.shape
+	c 			= np.floor( ( np.asarray( xy_m, dtype = float ) - index.origin_m ) / index.cell_m ).astype( np.int64 )
+	offsets 	= np.array([ ( i, j ) for i in range( -span, span + 1 ) for j in range( -span, span + 1 ) ])
+	around 		= c[:, None, :] + offsets
+	inside 		= ( around[..., 0] >= 0 ) & ( around[..., 0] < nx ) & ( around[..., 1] >= 0 ) & ( around[..., 1] < ny )
+	cell 		= np.where( inside, around[..., 0]*ny + around[..., 1], 0 )
+	lo 			= np.where( inside, index.starts[cell], 0 )
+	counts 		= np.where( inside, index.starts[cell + 1] - index.starts[cell], 0 )
+	return ( lo, counts )
+
+def _expand( lo, counts ):
+	# The ranges [lo, lo + count) of each row as one array of ( point, position in order ) pairs, sorted by point.
+	per_point 		= counts.sum( axis = 1 )
+	( lo, counts ) 	= ( lo.ravel(), counts.ravel() )
+	ends 			= np.cumsum( counts )
+	pos 			= np.arange( ends[-1] if len( ends ) else 0 ) - np.repeat( ends - counts, counts ) + np.repeat( lo, counts )
+	return ( np.repeat( np.arange( len( per_point ) ), per_point ), pos )
+
+def grid_candidates( index, xy_m, radius_m ):
+	'''
+	The tags in the cells around each of the points xy_m (shape (T, 2)) that may be within radius_m of it.
+	Returns ( point, tag ), the indices of each pair, sorted by point.
+	'''
+	( point, pos ) = _expand( *_cell_ranges( index, xy_m, int( np.ceil( radius_m / index.cell_m ) ) ) )
+	return ( point, index.order[pos] )
+
+
+##############################################
+#### READER PASS #############################
+##############################################
+
+def reach( table, Bth ):
+	'''
+	Distance from the coil (in the units of the table) past which the field module is below Bth in every
+	direction. The bilinear field between samples is never above the largest of them, and past the table it
+	decays as 1/r^3 (see field_at()).
+	'''
+	B 		= np.hypot( table.B_er, table.B_et )
+	above 	= ( B >= Bth ).any( axis = 0 )
+	if not above.any():
+		return table.r[0]
+	last 	= len( above ) - 1 - np.argmax( above[::-1] )
+	if last == len( above ) - 1:
+		return table.r[-1] * ( B[:, -1].max() / Bth )**( 1/3 )
+	return table.r[last + 1]
+
+def reader_pass( table, herd, path, Bth, scale = 1, max_pairs = 1 << 21 ):
+	'''
+	The ReaderPass of the Herd herd along the ReaderPath path, with the field of the RotationTable table. Lab
+	distances are scale times the ones of the table.
+	The steps go in chunks of at most about max_pairs candidate pairs.
+	'''
+	positions 	= np.asarray( herd.positions_m, dtype = float )
+	normals 	= np.asarray( herd.normals, dtype = float )
+	n 			= len( positions )
+	reach_m 	= reach( table, Bth ) * scale
+	wake_t 		= np.full( n, np.inf )
+	dwell 		= np.zeros( n )
+	dt 			= path.t_s[1] - path.t_s[0] if len( path.t_s ) > 1 else 0
+	candidates 	= 0
+
+	with stage( 'TAG INDEX' ):
+		# Cells of half the reach: the 5 x 5 around the coil cover less area out of reach than 3 x 3 of the reach.
+		index 		= grid_index( positions[:, :2], reach_m / 2 )
+		( x, y ) 	= ( positions[index.order, 0].copy(), positions[index.order, 1].copy() )
+		z 			= positions[index.order, 2]
+		normals 	= normals[index.order]
+
+	with stage( 'READER PASS' ):
+		( lo, counts ) 	= _cell_ranges( index, path.coil_m[:, :2], 2 )
+		( cos, sin ) 	= ( np.cos( path.axis_r ), np.sin( path.axis_r ) )
+		per_step 		= np.cumsum( counts.sum( axis = 1 ) )
+		# Contiguous steps with at most about max_pairs candidates (at least one step) per chunk.
+		bounds 			= np.unique( np.concatenate([ [ 0 ], np.searchsorted( per_step, np.arange( max_pairs, per_step[-1] if len( per_step ) else 0, max_pairs ) ) + 1,
+			[ len( per_step ) ] ]) )
+		for ( first_step, end_step ) in zip( bounds[:-1], bounds[1:] ):
+			# k is the position of the tag in index.order, as x, y, z and normals are now.
+			( p, k ) 	= _expand( lo[first_step:end_step], counts[first_step:end_step] )
+			p 			= p + first_step
+			dx 			= x[k] - path.coil_m[p, 0]
+			dy 			= y[k] - path.coil_m[p, 1]
+			near 		= dx*dx + dy*dy <= reach_m**2
+			( p, k, dx, dy ) 	= ( p[near], k[near], dx[near], dy[near] )
+			dz 					= z[k] - path.coil_m[p, 2]
+			near 				= dx*dx + dy*dy + dz*dz <= reach_m**2
+			( p, k, dx, dy, dz ) = ( p[near], k[near], dx[near], dy[near], dz[near] )
+			candidates 	+= len( k )
+
+			# Into the reader's frame: x along its axis, y across it on the floor, z up.
+			( c, s ) 	= ( cos[p], sin[p] )
+			q 			= np.column_stack([ c*dx + s*dy, c*dy - s*dx, dz ]) / scale
+			n_rd 		= np.column_stack([ c*normals[k, 0] + s*normals[k, 1], c*normals[k, 1] - s*normals[k, 0], normals[k, 2] ])
+			flux 		= np.abs( np.einsum( 'ij,ij->i', field_vectors( table, q ), n_rd ) )
+
+			above 		= flux > Bth
+			( p, k ) 	= ( p[above], k[above] )
+			dwell 		+= np.bincount( k, minlength = n ) * dt
+			# The pairs are sorted by step: assigned in reverse, the first one of each tag is the one that stays.
+			first 			= np.full( n, np.inf )
+			first[k[::-1]] 	= path.t_s[p[::-1]]
+			np.minimum( wake_t, first, out = wake_t )
+
+	# Back to the order of the herd.
+	( herd_wake_t, herd_dwell ) 	= ( np.empty( n ), np.empty( n ) )
+	herd_wake_t[index.order] 		= wake_t
+	herd_dwell[index.order] 		= dwell
+	return ReaderPass( herd_wake_t, herd_dwell, np.isfinite( herd_wake_t ), candidates, reach_m )
+
+def field_reader_pass( field, herd, path, lines_n = 100, max_dist_m = 5, Bth = None, max_pairs = 1 << 21 ):
+	'''
+	The ReaderPass with the FieldSet field (see region.field_set()) and the defaults of guaranteed_region(): its
+	first lines_n lines resized so that the last one is at max_dist_m, Bth = None for the field on the axis there.
+	'''
+	r_m 	= np.asarray( field.r[-1][:lines_n] )
+	scale 	= max_dist_m / r_m[lines_n -1]
+	with stage( 'GETTING THE SIMULATED FIELD VALUES' ):
+		table = rotation_table( field.r[:, :lines_n], field.B_et[:, :lines_n], field.B_er[:, :lines_n], list( field.thetas_d ) )
+		if Bth is None:
+			i_axis 	= list( field.thetas_d ).index( 0 )
+			Bth 	= np.sqrt( field.B_et[i_axis][lines_n -1]**2 + field.B_er[i_axis][lines_n -1]**2 )
+	return reader_pass( table, herd, path, Bth, scale, max_pairs )
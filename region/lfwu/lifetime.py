@@ -0,0 +1,202 @@
+'''
+Battery lifetime of a fleet of tags.
+
+Between wake-ups a tag only draws its sleep current (the nRF52 off and the LF ASIC listening). Each wake-up
+costs the boot of the nRF52 and adv_duration_s of main.c's advertising: its idle current plus the charge of
+every advertising event (the packet on each of the three channels, the wait for a scan request after each one,
+and a fixed overhead for the radio ramp-up and the CPU).
+
+The wake-ups of each tag are counted in time bins, either drawn from the reader passes (every pass wakes a tag
+with the probability the herd simulation gave it, once per adv_duration_s it stays in the field, see herd.py)
+plus spurious wake-ups, or counted from a logged trace. The counts of one cycle (a year by default) are
+repeated until the battery is empty: the charge of each bin is a cumulative sum per tag, and the bin where it
+crosses what is left after the full cycles is found for every tag at once.
+
+The default currents are those of the nRF52840 datasheet (3 V, DC/DC, 0 dBm). The sleep current depends on the
+ASIC and should be replaced by a measured one.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from .ble import beacon_advertising
+from .profiling import stage
+
+
+YEAR_S 	= 365.25 * 86400
+DAY_S 	= 86400
+BLOCK 	= 4096 		# Tags drawn with the same random stream (the chunks are whole blocks, so the result does not depend on them).
+
+
+# sleep_a: 			Current between wake-ups (nRF52 System OFF and the ASIC listening).
+# awake_a: 			Current of the nRF52 idle between advertising events.
+# boot_c: 			Charge of the nRF52 start-up after a wake-up (SoftDevice enabled, advertising configured).
+# tx_a, rx_a: 		Radio currents while sending a packet and while waiting for a scan request.
+# event_overhead_c: Charge of each advertising event besides the packets (radio ramp-ups, CPU).
+CurrentProfile = namedtuple( 'CurrentProfile', [ 'sleep_a', 'awake_a', 'boot_c', 'tx_a', 'rx_a', 'event_overhead_c' ] )
+
+NRF52840_PROFILE = CurrentProfile( sleep_a = 2e-6, awake_a = 3e-6, boot_c = 30e-6, tx_a = 6.4e-3, rx_a = 6.26e-3, event_overhead_c = 5e-6 )
+
+# capacity_c: 				Nominal capacity, in Coulomb.
+# usable: 					Fraction of it that can be used before the voltage drops below the cut-off.
+# self_discharge_per_year: 	Fraction of the nominal capacity lost every year.
+Battery = namedtuple( 'Battery', [ 'capacity_c', 'usable', 'self_discharge_per_year' ] )
+
+# years: 			Time until the battery is empty. Shape (tag,)
+# wakes_per_day: 	Mean number of wake-ups. Shape (tag,)
+# mean_current_a: 	Mean current over the cycle, self-discharge included. Shape (tag,)
+Lifetime = namedtuple( 'Lifetime', [ 'years', 'wakes_per_day', 'mean_current_a' ] )
+
+
+def coin_cell( capacity_mah = 225, usable = 0.8, self_discharge_per_year = 0.01 ):
+	'''
+	A Battery of capacity_mah (225 mAh: a CR2032).
+	'''
+	return Battery( capacity_mah * 3.6, usable, self_discharge_per_year )
+
+
+##############################################
+#### CHARGE OF A WAKE-UP #####################
+##############################################
+
+def event_charge( profile = NRF52840_PROFILE, advertising = None ):
+	'''
+	Charge of one advertising event of advertising (ble.beacon_advertising() by default), in Coulomb.
+	'''
+	if advertising is None:
+		advertising = beacon_advertising()
+	listen_s = advertising.channel_gap_s - advertising.airtime_s
+	return 3*( advertising.airtime_s*profile.tx_a + listen_s*profile.rx_a ) + profile.event_overhead_c
+
+def wake_charge( adv_duration_s, profile = NRF52840_PROFILE, advertising = None ):
+	'''
+	Charge of a wake-up followed by adv_duration_s of advertising, in Coulomb (on top of the sleep current).
+	'''
+	if advertising is None:
+		advertising = beacon_advertising()
+	events = adv_duration_s / ( advertising.interval_s + advertising.adv_delay_max_s / 2 )
+	return profile.boot_c + events*event_charge( profile, advertising ) + adv_duration_s*( profile.awake_a - profile.sleep_a )
+
+
+##############################################
+#### WAKE-UP STREAMS #########################
+##############################################
+
+def pass_wake_stats( passes, adv_duration_s ):
+	'''
+	From reader passes (herd.ReaderPass of the same herd, e.g. with the animals placed again each time), the
+	probability that a pass wakes each tag, and the number of wake-ups when it does: the tag advertises
+	adv_duration_s and then sleeps, and is woken again while it is still in the field. Shapes (tag,)
+	'''
+	woken 	= np.array([ p.woken for p in passes ], dtype = float )
+	wakes 	= np.array([ np.where( p.woken, 1 + np.floor( p.dwell_s / adv_duration_s ), 0 ) for p in passes ])
+	count 	= woken.sum( axis = 0 )
+	return ( count / len( passes ), np.where( count > 0, wakes.sum( axis = 0 ) / np.maximum( count, 1 ), 1 ) )
+
+def scheduled_wakes( rng, probability, wakes_per_pass, passes_per_bin, false_per_bin = 0 ):
+	'''
+	Wake-ups of each tag in each bin, drawn for passes_per_bin passes (shape (bin,)) that each wake a tag with
+	probability (shape (tag,)) wakes_per_pass times (a mean, so the counts are not whole), plus spurious
+	wake-ups at a mean of false_per_bin.
+	Returns shape (tag, bin).
+	'''
+	probability 	= np.asarray( probability, dtype = float )[:, None]
+	passes 			= np.asarray( passes_per_bin, dtype = np.int64 )[None, :]
+	counts 			= rng.binomial( passes, probability ) * np.asarray( wakes_per_pass, dtype = float )[:, None]
+	if false_per_bin:
+		counts += rng.poisson( false_per_bin, counts.shape )
+	return counts
+
+def trace_wakes( tags, times_s, n_tags, bin_s, n_bins ):
+	'''
+	Wake-ups of each tag in each bin from a log of ( tag, time ) events (times past n_bins bins are wrapped, as
+	the cycle is repeated). Returns shape (tag, bin).
+	'''
+	bins = np.mod( ( np.asarray( times_s, dtype = float ) // bin_s ).astype( np.int64 ), n_bins )
+	flat = np.asarray( tags, dtype = np.int64 )*n_bins + bins
+	return np.bincount( flat, minlength = n_tags*n_bins ).reshape( n_tags, n_bins )
+
+
+##############################################
+#### DEPLETION ###############################
+##############################################
+
+def depletion_time( counts, bin_s, charge_per_wake_c, base_a, capacity_c ):
+	'''
+	Time at which each tag has drawn capacity_c, the wake-up counts (shape (tag, bin)) being repeated, with
+	base_a drawn all the time. Returns shape (tag,), in seconds.
+	'''
+	charge 	= base_a*bin_s + counts*charge_per_wake_c
+	cum 	= np.cumsum( charge, axis = 1 )
+	cycle 	= cum[:, -1]
+	# Full cycles, and what is left for the last one, in ( 0, cycle ].
+	full 	= np.ceil( capacity_c / cycle ) - 1
+	left 	= capacity_c - full*cycle
+	j 		= np.argmax( cum >= left[:, None] - 1e-12*cycle[:, None], axis = 1 )
+	rows 	= np.arange( len( cum ) )
+	before 	= np.where( j > 0, cum[rows, np.maximum( j - 1, 0 )], 0 )
+	return ( full*counts.shape[1] + j + ( left - before ) / charge[rows, j] ) * bin_s
+
+def _lifetime( counts_of, n_tags, bin_s, cycle_bins, adv_duration_s, profile, battery, advertising, max_bytes ):
+	# The Lifetime, counts_of( start, stop ) giving the wake-up counts of the tags start to stop.
+	if battery is None:
+		battery = coin_cell()
+	per_wake 	= wake_charge( adv_duration_s, profile, advertising )
+	base_a 		= profile.sleep_a + battery.self_discharge_per_year*battery.capacity_c / YEAR_S
+	capacity 	= battery.capacity_c*battery.usable
+	# About four float64 arrays of the shape (tag, bin) at a time, in whole blocks of tags.
+	chunk 		= max( 1, int( max_bytes // ( 32 * cycle_bins * BLOCK ) ) ) * BLOCK
+
+	seconds = np.empty( n_tags )
+	wakes 	= np.empty( n_tags )
+	with stage( 'FLEET LIFETIME' ):
+		for start in range( 0, n_tags, chunk ):
+			stop 				= min( n_tags, start + chunk )
+			counts 				= counts_of( start, stop )
+			seconds[start:stop] = depletion_time( counts, bin_s, per_wake, base_a, capacity )
+			wakes[start:stop] 	= counts.sum( axis = 1 )
+	cycle_s = cycle_bins * bin_s
+	return Lifetime( seconds / YEAR_S, wakes * DAY_S / cycle_s, base_a + wakes*per_wake / cycle_s )
+
+def fleet_lifetime( probability, wakes_per_pass = 1, passes_per_day = 1, false_wakes_per_day = 0, adv_duration_s = 10, profile = NRF52840_PROFILE,
+		battery = None, advertising = None, bin_days = 1, cycle_days = 365, seed = None, max_bytes = 1 << 28 ):
+	'''
+	The Lifetime of a fleet with a tag per element of probability (see pass_wake_stats(), wakes_per_pass has
+	the same shape or is a number), read every 1/passes_per_day days and woken false_wakes_per_day times a day by
+	anything else. Every tag advertises adv_duration_s after each wake-up, drawing the currents of profile from
+	battery (coin_cell() by default). One cycle_days cycle of bin_days bins is drawn, with the blocks of BLOCK tags
+	on their own random streams spawned from seed.
+	'''
+	probability 	= np.asarray( probability, dtype = float )
+	wakes_per_pass 	= np.broadcast_to( np.asarray( wakes_per_pass, dtype = float ), probability.shape )
+	n_bins 			= int( round( cycle_days / bin_days ) )
+	# A pass every 1/passes_per_day days, from the first day on.
+	edges 			= np.floor( np.arange( n_bins + 1 ) * bin_days * passes_per_day )
+	passes_per_bin 	= np.diff( edges )
+	seeds 			= np.random.SeedSequence( seed ).spawn( -( -len( probability ) // BLOCK ) )
+
+	def counts_of( start, stop ):
+		return np.concatenate([ scheduled_wakes( np.random.default_rng( seeds[lo // BLOCK] ), probability[lo:lo + BLOCK], wakes_per_pass[lo:lo + BLOCK],
+			passes_per_bin, false_wakes_per_day * bin_days ) for lo in range( start, stop, BLOCK ) ])
+
+	return _lifetime( counts_of, len( probability ), bin_days * DAY_S, n_bins, adv_duration_s, profile, battery, advertising, max_bytes )
+
+def trace_lifetime( tags, times_s, n_tags, cycle_s, bin_s = DAY_S, adv_duration_s = 10, profile = NRF52840_PROFILE, battery = None,
+		advertising = None, max_bytes = 1 << 28 ):
+	'''
+	The Lifetime of n_tags tags from a log of their wake-ups ( tags, times_s ) covering cycle_s, repeated until
+	the batteries are empty.
+	'''
+	tags 	= np.asarray( tags, dtype = np.int64 )
+	times_s = np.asarray( times_s, dtype = float )
+	n_bins 	= max( 1, int( round( cycle_s / bin_s ) ) )
+	order 	= np.argsort( tags, kind = 'stable' )
+	( tags, times_s ) = ( tags[order], times_s[order] )
+	bounds 	= np.searchsorted( tags, np.arange( n_tags + 1 ) )
+
+	def counts_of( start, stop ):
+		( lo, hi ) = ( bounds[start], bounds[stop] )
+		return trace_wakes( tags[lo:hi] - start, times_s[lo:hi], stop - start, bin_s, n_bins )
+
+	return _lifetime( counts_of, n_tags, bin_s, n_bins, adv_duration_s, profile, battery, advertising, max_bytes )
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+
+from .profiling import stage
+
+
+##############################################
+#### COLUMN COUNTS OF THE KNOWN FILES ########
+##############################################
+
+# FEMM "Plot X-Y" exports of the normal/tangential components: r, |B|, B_1, B_2
+FIELD_COLS		= 4
+# FEMM exports of the field module only (the plain <theta>deg.txt files): r, |B|
+MODULE_COLS		= 2
+# measured.csv: r (cm), theta (deg), v, u
+MEASURED_COLS	= 4
+# simulated.csv: r (cm), theta (deg), |B|
+SIMULATED_COLS	= 3
+
+
+##############################################
+#### READING FILES ###########################
+##############################################
+
+def read_columns( path, n_cols, sep = None, dtype = float ):
+	'''
+	Reads a whole delimited text file in a single pass and returns its columns.
+
+	sep is the value delimiter (None means any whitespace, which also swallows the trailing tab and
+	CR that FEMM leaves at the end of each line).
+	A ValueError is raised if the file does not have exactly n_cols columns on every row.
+	Returns a tuple with one contiguous array of the given dtype per column.
+	'''
+	try:
+		with stage( 'file parsing' ):
+			values = np.loadtxt( path, delimiter = sep, dtype = dtype, ndmin = 2 )
+	except ValueError as e:
+		raise ValueError( "%s: %s" % ( path, e ) ) from e
+
+	if values.shape[1] != n_cols:
+		raise ValueError( "%s: expected %d columns, found %d" % ( path, n_cols, values.shape[1] ) )
+
+	return tuple( np.ascontiguousarray( col ) for col in values.T )
+
+
+def field_profile_path( data_dir, name ):
+	'''
+	Path of a FEMM export following the data/ naming scheme, e.g. name = "norm_15" -> data/norm_15deg.txt
+	'''
+	return os.path.join( data_dir, name.strip('/') + 'deg.txt' )
+
+
+def load_field_profile( data_dir, name, n_cols = FIELD_COLS, dtype = float ):
+	'''
+	Loads one of the norm_*, tan_* or *deg.txt FEMM exports.
+	Returns its columns, the first one being the distance r (in meters).
+	'''
+	return read_columns( field_profile_path( data_dir, name ), n_cols, dtype = dtype )
+
+
+def load_measured( path, dtype = float ):
+	'''
+	Loads measured.csv. Returns (r_cm, theta_d, v, u).
+	'''
+	return read_columns( path, MEASURED_COLS, sep = ',', dtype = dtype )
+
+
+def load_simulated( path, dtype = float ):
+	'''
+	Loads simulated.csv. Returns (r_cm, theta_d, module).
+	'''
+	return read_columns( path, SIMULATED_COLS, sep = ',', dtype = dtype )
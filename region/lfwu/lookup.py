@@ -0,0 +1,141 @@
+'''
+Precomputed guaranteed-lobe lookup tables.
+
+build_lookup() runs the region pipeline once over a dense grid of tag angles theta, tag orientations phi and
+thresholds Bth, and keeps r_max_flat_time (per orientation) and guar_lobe (over all of them), resized to meters.
+save_lookup() writes them to a compressed .npz (about 35 kB with the default grids), and load_lookup() reads
+it back.
+
+The queries then never touch the field data (nor scipy): every grid is uniform (Bth in log scale), so locating
+a point is an O(1) index computation, and the value is interpolated multilinearly between the grid nodes. They
+take scalars or arrays of any (broadcastable) shapes, so millions of points go in a single call.
+
+The tag angles are off the simulation grid, so the reader is rotated with rotate_reader_continuous(), as
+guaranteed_region() does with alpha_steps: at the grid nodes the table gives the same values.
+'''
+
+import itertools
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from .engine import lobe_curve, phi_grid
+from .profiling import stage
+from .rotation import rotation_table, rotate_reader_continuous
+
+
+# thetas_d, phis_d: 	Uniform grids of the tag angle and orientation, in degrees. Shapes (theta,) and (phi,)
+# Bths: 				Thresholds, uniform in log scale, in Tesla. Shape (Bth,)
+# r_max: 				Time-flattened lobe of each orientation, in meters. Shape (Bth, phi, theta)
+# guar_lobe: 			Guaranteed lobe over every orientation of phis_d, in meters. Shape (Bth, theta)
+# meta: 				Parameters the table was built with (a dict).
+LookupTable = namedtuple( 'LookupTable', [ 'thetas_d', 'phis_d', 'Bths', 'r_max', 'guar_lobe', 'meta' ] )
+
+
+##############################################
+#### BUILDING ################################
+##############################################
+
+def build_lookup( field, lines_n = 100, max_dist_m = 5, theta_step_d = 1, phi_step_d = 1, Bths = None, Bth_span = 4, Bth_n = 33,
+		alpha_steps = 7, pivot_dist_m = 0.5, phi_chunk = 16 ):
+	'''
+	The LookupTable of the FieldSet field (see region.field_set()), using its first lines_n lines, with the reader
+	rotated alpha_steps times from 0 to 90 deg about a pivot pivot_dist_m behind the coil.
+	Bths = None takes Bth_n thresholds from 1/Bth_span to Bth_span times the field on the axis at the last line
+	(guaranteed_region()'s default). Otherwise Bths must be uniform in log scale.
+	The orientations go through lobe_curve() phi_chunk at a time, to bound the memory.
+	'''
+	thetas_d 	= phi_grid( theta_step_d )
+	phis_d 		= phi_grid( phi_step_d )
+	alphas_d 	= np.linspace( 0, 90, alpha_steps )
+	r_m 		= np.asarray( field.r[-1][:lines_n] )
+	# Resized as the planar lobe, with the last line at max_dist_m.
+	scale 		= max_dist_m / r_m[lines_n -1]
+
+	with stage( 'GETTING THE SIMULATED FIELD VALUES' ):
+		if Bths is None:
+			i_axis 	= list( field.thetas_d ).index( 0 )
+			Bth 	= np.sqrt( field.B_et[i_axis][lines_n -1]**2 + field.B_er[i_axis][lines_n -1]**2 )
+			Bths 	= Bth * np.geomspace( 1 / Bth_span, Bth_span, Bth_n )
+		Bths 	= np.asarray( Bths, dtype = float )
+		table 	= rotation_table( field.r[:, :lines_n], field.B_et[:, :lines_n], field.B_er[:, :lines_n], list( field.thetas_d ) )
+
+	with stage( 'ROTATING theta READER' ):
+		( B_rot, gamma_rot_r ) = rotate_reader_continuous( table, r_m, thetas_d, alphas_d, pivot_dist_m / scale )
+
+	with stage( 'LOOKUP TABLE' ):
+		r_max = np.empty( ( len( Bths ), len( phis_d ), len( thetas_d ) ), dtype = np.float32 )
+		for start in range( 0, len( phis_d ), phi_chunk ):
+			lobe = lobe_curve( B_rot, gamma_rot_r, r_m, phis_d[start:start + phi_chunk], Bths )
+			r_max[:, start:start + phi_chunk] = lobe.r_max_flat_time * scale
+
+	meta = { 'lines_n': lines_n, 'max_dist_m': max_dist_m, 'alphas_d': alphas_d.tolist(), 'pivot_dist_m': pivot_dist_m }
+	return LookupTable( thetas_d, phis_d, Bths, r_max, r_max.min( axis = 1 ), meta )
+
+
+def save_lookup( path, table ):
+	np.savez_compressed( path, thetas_d = table.thetas_d, phis_d = table.phis_d, Bths = table.Bths, r_max = table.r_max,
+		guar_lobe = table.guar_lobe, meta = np.array( json.dumps( table.meta ) ) )
+
+def load_lookup( path ):
+	with np.load( path ) as f:
+		return LookupTable( f['thetas_d'], f['phis_d'], f['Bths'], f['r_max'], f['guar_lobe'], json.loads( str( f['meta'] ) ) )
+
+
+##############################################
+#### QUERIES #################################
+##############################################
+
+def _locate( grid, x ):
+	# Lower node and weight of the upper one on a uniform grid, clipped to its ends.
+	n = len( grid )
+	if n == 1:
+		return ( np.zeros( np.shape( x ), dtype = int ), np.zeros( np.shape( x ) ) )
+	pos 	= np.clip( ( np.asarray( x, dtype = float ) - grid[0] ) / ( grid[1] - grid[0] ), 0, n - 1 )
+	i 		= np.minimum( pos.astype( int ), n - 2 )
+	return ( i, pos - i )
+
+def _multilinear( values, located ):
+	# Sum over the 2^k corners of the cell, located holding the ( i, w ) of each of the k leading axes.
+	out = 0
+	for corner in itertools.product( ( 0, 1 ), repeat = len( located ) ):
+		index 	= tuple( np.minimum( i + c, n - 1 ) for ( ( i, _ ), c, n ) in zip( located, corner, values.shape ) )
+		weight 	= 1
+		for ( ( _, w ), c ) in zip( located, corner ):
+			weight = weight * ( w if c else 1 - w )
+		out = out + values[index] * weight
+	return out
+
+def _arrays( *args ):
+	return np.broadcast_arrays( *[ np.asarray( a, dtype = float ) for a in args ] )
+
+def _bth( table, Bth ):
+	return table.Bths[ len( table.Bths ) // 2 ] if Bth is None else Bth
+
+def lookup_r_max( table, theta_d, phi_d, Bth = None ):
+	'''
+	Guaranteed distance (in meters) of a tag at angle theta_d with orientation phi_d, for the threshold Bth
+	(default: the middle of the table, the field on the axis at the last line when built with its defaults).
+	Arguments out of the table are clipped to it.
+	'''
+	( theta_d, phi_d, Bth ) = _arrays( theta_d, phi_d, _bth( table, Bth ) )
+	located = [ _locate( np.log( table.Bths ), np.log( Bth ) ), _locate( table.phis_d, phi_d ), _locate( table.thetas_d, theta_d ) ]
+	return _multilinear( table.r_max.astype( float ), located )
+
+def lookup_guar_lobe( table, theta_d, Bth = None ):
+	'''
+	Guaranteed distance (in meters) at angle theta_d whatever the tag's orientation, for the threshold Bth.
+	'''
+	( theta_d, Bth ) = _arrays( theta_d, _bth( table, Bth ) )
+	located = [ _locate( np.log( table.Bths ), np.log( Bth ) ), _locate( table.thetas_d, theta_d ) ]
+	return _multilinear( table.guar_lobe.astype( float ), located )
+
+def is_guaranteed( table, theta_d, dist_m, phi_d = None, Bth = None ):
+	'''
+	Whether the wake-up is guaranteed at angle theta_d and distance dist_m, for a tag with orientation phi_d
+	(None for any orientation).
+	'''
+	if phi_d is None:
+		return np.asarray( dist_m ) <= lookup_guar_lobe( table, theta_d, Bth )
+	return np.asarray( dist_m ) <= lookup_r_max( table, theta_d, phi_d, Bth )
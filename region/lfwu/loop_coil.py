@@ -0,0 +1,124 @@
+'''
+Analytic field of air-core loop coils, as a FEMM-free fast path for design sweeps.
+
+The field of a circular loop of radius a and current I at (rho, z) is given by the complete elliptic integrals
+K(m) and E(m), with m = 4.a.rho / ((a + rho)^2 + z^2):
+	B_z 	= mu_0.I / (2.pi.s) . [ K + (a^2 - rho^2 - z^2) / ((a - rho)^2 + z^2) . E ]
+	B_rho 	= mu_0.I / (2.pi.s) . z/rho . [ -K + (a^2 + rho^2 + z^2) / ((a - rho)^2 + z^2) . E ]
+with s = sqrt((a + rho)^2 + z^2). A coil is a stack of such loops, evenly spread along its length.
+K and E are computed with the arithmetic-geometric mean, so only NumPy is needed.
+The ferrite core of the real reader is not modelled: the magnitudes differ from FEMM by the core's gain, but
+the shape of the field (which is what the guaranteed lobe depends on) is comparable.
+'''
+
+import numpy as np
+from numpy import pi
+
+from .engine import deg_2_rad
+from .field_cache import FieldSet
+
+
+mu_0 = 4e-7*pi
+
+
+def ellipke( m, iterations = 8 ):
+	'''
+	Complete elliptic integrals of the first and second kind (K(m), E(m)), for 0 <= m < 1.
+	The AGM converges quadratically: 8 iterations reach double precision up to m ~ 1 - 1e-12, and it stops
+	earlier once every c_n is below it.
+	'''
+	m 	= np.asarray( m, dtype = float )
+	a 	= np.ones_like( m )
+	b 	= np.asarray( np.sqrt( 1 - m ) )
+	s 	= 0.5*m					# sum of 2^(n-1).c_n^2
+	c2 	= np.empty_like( m )	# c_n^2
+	ab 	= np.empty_like( m )
+	w 	= 0.5
+	# In place: these are the largest arrays of coil_field().
+	for _ in range( iterations ):
+		np.subtract( a, b, out = c2 )
+		c2 *= 0.5
+		c2 *= c2
+		np.multiply( a, b, out = ab )
+		a += b
+		a *= 0.5
+		np.sqrt( ab, out = b )
+		if not m.size or c2.max() < 1e-32:
+			break
+		w 	*= 2
+		c2 	*= w
+		s 	+= c2
+	K = pi / ( 2*a )
+	return ( K, K*( 1 - s ) )
+
+def loop_field( rho, z, radius, current = 1 ):
+	'''
+	(B_rho, B_z) in Tesla of a single loop of the given radius (in meters) centered at the origin, on the
+	plane z = 0. All the arguments broadcast together.
+	'''
+	( rho, z, a ) = ( np.asarray( rho, dtype = float ), np.asarray( z, dtype = float ), np.asarray( radius, dtype = float ) )
+	# Not broadcast beforehand, so that the terms without z keep their smaller shape.
+	z2 		= z**2
+	s2 		= ( a + rho )**2 + z2
+	d2 		= ( a - rho )**2 + z2
+	( K, E ) = ellipke( 4*a*rho / s2 )
+	k 		= mu_0*current / ( 2*pi*np.sqrt( s2 ) )
+
+	B_z 	= k*( K + ( a**2 - rho**2 - z2 ) / d2 * E )
+	on_axis = rho == 0
+	B_rho 	= k*z / np.where( on_axis, 1, rho )*( -K + ( a**2 + rho**2 + z2 ) / d2 * E )
+	return ( np.where( on_axis, 0, B_rho ), B_z )
+
+def coil_field( rho, z, radius, turns, length = 0, current = 1, max_bytes = 1 << 24 ):
+	'''
+	(B_rho, B_z) of coils of the given radius, number of turns and length (along z, centered at the origin),
+	at the points (rho, z).
+	radius, turns, length and current may be arrays of any (common) shape, one entry per coil. The result has
+	that shape followed by the shape of the points.
+	The turns of all the coils are evaluated by loop_field() at once, as an array of shape (turn,) + points that
+	is summed per coil. It is cut in chunks of whole coils of about max_bytes (small enough to stay in cache).
+	'''
+	( radius, turns, length, current ) = np.broadcast_arrays( np.asarray( radius, dtype = float ), np.asarray( turns ), np.asarray( length, dtype = float ), np.asarray( current, dtype = float ) )
+	coils 	= radius.shape
+	( rho, z ) = np.broadcast_arrays( np.asarray( rho, dtype = float ), np.asarray( z, dtype = float ) )
+	expand 	= ( Ellipsis, ) + ( None, )*rho.ndim
+	( radius, length, current ) = ( a.ravel() for a in ( radius, length, current ) )
+	turns 	= np.maximum( turns.ravel().astype( np.int64 ), 0 )
+
+	B_rho 	= np.zeros( ( len( radius ), ) + rho.shape )
+	B_z 	= np.zeros( ( len( radius ), ) + rho.shape )
+	# About twenty float64 arrays of the shape (turn,) + points in loop_field(), in chunks of whole coils.
+	per 	= max( 1, int( max_bytes // ( 160 * max( 1, rho.size ) ) ) )
+	ends 	= np.cumsum( turns )
+	start 	= 0
+	while start < len( radius ):
+		stop 		= max( start + 1, int( np.searchsorted( ends, ends[start] - turns[start] + per, side = 'right' ) ) )
+		coil 		= np.flatnonzero( turns[start:stop] ) + start
+		if len( coil ):
+			count 		= turns[coil]
+			first 		= np.cumsum( count ) - count
+			owner 		= np.repeat( coil, count )
+			k 			= np.arange( count.sum() ) - np.repeat( first, count )
+			offset 		= length[owner]*( ( k + 0.5 ) / turns[owner] - 0.5 )
+			( b_rho, b_z ) = loop_field( rho, z - offset[expand], radius[owner][expand], current[owner][expand] )
+			B_rho[coil] = np.add.reduceat( b_rho, first, axis = 0 )
+			B_z[coil] 	= np.add.reduceat( b_z, first, axis = 0 )
+		start = stop
+	return ( B_rho.reshape( coils + rho.shape ), B_z.reshape( coils + rho.shape ) )
+
+def coil_field_set( thetas_d, r_m, radius, turns, length = 0, current = 1 ):
+	'''
+	The coil field in the layout of the FEMM exports: along lines from the coil's center at the angles thetas_d
+	(from the coil's axis) and distances r_m, B_er and B_et are the magnitudes of the components on e_r and
+	e_theta. r_m is either one grid for every angle, shape (n,), or one per angle, shape (theta, n).
+	Returns a FieldSet whose arrays have the shape of the coil parameters followed by (theta, n).
+	'''
+	thetas 	= np.asarray( thetas_d, dtype = float )[:, None] * deg_2_rad
+	r 		= np.asarray( r_m, dtype = float )
+	if r.ndim == 1:
+		r = r[None, :]
+	( B_rho, B_z ) = coil_field( r*np.sin( thetas ), r*np.cos( thetas ), radius, turns, length, current )
+
+	B_er = np.abs( B_rho*np.sin( thetas ) + B_z*np.cos( thetas ) )
+	B_et = np.abs( B_rho*np.cos( thetas ) - B_z*np.sin( thetas ) )
+	return FieldSet( list( thetas_d ), np.broadcast_to( r, B_er.shape ), B_et, B_er )
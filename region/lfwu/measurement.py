@@ -0,0 +1,85 @@
+'''
+The measurement_vs_simulation computation with explicit parameters, without plotting.
+
+The measured and simulated files have one block of distances per angle. The A.1/r^3 decay is fitted on each
+block, and the lobe is the distance at which every angle reaches the value the 0 deg one has at max_dist_m,
+normalized so that the farthest measured distance stands for max_dist_m.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from numpy import pi
+
+from .fitting import decay, decay_inv, fit_decay, near_field_cutoff
+from .loader import load_measured, load_simulated
+from .profiling import stage
+
+
+ANGLES_N 	= 7		# Number of angles (blocks) used during measurements.
+BLOCK_N 	= 8		# Number of distances of each block.
+
+
+# lobe: 		Normalized distance at which each angle reaches th_max_dist. Shape (angle,)
+# th_max_dist: 	Value of the 0 deg fit at max_dist_m (the threshold).
+# A, perr: 		Fitted coefficients of each angle and their standard errors. Shape (angle,)
+MeasuredLobe = namedtuple( 'MeasuredLobe', [ 'lobe', 'th_max_dist', 'A', 'perr' ] )
+
+def measured_lobe( distances_m, module, max_dist_m = 5, angles_n = ANGLES_N, block_n = BLOCK_N, skip = 1 ):
+	'''
+	distances_m and module are the columns of the file, angles_n blocks of block_n rows. The last row of each
+	block is not used, and neither are its first skip rows (skip = None finds them for each angle with
+	near_field_cutoff()). All the angles are fitted at once. Returns a MeasuredLobe.
+	Leading axes are data sets fitted at once, e.g. module with shape (campaigns, rows): the fields of the
+	MeasuredLobe then have them too. NaN rows (missing points) are left out of the fits, and the farthest
+	distance that is not NaN stands for max_dist_m.
+	'''
+	distances_m = np.asarray( distances_m )
+	module 		= np.asarray( module )
+	if skip is None:
+		blocks 		= np.arange( angles_n )[:, None]*block_n + np.arange( block_n - 1 )
+		cut 		= near_field_cutoff( distances_m[..., blocks], module[..., blocks] )
+		( A, perr ) = ( cut.A, cut.perr )
+	else:
+		blocks 		= np.arange( angles_n )[:, None]*block_n + np.arange( skip, block_n - 1 )
+		( A, perr ) = fit_decay( distances_m[..., blocks], module[..., blocks] )
+	# The value that would have been measured at the maximum reported Wake-Up-distance. It was measured with 0 degrees.
+	th_max_dist = decay( max_dist_m, A[..., 0] )
+	# The distance at which in each direction that value is obtained, normalized for representation.
+	th_dist_m 	= decay_inv( np.asarray( th_max_dist )[..., None], A )
+	return MeasuredLobe( th_dist_m * np.nanmax( distances_m, axis = -1 )[..., None] / max_dist_m, th_max_dist, A, perr )
+
+
+# r_m, t_r: 		Distances (in meters) and angles (in radians) of the measured points.
+# m: 				Measured module.
+# u, v: 			Normalized direction of the measured field, as drawn in the quiver.
+# m_sim: 			Simulated module at the same points.
+# meas, sim: 		MeasuredLobe of the measured and simulated values.
+Comparison = namedtuple( 'Comparison', [ 'r_m', 't_r', 'm', 'u', 'v', 'm_sim', 'meas', 'sim' ] )
+
+def field_directions( t_r, u, v ):
+	'''
+	Unit direction (u, v) of the measured components, with u pointing away from the reader's axis when the
+	field angle is past the position angle.
+	'''
+	a = np.arctan( u/v )
+	return ( np.where( t_r <= a, np.cos( a ), -np.cos( a ) ), np.sin( a ) )
+
+def compare( measured_path, simulated_path, max_dist_m = 5, skip = 1 ):
+	'''
+	Reads the measured and simulated csv files and returns the Comparison.
+	'''
+	with stage( 'GETTING MEASURED VALUES' ):
+		values 	= load_measured( measured_path )
+		r_m 	= values[0]*0.01
+		t_r 	= values[1]*pi/180
+		( v, u ) = ( values[2], values[3] )
+		m 		= np.sqrt( u**2 + v**2 )
+		( u, v ) = field_directions( t_r, u, v )
+
+	with stage( 'GETTING SIMULATED VALUES' ):
+		m_sim 	= load_simulated( simulated_path )[2]
+
+	with stage( 'GENERATING THE LOBE' ):
+		lobes 	= ( measured_lobe( r_m, m, max_dist_m, skip = skip ), measured_lobe( r_m, m_sim, max_dist_m, skip = skip ) )
+	return Comparison( r_m, t_r, m, u, v, m_sim, *lobes )
@@ -0,0 +1,377 @@
+'''
+Figures of the region scripts. matplotlib and scipy are only imported when a figure is drawn, so the compute
+modules (and the CLI with --no-plot) start without them.
+'''
+
+import os
+
+import numpy as np
+from numpy import pi
+
+from .profiling import stage
+
+
+def setup_style():
+	from matplotlib import pyplot as plt
+
+	plt.close('all')
+
+	figLength = 7
+	figHeight = figLength*0.85
+
+	plt.rcParams["figure.figsize"] = [figLength, figHeight]
+	plt.rcParams["figure.autolayout"] = True
+	plt.rcParams["font.family"] = "serif"
+	plt.rc('xtick',labelsize=13)
+	plt.rc('ytick',labelsize=13)
+
+_BASES = {}
+
+def lobe_basis( angles_r, n = 500 ):
+	'''
+	The spline smoothing of lobe_polar() as a linear map, computed once per set of knots angles_r and n.
+	Returns (X_, basis) with basis of shape (n, len(angles_r)): the smoothed lobe is basis @ values.
+	It is not bit for bit make_interp_spline( angles_r, values )( X_ ), whose sums run in another order: the
+	two differ by less than 1e-14 times the largest |value| of the lobe (at most 1.4e-15 from 7 to 361 knots).
+	'''
+	xls = np.asarray( angles_r, dtype = float )
+	key = ( xls.tobytes(), n )
+	if key not in _BASES:
+		from scipy.interpolate import make_interp_spline
+
+		X_ = np.linspace( xls.min(), xls.max(), n )
+		# The interpolating spline is linear in the values: its columns are the splines of the unit vectors.
+		_BASES[key] = ( X_, make_interp_spline( xls, np.eye( len( xls ) ) )( X_ ) )
+	return _BASES[key]
+
+def lobe_polar( angles_r, values, n = 500 ):
+	'''
+	The lobe values at angles_r, smoothed with a spline over n angles. Returns (X_, Y_).
+	values may hold any number of lobes along its last axis, e.g. shape (alpha, theta): they are all smoothed
+	with a single product by lobe_basis() (equal to the spline of each lobe to the tolerance given there), and
+	Y_ has shape (..., n).
+	'''
+	( X_, basis ) = lobe_basis( angles_r, n )
+	return ( X_, np.asarray( values, dtype = float ) @ basis.T )
+
+def _finish( f, path, show ):
+	from matplotlib import pyplot as plt
+
+	if show:
+		plt.show()
+	if path:
+		with stage( 'saving svg' ):
+			f.savefig( path, format = 'svg', transparent = True )
+	return f
+
+
+##############################################
+#### BATCHED RENDERING #######################
+##############################################
+
+class LobeRenderer:
+	'''
+	Figures of many lobes for sweep reports. The polar axis is set up once (the template) and every figure only
+	replaces its lobes: all the edges go in one LineCollection and all the fills in one PolyCollection, instead
+	of a plot() and a fill_between() per lobe. The lobes are smoothed with lobe_basis(), to its tolerance.
+	For png the template's axis is rendered once too, and each figure only draws its two collections over a copy
+	of it (blitting).
+	Its compression level (zlib's, 0 to 9) is png_compress_level: encoding at the default 6 takes longer than
+	drawing.
+	With rasterize_fills the fills are embedded in the svg as one image (at dpi) instead of a path per lobe.
+	With background the figures are saved by a worker thread. There are then two templates used in turns, so
+	one is drawn while the other is being saved: a figure is never touched by both threads at once (a png is
+	handed over as a copy of its pixels).
+	Use as a context manager, or call close() to wait for the last saves.
+	'''
+
+	def __init__( self, thetas_d, max_dist_m, n = 500, rasterize_fills = False, background = False, dpi = 100, png_compress_level = 1 ):
+		setup_style()
+		( self.x, self.basis ) 	= lobe_basis( np.array( thetas_d ) * pi/180, n )
+		self.rasterize_fills 	= rasterize_fills
+		self.dpi 				= dpi
+		self.png_compress_level = png_compress_level
+		self.templates 			= [ self._template( thetas_d, max_dist_m ) for _ in range( 2 if background else 1 ) ]
+		self.pending 			= [ None ] * len( self.templates )
+		self.current 			= 0
+		self.executor 			= None
+		if background:
+			from concurrent.futures import ThreadPoolExecutor
+			self.executor = ThreadPoolExecutor( 1 )
+
+	def _template( self, thetas_d, max_dist_m ):
+		# Not a pyplot figure: nothing global refers to it, so the worker thread can save it.
+		from matplotlib.figure import Figure
+		from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+		f = Figure( dpi = self.dpi )
+		FigureCanvasAgg( f )
+		# Transparent, as savefig( transparent = True ), so that the blitted png is too.
+		f.patch.set_alpha( 0 )
+		ax = f.add_subplot( polar = True )
+		ax.patch.set_alpha( 0 )
+		ax.set_ylim( 0, max_dist_m )
+		ax.set_rmax( max_dist_m*1.1 )
+		ax.set_thetamax( max( thetas_d ) )
+		ax.set_xticks( pi/180 * np.linspace( 0, max( thetas_d ), len( thetas_d ), endpoint = True ) )
+		ax.set_rticks( np.arange( 0, max_dist_m + 0.5 ) )
+		# The layout does not depend on the lobes: computed here once instead of at every save (autolayout).
+		f.tight_layout()
+		f.set_layout_engine( 'none' )
+		return [ f, ax, [], None ] 		# Figure, axis, lobe collections, rendered axis (for png)
+
+	def _wait( self, i ):
+		if self.pending[i] is not None:
+			self.pending[i].result()
+			self.pending[i] = None
+
+	def draw( self, lobes, colors = 'k', linestyles = '--', linewidths = 1, fill_alpha = 0.075 ):
+		'''
+		Replaces the lobes of the current figure by lobes, shape (k, theta) (the values at thetas_d, smoothed
+		as lobe_polar() does). colors, linestyles and linewidths are one value or one per lobe. fill_alpha = 0
+		draws no fills. Returns the figure.
+		'''
+		from matplotlib.collections import LineCollection, PolyCollection
+
+		self._wait( self.current )
+		( f, ax, drawn, _ ) = self.templates[self.current]
+		for artist in drawn:
+			artist.remove()
+		drawn.clear()
+
+		y 		= np.atleast_2d( np.asarray( lobes, dtype = float ) ) @ self.basis.T
+		edges 	= np.stack([ np.broadcast_to( self.x, y.shape ), y ], axis = -1 )
+		if fill_alpha:
+			# Each fill goes along the lobe and back along r = 0, as fill_between( x, 0, y ).
+			base 	= np.stack([ self.x[::-1], np.zeros_like( self.x ) ], axis = -1 )
+			polys 	= np.concatenate([ edges, np.broadcast_to( base, edges.shape ) ], axis = 1 )
+			fills 	= PolyCollection( polys, facecolors = colors, edgecolors = 'none', alpha = fill_alpha, zorder = 1 )
+			fills.set_rasterized( self.rasterize_fills )
+			drawn.append( ax.add_collection( fills, autolim = False ) )
+		lines = LineCollection( edges, colors = colors, linestyles = linestyles, linewidths = linewidths, zorder = 2 )
+		drawn.append( ax.add_collection( lines, autolim = False ) )
+		return f
+
+	def save( self, path, format = None ):
+		'''
+		Saves the current figure to path (the format from its extension unless given), in the background if
+		enabled, and moves on to the next template.
+		'''
+		( f, _, _, _ ) = self.templates[self.current]
+		if ( format or os.path.splitext( path )[1][1:] ).lower() == 'png':
+			from matplotlib.image import imsave
+			( write, args ) = ( imsave, ( path, self._blit() ) )
+			kwargs = dict( format = format, dpi = self.dpi, pil_kwargs = { 'compress_level': self.png_compress_level } )
+		else:
+			( write, args ) = ( f.savefig, ( path, ) )
+			kwargs = dict( format = format, dpi = self.dpi )
+		if self.executor is None:
+			with stage( 'saving figure' ):
+				write( *args, **kwargs )
+		else:
+			self.pending[self.current] = self.executor.submit( write, *args, **kwargs )
+			self.current = ( self.current + 1 ) % len( self.templates )
+
+	def _blit( self ):
+		template 			= self.templates[self.current]
+		( f, ax, drawn, axis ) 	= template
+		canvas 				= f.canvas
+		if axis is None:
+			for artist in drawn:
+				artist.set_visible( False )
+			canvas.draw()
+			axis = template[3] = canvas.copy_from_bbox( f.bbox )
+			for artist in drawn:
+				artist.set_visible( True )
+		canvas.restore_region( axis )
+		for artist in drawn:
+			ax.draw_artist( artist )
+		return np.array( canvas.buffer_rgba() )
+
+	def close( self ):
+		for i in range( len( self.templates ) ):
+			self._wait( i )
+		if self.executor is not None:
+			self.executor.shutdown()
+
+	def __enter__( self ):
+		return self
+
+	def __exit__( self, *exc ):
+		self.close()
+		return False
+
+def render_sweep( table, directory, format = 'png', thetas_d = ( 0, 15, 30, 45, 60, 75, 90 ), background = True, rasterize_fills = False ):
+	'''
+	One figure per ( data_dir, lines_n, phis_d, max_dist_m ) of a run_grid() table, with the guar_lobe_m of all
+	its thresholds, colored from the lowest Bth (violet) to the highest (red). Written to directory, named after
+	the row index of the group's first threshold. Returns the paths.
+	'''
+	from matplotlib import cm
+
+	os.makedirs( directory, exist_ok = True )
+	groups = {}
+	for ( i, row ) in enumerate( table ):
+		groups.setdefault( ( row['data_dir'], row['lines_n'], row['phis_d'], row['max_dist_m'] ), [] ).append( i )
+
+	paths 		= []
+	renderers 	= {}
+	try:
+		for ( key, rows ) in groups.items():
+			max_dist_m = key[3]
+			if max_dist_m not in renderers:
+				renderers[max_dist_m] = LobeRenderer( thetas_d, max_dist_m, rasterize_fills = rasterize_fills, background = background )
+			paths.append( os.path.join( directory, 'lobes_%d.%s' % ( rows[0], format ) ) )
+			rows = np.asarray( rows )[ np.argsort( table['Bth'][rows] ) ]
+			renderers[max_dist_m].draw( table['guar_lobe_m'][rows], cm.rainbow( np.linspace( 0, 1, len( rows ) ) ), ':' )
+			renderers[max_dist_m].save( paths[-1], format )
+	finally:
+		for renderer in renderers.values():
+			renderer.close()
+	return paths
+
+
+##############################################
+#### MAX GUARANTEED REGION ###################
+##############################################
+
+def plot_region( region, path = None, show = True, plot_color_lobes = 0, plot_small_lobes = 1 ):
+	'''
+	The figure of max_guaranteed_region/main.py for a Region: the lobes of phi = 0 at each time step and the
+	time-flattened lobe of each phi, resized, and the time-flattened lobes in simulation units.
+	Saved as svg to path if given. Returns the figure.
+	'''
+	with stage( 'plotting' ):
+		f = _plot_region( region, plot_color_lobes, plot_small_lobes )
+	return _finish( f, path, show )
+
+def _plot_region( region, plot_color_lobes, plot_small_lobes ):
+	from matplotlib import pyplot as plt
+	from matplotlib import cm
+
+	thetas_r 	= np.array( region.thetas_d ) * pi/180
+	max_dist_m 	= region.max_dist_m
+
+	# Every lobe of a set is smoothed at once (see lobe_polar()), then drawn one by one.
+	def plot_lobe( ax, x_lobe, y_lobe, c = 'r' ):
+		ax.plot(x_lobe,y_lobe,':', color = c )
+		ax.fill_between(x_lobe,0,y_lobe, alpha=0.075, zorder=1,color=c)
+
+	def plot_lobe_edge( ax, x_lobe, y_lobe, w = 2 ):
+		ax.plot(x_lobe,y_lobe,'--', color = 'k', linewidth=w )
+
+	def setup_plot( ax ):
+		ax.set_ylim( 0,  max_dist_m )
+		ax.set_rmax( max_dist_m*1.1  )
+		ax.set_thetamax( max( region.thetas_d ) )
+		ax.set_xticks( pi/180 * np.linspace(0,  max( region.thetas_d ) , len( region.thetas_d ), endpoint=True) )
+		ax.set_rticks(np.arange(0,max_dist_m + 0.5 ))
+		return ax
+
+	setup_style()
+	f = plt.figure()
+	axs = f.add_subplot(polar=True)
+	plt.tight_layout(pad = 0.8)
+
+	r_max_rot_tag 	= region.lobe.r_max_rot_tag
+	r_max_flat_time = region.lobe.r_max_flat_time
+	scaling_factor 	= region.guar_lobe_real / region.guar_lobe
+	i_phi 			= region.phis_d.index( 0 )
+	colors 			= cm.rainbow(np.linspace(0, 1, len( region.alphas_d )))
+
+	# Resized lobes of phi = 0 at each time step, and resized time-flattened lobe of each phi.
+	setup_plot( axs )
+	( x_lobe, y_lobes ) = lobe_polar( thetas_r, r_max_rot_tag[ i_phi ] * scaling_factor )
+	for i_color in range( len( region.alphas_d ) ):
+		plot_lobe( axs, x_lobe, y_lobes[i_color], colors[i_color] )
+
+	( x_lobe, y_lobes ) = lobe_polar( thetas_r, r_max_flat_time * scaling_factor )
+	for phi_d, i_phi in zip( region.phis_d, range( len( region.phis_d ) ) ):
+		setup_plot 		( axs )
+		plot_lobe_edge	( axs, x_lobe, y_lobes[i_phi], w = 3 if phi_d == 0 else 2 )
+
+	# The same lobes in simulation units.
+	i_phi = region.phis_d.index( 0 )
+	setup_plot( axs )
+	if plot_color_lobes:
+		( x_lobe, y_lobes ) = lobe_polar( thetas_r, r_max_rot_tag[ i_phi ] )
+		for i_color in range( len( region.alphas_d ) ):
+			plot_lobe( axs, x_lobe, y_lobes[i_color], colors[i_color] )
+
+	if plot_small_lobes:
+		( x_lobe, y_lobes ) = lobe_polar( thetas_r, r_max_flat_time )
+		for i_phi in range( len( region.phis_d ) ):
+			setup_plot 		( axs )
+			plot_lobe_edge	( axs, x_lobe, y_lobes[i_phi], w=1 )
+	return f
+
+
+##############################################
+#### GUARANTEED VOLUME #######################
+##############################################
+
+def plot_volume( volume, path = None, show = True, psis_d = ( 0, 90 ) ):
+	'''
+	Meridian sections of a guaranteed Volume (see volume.cross_section()), one line style per psi of psis_d, the
+	reader's axis at 0 deg. Saved as svg to path if given. Returns the figure.
+	'''
+	with stage( 'plotting' ):
+		f = _plot_volume( volume, psis_d )
+	return _finish( f, path, show )
+
+def _plot_volume( volume, psis_d ):
+	from matplotlib import pyplot as plt
+	from .volume import cross_section
+
+	setup_style()
+	f = plt.figure()
+	ax = f.add_subplot(polar=True)
+	plt.tight_layout(pad = 0.8)
+
+	for ( psi_d, style ) in zip( psis_d, [ 'k--', 'k:', 'k-.', 'k-' ] ):
+		( angles_d, r_max ) = cross_section( volume, psi_d )
+		if angles_d[-1] > 180:
+			# The full circle: closed back at 0 deg.
+			( angles_d, r_max ) = ( np.append( angles_d, 360 ), np.append( r_max, r_max[0] ) )
+		ax.plot( angles_d*pi/180, r_max, style, label = "psi = %g deg" % psi_d )
+		ax.fill_between( angles_d*pi/180, 0, r_max, alpha=0.075, zorder=0, color='k' )
+	ax.set_rmax( volume.r_max.max()*1.1 )
+	ax.legend( loc = 'lower left' )
+	return f
+
+
+##############################################
+#### MEASUREMENT VS SIMULATION ###############
+##############################################
+
+def plot_comparison( comparison, path = None, show = True ):
+	'''
+	The figure of measurement_vs_simulation/main.py for a Comparison: the quiver of the measured field, the
+	measured lobe (dotted) and the simulated one (dashed and shaded).
+	Saved as svg to path if given. Returns the figure.
+	'''
+	with stage( 'plotting' ):
+		f = _plot_comparison( comparison )
+	return _finish( f, path, show )
+
+def _plot_comparison( comparison ):
+	from matplotlib import pyplot as plt
+
+	setup_style()
+	c = comparison
+	f = plt.figure()
+	ax = f.add_subplot(polar=True)
+
+	ax.quiver(c.t_r, c.r_m, c.u, c.v, np.log( c.m ), scale = 12, width=0.008, clip_on = False, zorder=100 )
+	ax.set_rmax(max(c.r_m)+min(c.r_m))
+	ax.set_thetamax(90)
+	ax.set_xticks(pi/180 * np.linspace(0, 90, 7, endpoint=True))
+	ax.set_rticks([ 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.40])
+	plt.tight_layout(pad = 0.8)
+
+	angles_r = np.array([0, 15, 30, 45, 60, 75, 90])*pi/180
+	( x_lobe, ( y_lobe_meas, y_lobe_sim ) ) = lobe_polar( angles_r, [ c.meas.lobe, c.sim.lobe ] )
+	ax.plot(x_lobe,y_lobe_meas,'k:')
+	ax.plot(x_lobe, y_lobe_sim, 'k--')
+	ax.fill_between(x_lobe,0,y_lobe_sim, alpha=0.075, zorder=0,color='k')
+	return f
@@ -0,0 +1,155 @@
+'''
+Per-stage instrumentation of the region runs: wall time, number of calls and peak allocations of each stage,
+written as a JSON report when the process exits.
+
+The stages are the section banners of max_guaranteed_region/main.py (GETTING THE SIMULATED FIELD VALUES,
+ROTATING theta READER, ROTATING THE TAG, TIME FLATTENING, MINIMUM LOBE, RESIZING THE LOBE, plotting) plus the
+file parsing, curve fitting and svg saving done inside them. Stages nest: a stage's time and peak include those
+of the stages opened inside it.
+
+It is off unless enable() is called or the LFWU_PROFILE environment variable holds the report's path ('-' for
+stderr). While off, stage() returns a shared no-op context manager, so instrumented code only pays a function
+call and a global lookup. Peak allocations come from tracemalloc, which sees the NumPy buffers but slows down
+pure Python code; enable( memory = False ) to time only. Only the process that enabled it writes a report: pool
+workers exit without running atexit handlers.
+'''
+
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+
+_NULL 		= contextlib.nullcontext()
+_profile 	= None
+_registered = False
+
+
+class _Profile:
+
+	def __init__( self, path, memory ):
+		self.path 		= path
+		self.memory 	= memory
+		self.stages 	= {} 		# name -> { 'calls', 'seconds', 'peak_bytes' }, in order of first use
+		self.open 		= [] 		# Stack of [ name, start time, peak so far ]
+		self.current 	= None 		# Stage opened by checkpoint()
+		self.start 		= time.perf_counter()
+		if memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	def _peak( self ):
+		return tracemalloc.get_traced_memory()[1] if self.memory else 0
+
+	def push( self, name ):
+		if self.memory:
+			# The enclosing stage keeps its peak so far, and the peak is reset to measure this one alone.
+			if self.open:
+				self.open[-1][2] = max( self.open[-1][2], self._peak() )
+			tracemalloc.reset_peak()
+		self.open.append( [ name, time.perf_counter(), 0 ] )
+
+	def pop( self ):
+		( name, start, peak ) 	= self.open.pop()
+		elapsed 				= time.perf_counter() - start
+		peak 					= max( peak, self._peak() )
+		if self.open:
+			self.open[-1][2] = max( self.open[-1][2], peak )
+		record = self.stages.setdefault( name, { 'calls': 0, 'seconds': 0.0, 'peak_bytes': 0 } )
+		record['calls'] 		+= 1
+		record['seconds'] 		+= elapsed
+		record['peak_bytes'] 	= max( record['peak_bytes'], peak )
+
+	def report( self ):
+		return {
+			'pid' 		: os.getpid(),
+			'argv' 		: sys.argv,
+			'seconds' 	: time.perf_counter() - self.start,
+			'memory' 	: self.memory,
+			'stages' 	: [ dict( stage = name, **record ) for ( name, record ) in self.stages.items() ],
+		}
+
+	def write( self ):
+		while self.open:
+			self.pop()
+		text = json.dumps( self.report(), indent = 1 )
+		if self.path == '-':
+			print( text, file = sys.stderr )
+		else:
+			with open( self.path, 'w' ) as f:
+				f.write( text )
+
+
+class _Stage:
+
+	__slots__ = [ 'profile', 'name' ]
+
+	def __init__( self, profile, name ):
+		self.profile 	= profile
+		self.name 		= name
+
+	def __enter__( self ):
+		self.profile.push( self.name )
+		return self
+
+	def __exit__( self, *exc ):
+		self.profile.pop()
+		return False
+
+
+##############################################
+#### PUBLIC INTERFACE ########################
+##############################################
+
+def enable( path = '-', memory = True ):
+	'''
+	Starts recording. The report is written to path ('-' for stderr) at exit, or when write_report() is called.
+	'''
+	global _profile, _registered
+	if not _registered:
+		atexit.register( write_report )
+		_registered = True
+	_profile = _Profile( path, memory )
+
+def disable():
+	global _profile
+	_profile = None
+
+def enabled():
+	return _profile is not None
+
+def stage( name ):
+	'''
+	Context manager recording the enclosed code as the stage name.
+	'''
+	if _profile is None:
+		return _NULL
+	return _Stage( _profile, name )
+
+def checkpoint( name ):
+	'''
+	For flat scripts: ends the stage opened by the previous checkpoint() and opens name (None only ends it).
+	'''
+	if _profile is None:
+		return
+	if _profile.current is not None and _profile.open and _profile.open[-1][0] == _profile.current:
+		_profile.pop()
+	_profile.current = name
+	if name is not None:
+		_profile.push( name )
+
+def report():
+	'''
+	The report so far as a dict, or None while disabled.
+	'''
+	return None if _profile is None else _profile.report()
+
+def write_report():
+	if _profile is not None:
+		_profile.write()
+
+
+if os.environ.get( 'LFWU_PROFILE' ):
+	enable( os.environ['LFWU_PROFILE'] )
@@ -0,0 +1,145 @@
+'''
+The whole max_guaranteed_region computation as one function with explicit parameters, without plotting.
+
+Same steps (and same results) as max_guaranteed_region/main.py: getting the field, rotating the reader,
+rotating the tag, time flattening, minimum lobe and resizing. Only NumPy is imported.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from .engine import LobeResult, field_module_angle, rotate_reader, project_on_tag, last_crossing, sweep_from_rotation, phi_grid
+from .field_cache import FieldSet, fingerprint, load_field_set
+from .fitting import decay, decay_inv, fit_decay, near_field_cutoff
+from .profiling import stage
+from .stage_cache import cached
+
+
+THETAS_D 		= [ 0, 15, 30, 45, 60, 75, 90 ]
+PHIS_D 			= [ 0, 45, 90 ]
+ANS_CENTER_M 	= ( 0.0001, 0.0225 )
+
+
+# thetas_d, alphas_d, phis_d: 	Angles used, in degrees (alphas_d are the time steps of the reader's rotation).
+# max_dist_m: 		Max distance at which the tag woke up, in meters.
+# r_m: 				Distances of the lines, in simulation units. Shape (r,)
+# B, gamma_r: 		Field module and angle wrt e_r of every theta. Shape (theta, r)
+# Bth: 				Threshold used for the lobe.
+# lobe: 			LobeResult over phis_d.
+# guar_lobe: 		Minimum guaranteed lobe, over phis_d or over the fine sweep of phi_step_d. Shape (theta,)
+# worst_phi_d: 		Tag orientation giving guar_lobe, with the fine sweep only (None otherwise). Shape (theta,)
+# skip: 			First line used to fit the A.1/r^3 decay.
+# A: 				Coefficient of that fit.
+# r_max_real: 		Distance at which the fitted decay reaches its value at max_dist_m.
+# guar_lobe_real: 	guar_lobe resized to the real distances. Shape (theta,)
+Region = namedtuple( 'Region', [ 'thetas_d', 'alphas_d', 'phis_d', 'max_dist_m', 'r_m', 'B', 'gamma_r', 'Bth', 'lobe', 'guar_lobe', 'worst_phi_d',
+	'skip', 'A', 'r_max_real', 'guar_lobe_real' ] )
+
+
+def field_set( data_dir, thetas_d = THETAS_D, lines_n = 100, ans_file = None, ans_center_m = ANS_CENTER_M, ans_length_m = 0.4,
+		analytic_coil = None, cache = None ):
+	'''
+	The FieldSet the computation starts from: sampled from the FEMM solution ans_file, computed for the air-core
+	coil analytic_coil = ( radius in m, turns, length in m ), or else read from the exports in data_dir.
+	With a StageCache the sampled or computed field is kept there, keyed on the size and mtime of ans_file (the
+	exports in data_dir already have their own cache).
+	'''
+	with stage( 'GETTING THE SIMULATED FIELD VALUES' ):
+		if ans_file:
+			from .femm import read_ans, mesh_field, field_set_from_ans
+			compute = lambda: field_set_from_ans( mesh_field( read_ans( ans_file ) ), ans_center_m, thetas_d, np.linspace( 0, ans_length_m, lines_n ) )
+			source 	= fingerprint( ans_file, with_hash = False )
+		elif analytic_coil:
+			from .loop_coil import coil_field_set
+			compute = lambda: coil_field_set( thetas_d, np.linspace( 0, ans_length_m, lines_n ), *analytic_coil )
+			source 	= list( analytic_coil )
+		else:
+			return load_field_set( data_dir, thetas_d )
+
+		source = [ source, ans_center_m, list( thetas_d ), lines_n, ans_length_m ]
+		if cache is None:
+			return compute()._replace( source = source )
+		key = cache.key( 'field_set', *source )
+		return FieldSet( list( thetas_d ), *cached( cache, key, lambda: compute()[1:4] ), source )
+
+
+def guaranteed_region( field, lines_n = 100, phis_d = PHIS_D, max_dist_m = 5, Bth = None, phi_step_d = 0, alpha_steps = 0,
+		pivot_dist_m = 0.5, near_field_tol = 0.05, cache = None ):
+	'''
+	Computes the Region of the FieldSet field (see field_set()), using its first lines_n lines.
+	Bth = None takes the field on the axis at the last line, B['0'][lines_n -1] in main.py.
+	phi_step_d, alpha_steps and pivot_dist_m are the fine sweep over the tag orientations and the continuous
+	rotation of the reader, as in main.py (0 to disable them).
+	With a StageCache, each stage is loaded back when neither the field nor its own parameters changed: e.g. a
+	new Bth only recomputes the tag projection, the time flattening and the minimum.
+	'''
+	thetas_d 	= list( field.thetas_d )
+	phis_d 		= list( phis_d )
+	i_axis 		= thetas_d.index( 0 )
+
+	# As in main.py, r_m is the grid of the last theta.
+	with stage( 'GETTING THE SIMULATED FIELD VALUES' ):
+		r_m 			= np.asarray( field.r[-1][:lines_n] )
+		if cache is not None:
+			# Keyed on what the field comes from when it is known, so that a cached run neither hashes nor
+			# processes the arrays.
+			if field.source is not None:
+				field_key = cache.key( 'field', thetas_d, lines_n, field.source )
+			else:
+				field_key = cache.key( 'field', thetas_d, *( np.asarray( a[:, :lines_n] ) for a in field[1:4] ) )
+		( B, gamma_r ) = cached( cache, cache and cache.key( 'module', field_key ),
+			lambda: field_module_angle( np.asarray( field.B_et[:, :lines_n] ), np.asarray( field.B_er[:, :lines_n] ) ) )
+
+	alphas_d = list( np.linspace( 0, 90, alpha_steps ) ) if alpha_steps else thetas_d
+
+	def rotation():
+		if alpha_steps:
+			from .rotation import rotation_table, rotate_reader_continuous
+			table = rotation_table( field.r[:, :lines_n], field.B_et[:, :lines_n], field.B_er[:, :lines_n], thetas_d )
+			return rotate_reader_continuous( table, r_m, thetas_d, alphas_d, pivot_dist_m * r_m[lines_n -1] / max_dist_m )
+		return rotate_reader( B, gamma_r, thetas_d, alphas_d )
+
+	# The rotation is only needed when a stage using it is not in the cache.
+	rotated = []
+	def rotated_field():
+		if not rotated:
+			with stage( 'ROTATING theta READER' ):
+				rotated.extend( cached( cache, rot_key, rotation ) )
+		return rotated
+
+	if Bth is None:
+		Bth = B[i_axis][lines_n -1]
+
+	rot_key = None
+	if cache is not None:
+		rot_key = cache.key( 'rotation', field_key, alphas_d, pivot_dist_m * r_m[lines_n -1] / max_dist_m if alpha_steps else None )
+	else:
+		rotated_field()
+
+	# Same steps as lobe_from_rotation(), one stage each.
+	with stage( 'ROTATING THE TAG' ):
+		( r_max_rot_tag, ) = cached( cache, cache and cache.key( 'tag', rot_key, phis_d, Bth ),
+			lambda: ( r_m[ last_crossing( project_on_tag( *rotated_field(), phis_d ), Bth ) ], ) )
+	with stage( 'TIME FLATTENING' ):
+		r_max_flat_time = r_max_rot_tag.max( axis = 1 )
+	with stage( 'MINIMUM LOBE' ):
+		lobe 		= LobeResult( r_max_rot_tag, r_max_flat_time, r_max_flat_time.min( axis = 0 ) )
+		guar_lobe 	= lobe.guar_lobe
+		worst_phi_d = None
+		if phi_step_d:
+			( guar_lobe, worst_phi_d ) = cached( cache, cache and cache.key( 'sweep', rot_key, phi_step_d, Bth ),
+				lambda: sweep_from_rotation( *rotated_field(), r_m, phi_grid( phi_step_d ), Bth )[:2] )
+
+	# Resizing: the fitted decay brings the last line to max_dist_m.
+	with stage( 'RESIZING THE LOBE' ):
+		def resize():
+			skip 		= int( near_field_cutoff( r_m, B[i_axis], tol = near_field_tol ).index )
+			( A, _ ) 	= fit_decay( r_m[skip:], B[i_axis][skip:] )
+			return ( skip, A, decay_inv( decay( max_dist_m, A ), A ) )
+		( skip, A, r_max_real ) = cached( cache, cache and cache.key( 'resize', field_key, max_dist_m, near_field_tol ), resize )
+		if cache is not None:
+			( skip, A, r_max_real ) = ( int( skip ), A[()], r_max_real[()] )
+		guar_lobe_real = guar_lobe * r_max_real * ( 1 / r_m[ lines_n -1 ] )
+
+	return Region( thetas_d, alphas_d, phis_d, max_dist_m, r_m, B, gamma_r, Bth, lobe, guar_lobe, worst_phi_d, skip, A, r_max_real, guar_lobe_real )
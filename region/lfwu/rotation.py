@@ -0,0 +1,136 @@
+'''
+Continuous rotation of the reader.
+
+The index swapping of rotate_reader() only works for rotation steps equal to the simulation grid, and
+rotates the reader about its coil's center. Here the FEMM profiles are put in a dense (theta, r) table once,
+and the field is bilinearly interpolated from it at any reader-frame position, so the reader can be rotated
+any alpha and about a pivot behind the coil (the arm).
+
+Geometry (lab frame, same plane as the simulation):
+* At alpha = 0 the coil's center is at the origin and its axis points along theta = 0.
+* The pivot is pivot_m behind the coil's center, on its axis. Rotating alpha moves the center along a circle
+  of radius pivot_m around it and turns the axis to alpha.
+* The tag is at (r, theta) measured from the origin, and gamma is given wrt the e_r of that position.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from numpy import pi
+
+from .engine import deg_2_rad
+
+
+# thetas_r: Reader-frame angles of the rows, uniform from 0 to pi/2 (in radians). Shape (n_theta,)
+# r: 		Distances of the columns, uniform from 0 (in the units of the FEMM exports). Shape (n_r,)
+# B_er: 	Field on the reader-frame versor e_r. Shape (n_theta, n_r)
+# B_et: 	Field on the reader-frame versor e_theta. Shape (n_theta, n_r)
+RotationTable = namedtuple( 'RotationTable', [ 'thetas_r', 'r', 'B_er', 'B_et' ] )
+
+
+##############################################
+#### INTERPOLATION TABLE #####################
+##############################################
+
+def _resample_r( r_by_theta, values, r ):
+	# FEMM does not sample every line at the same distances, so each one is put on the common grid r.
+	return np.array([ np.interp( r, r_theta, v ) for r_theta, v in zip( r_by_theta, values ) ])
+
+def rotation_table( r_by_theta, B_et, B_er, thetas_d, step_d = 0.5, n_r = None ):
+	'''
+	Builds the RotationTable from the FEMM profiles of the angles thetas_d (which must span 0 to 90 deg).
+	r_by_theta, B_et and B_er have shape (len(thetas_d), n), as in a FieldSet.
+	The table has a row every step_d degrees (linearly interpolated between the FEMM angles) and n_r uniform
+	columns (n by default) up to the shortest of the profiles.
+	'''
+	r_by_theta 	= np.asarray( r_by_theta )
+	thetas 		= np.asarray( thetas_d, dtype = float )
+	if thetas.min() != 0 or thetas.max() != 90:
+		raise ValueError( "thetas_d must span 0 to 90 deg" )
+	if n_r is None:
+		n_r = r_by_theta.shape[1]
+
+	r 		= np.linspace( 0, r_by_theta[:, -1].min(), n_r )
+	order 	= np.argsort( thetas )
+	B_er_r 	= _resample_r( r_by_theta[order], np.asarray( B_er )[order], r )
+	B_et_r 	= _resample_r( r_by_theta[order], np.asarray( B_et )[order], r )
+
+	rows 	= np.linspace( 0, 90, int( round( 90 / step_d ) ) + 1 )
+	# Linear interpolation in theta, as weights between the two surrounding FEMM angles.
+	hi 		= np.clip( np.searchsorted( thetas[order], rows, side = 'right' ), 1, len( thetas ) - 1 )
+	lo 		= hi - 1
+	w 		= ( ( rows - thetas[order][lo] ) / ( thetas[order][hi] - thetas[order][lo] ) )[:, None]
+
+	return RotationTable(
+		rows * deg_2_rad,
+		r,
+		B_er_r[lo]*( 1 - w ) + B_er_r[hi]*w,
+		B_et_r[lo]*( 1 - w ) + B_et_r[hi]*w,
+	)
+
+def field_at( table, r, theta_r ):
+	'''
+	Reader-frame field (B_er, B_et) at distances r and angles theta_r in [0, pi/2], bilinear on the table.
+	Beyond the last column the field is extrapolated with the 1/r^3 decay of the far field.
+	'''
+	r 			= np.asarray( r, dtype = float )
+	dr 			= table.r[1] - table.r[0]
+	dt 			= table.thetas_r[1] - table.thetas_r[0]
+	n_t 		= len( table.thetas_r )
+	n_r 		= len( table.r )
+
+	x 	= np.clip( r / dr, 0, n_r - 1 )
+	y 	= np.clip( np.asarray( theta_r ) / dt, 0, n_t - 1 )
+	i 	= np.minimum( x.astype( int ), n_r - 2 )
+	j 	= np.minimum( y.astype( int ), n_t - 2 )
+	u 	= x - i
+	v 	= y - j
+
+	def bilinear( values ):
+		return ( values[j, i]*( 1 - u )*( 1 - v ) + values[j, i + 1]*u*( 1 - v )
+			+ values[j + 1, i]*( 1 - u )*v + values[j + 1, i + 1]*u*v )
+
+	decay = np.where( r > table.r[-1], ( table.r[-1] / np.maximum( r, table.r[-1] ) )**3, 1 )
+	return ( bilinear( table.B_er )*decay, bilinear( table.B_et )*decay )
+
+
+##############################################
+#### ROTATING THE READER #####################
+##############################################
+
+def rotate_reader_continuous( table, r_m, thetas_d, alphas_d, pivot_m = 0 ):
+	'''
+	The field module and angle gamma wrt e_r for a tag at each (theta, r) of the lab grid thetas_d x r_m, with
+	the reader rotated each of alphas_d (in degrees, any value) about a pivot pivot_m behind its coil.
+	Returns B_rot and gamma_rot_r with shape (alpha, theta, r), as rotate_reader() does.
+
+	The reader-frame position of the tag is folded into the simulated quadrant with the symmetries of the coil
+	(about its axis and about its plane), and the field angle is unfolded accordingly. At pivot_m = 0 and
+	alphas_d on the grid this gives the same B as rotate_reader(), while gamma changes sign for theta < alpha,
+	which the index swapping does not account for.
+	'''
+	alphas 	= np.asarray( alphas_d, dtype = float )[:, None, None] * deg_2_rad
+	thetas 	= np.asarray( thetas_d, dtype = float )[None, :, None] * deg_2_rad
+	r 		= np.asarray( r_m, dtype = float )[None, None, :]
+
+	# Tag position relative to the coil's center, in the reader frame (x along its axis).
+	x = r*np.cos( thetas - alphas ) - pivot_m*( 1 - np.cos( alphas ) )
+	y = r*np.sin( thetas - alphas ) - pivot_m*np.sin( alphas )
+
+	r_rd 		= np.hypot( x, y )
+	theta_rd 	= np.arctan2( y, x ) 		# Signed, in (-pi, pi]
+	folded 		= np.abs( theta_rd )
+	behind 		= folded > pi/2
+	folded 		= np.where( behind, pi - folded, folded )
+
+	( B_er, B_et ) = field_at( table, r_rd, folded )
+	# Unfolding: mirroring about the axis flips B_et, mirroring about the coil's plane flips B_er.
+	B_et = np.where( theta_rd < 0, -B_et, B_et )
+	B_er = np.where( behind, -B_er, B_er )
+
+	# Angle of B in the lab frame, taken wrt the e_r of the tag position and wrapped to (-pi/2, pi/2] since only
+	# the direction of the field line matters.
+	gamma 	= alphas + theta_rd + np.arctan2( B_et, B_er ) - thetas
+	gamma 	= pi/2 - np.mod( pi/2 - gamma, pi )
+
+	return ( np.hypot( B_er, B_et ), gamma )
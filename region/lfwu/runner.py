@@ -0,0 +1,143 @@
+'''
+Parameter sweeps of the guaranteed-region computation over a process pool.
+
+A grid is every combination of data directories, lines_n, tag orientation sets phis_d, thresholds Bth and
+max_dist_m. The combinations sharing (data_dir, lines_n, phis_d) also share the rotated and projected field,
+so they are grouped and each group is computed once, with all its thresholds in a single lobe_curve().
+The workers do not receive the field arrays: they memory-map the binary cache of load_field_set(), which the
+parent builds beforehand, so every process reads the same pages of the OS cache and the tasks only carry the
+parameters.
+'''
+
+import itertools
+import os
+
+import numpy as np
+
+from .engine import field_module_angle, rotate_reader, lobe_curve
+from .field_cache import load_field_set
+
+
+THETAS_D = [ 0, 15, 30, 45, 60, 75, 90 ]
+
+
+##############################################
+#### THE GRID ################################
+##############################################
+
+def param_grid( data_dir, lines_n = ( 100, ), phis_d = ( ( 0, 45, 90 ), ), Bth = ( None, ), max_dist_m = ( 5, ) ):
+	'''
+	Every combination of the given values, as a list of dicts with those keys.
+	data_dir may be a single directory. Bth = None stands for main.py's threshold, the field on the axis at the
+	last line (B['0'][lines_n-1]).
+	'''
+	if isinstance( data_dir, str ):
+		data_dir = [ data_dir ]
+	keys = [ 'data_dir', 'lines_n', 'phis_d', 'Bth', 'max_dist_m' ]
+	return [ dict( zip( keys, values ) ) for values in itertools.product( data_dir, lines_n, [ tuple( p ) for p in phis_d ], Bth, max_dist_m ) ]
+
+
+##############################################
+#### WORKERS #################################
+##############################################
+
+_rotated = {}	# Per process: (data_dir, lines_n) -> (B_rot, gamma_rot_r, r_m, default Bth)
+
+def _rotation( data_dir, lines_n, thetas_d ):
+	key = ( data_dir, lines_n )
+	if key not in _rotated:
+		field 			= load_field_set( data_dir, thetas_d )
+		( B, gamma_r ) 	= field_module_angle( field.B_et[:, :lines_n], field.B_er[:, :lines_n] )
+		( B_rot, gamma_rot_r ) = rotate_reader( B, gamma_r, thetas_d, thetas_d )
+		# As in main.py, r_m is the grid of the last theta.
+		_rotated[key] 	= ( B_rot, gamma_rot_r, np.asarray( field.r[-1][:lines_n] ), B[ list( thetas_d ).index( 0 ) ][lines_n - 1] )
+	return _rotated[key]
+
+def _evaluate_group( data_dir, lines_n, phis_d, Bths, thetas_d ):
+	'''
+	guar_lobe (in simulation units) for each of the thresholds Bths, shape (len(Bths), theta), and the thresholds
+	actually used.
+	'''
+	( B_rot, gamma_rot_r, r_m, Bth_axis ) = _rotation( data_dir, lines_n, thetas_d )
+	Bths 		= np.array([ Bth_axis if Bth is None else Bth for Bth in Bths ], dtype = float )
+	lobes 		= lobe_curve( B_rot, gamma_rot_r, r_m, phis_d, Bths ).guar_lobe
+	return ( lobes, Bths, r_m[-1] )
+
+def _run_groups( groups, thetas_d ):
+	return [ _evaluate_group( *group, thetas_d ) for group in groups ]
+
+
+##############################################
+#### RUNNING #################################
+##############################################
+
+def _group( grid ):
+	# (data_dir, lines_n, phis_d) -> indices in grid and their thresholds
+	groups = {}
+	for ( i, point ) in enumerate( grid ):
+		( indices, Bths ) = groups.setdefault( ( point['data_dir'], point['lines_n'], point['phis_d'] ), ( [], [] ) )
+		indices.append( i )
+		Bths.append( point['Bth'] )
+	return groups
+
+def table_dtype( n_thetas, dir_len = 256 ):
+	return np.dtype([
+		( 'data_dir', 		'U%d' % dir_len ),
+		( 'lines_n', 		int ),
+		( 'phis_d', 		'U64' ),
+		( 'Bth', 			float ),
+		( 'max_dist_m', 	float ),
+		( 'guar_lobe', 		float, ( n_thetas, ) ),		# In simulation units, as main.py's guar_lobe
+		( 'guar_lobe_m', 	float, ( n_thetas, ) ),		# Resized so that the last line is at max_dist_m, as guar_lobe_real
+	])
+
+def run_grid( grid, thetas_d = THETAS_D, workers = None, chunks_per_worker = 4 ):
+	'''
+	Evaluates every point of grid (see param_grid()) and returns one structured array with a row per point, in
+	the same order (see table_dtype()).
+	workers = 1 runs everything in this process; None uses every core.
+	'''
+	thetas_d 	= list( thetas_d )
+	groups 		= _group( grid )
+	keys 		= list( groups )
+	if workers is None:
+		workers = os.cpu_count() or 1
+
+	# Built (or checked) once here, so that the workers only map it.
+	for data_dir in { key[0] for key in keys }:
+		load_field_set( data_dir, thetas_d )
+
+	tasks 	= [ key + ( groups[key][1], ) for key in keys ]
+	if workers == 1 or len( tasks ) == 1:
+		results = _run_groups( tasks, thetas_d )
+	else:
+		from concurrent.futures import ProcessPoolExecutor
+		# Contiguous slices, so the groups of the same (data_dir, lines_n) tend to reuse a worker's rotation.
+		n_chunks 	= min( len( tasks ), workers*chunks_per_worker )
+		bounds 		= np.linspace( 0, len( tasks ), n_chunks + 1 ).astype( int )
+		with ProcessPoolExecutor( max_workers = workers ) as pool:
+			futures = [ pool.submit( _run_groups, tasks[lo:hi], thetas_d ) for ( lo, hi ) in zip( bounds[:-1], bounds[1:] ) ]
+			results = [ result for future in futures for result in future.result() ]
+
+	table = np.zeros( len( grid ), dtype = table_dtype( len( thetas_d ), max( len( p['data_dir'] ) for p in grid ) ) )
+	for ( key, ( lobes, Bths, r_last ) ) in zip( keys, results ):
+		indices = groups[key][0]
+		for ( i, lobe, Bth ) in zip( indices, lobes, Bths ):
+			point = grid[i]
+			table[i] = ( point['data_dir'], point['lines_n'], ' '.join( str( p ) for p in point['phis_d'] ), Bth, point['max_dist_m'],
+				lobe, lobe * point['max_dist_m'] / r_last )
+	return table
+
+
+def write_table( path, table, thetas_d = THETAS_D ):
+	'''
+	Writes the table of run_grid() as a csv, with a guar_lobe and a guar_lobe_m column per theta.
+	'''
+	header = [ 'data_dir', 'lines_n', 'phis_d', 'Bth', 'max_dist_m' ]
+	header += [ 'guar_lobe_%s' % t for t in thetas_d ] + [ 'guar_lobe_m_%s' % t for t in thetas_d ]
+	with open( path, 'w' ) as f:
+		f.write( ','.join( header ) + '\n' )
+		for row in table:
+			values = [ row['data_dir'], str( row['lines_n'] ), row['phis_d'], repr( float( row['Bth'] ) ), repr( float( row['max_dist_m'] ) ) ]
+			values += [ repr( float( v ) ) for v in row['guar_lobe'] ] + [ repr( float( v ) ) for v in row['guar_lobe_m'] ]
+			f.write( ','.join( values ) + '\n' )
@@ -0,0 +1,122 @@
+'''
+On-disk cache of the region pipeline stages, for what-if sessions.
+
+Each stage's result is stored under a key hashed from the stage name, its parameters and the keys of the stages
+it takes its inputs from. Changing Bth therefore changes the key of the tag projection (and of what follows it)
+but not the key of the reader's rotation, which is loaded back instead of recomputed.
+
+Entries are .npz files of the stage's arrays in one directory. A hit refreshes the entry's mtime, and after each
+write the entries least recently used, other than the one just written, are deleted until the directory holds
+at most max_bytes.
+'''
+
+import hashlib
+import os
+
+import numpy as np
+
+
+class StageCache:
+
+	def __init__( self, cache_dir, max_bytes = 256 << 20 ):
+		self.cache_dir 	= cache_dir
+		self.max_bytes 	= max_bytes
+		self.hits 		= 0
+		self.misses 	= 0
+		os.makedirs( cache_dir, exist_ok = True )
+
+	def key( self, stage, *parts ):
+		'''
+		The key of stage for the given parameters: arrays, numbers, strings, None and nested lists, tuples
+		and dicts of them (upstream keys are strings).
+		'''
+		h = hashlib.sha1( stage.encode() )
+		for part in parts:
+			_feed( h, part )
+		return stage.replace( ' ', '_' ) + '-' + h.hexdigest()
+
+	def _path( self, key ):
+		return os.path.join( self.cache_dir, key + '.npz' )
+
+	def get( self, key ):
+		'''
+		The tuple of arrays stored under key, or None.
+		'''
+		path = self._path( key )
+		try:
+			with np.load( path ) as f:
+				arrays = tuple( f['arr_%d' % i] for i in range( len( f.files ) ) )
+			os.utime( path )
+		except ( OSError, ValueError, KeyError ):
+			self.misses += 1
+			return None
+		self.hits += 1
+		return arrays
+
+	def put( self, key, arrays ):
+		path = self._path( key )
+		# Written to a temporary file and then moved, as the field cache, so a concurrent run never reads half of it.
+		np.savez( path + '.tmp.npz', *arrays )
+		os.replace( path + '.tmp.npz', path )
+		self.evict( keep = key )
+
+	def evict( self, keep = None ):
+		'''
+		Deletes the least recently used entries until the cache holds at most max_bytes. The entry of key keep
+		is never deleted (it still counts in the total), so the stage just stored is there for the next lookup
+		even when it is larger than max_bytes alone.
+		'''
+		entries = []
+		total 	= 0
+		for name in os.listdir( self.cache_dir ):
+			if name.endswith( '.npz' ) and not name.endswith( '.tmp.npz' ):
+				st = os.stat( os.path.join( self.cache_dir, name ) )
+				total += st.st_size
+				if keep is not None and name == keep + '.npz':
+					continue
+				entries.append( ( st.st_mtime_ns, st.st_size, name ) )
+		for ( _, size, name ) in sorted( entries ):
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove( os.path.join( self.cache_dir, name ) )
+			except OSError:
+				pass
+			total -= size
+
+	def clear( self ):
+		for name in os.listdir( self.cache_dir ):
+			if name.endswith( '.npz' ):
+				os.remove( os.path.join( self.cache_dir, name ) )
+
+
+def _feed( h, part ):
+	if isinstance( part, np.ndarray ):
+		a = np.ascontiguousarray( part )
+		h.update( ( 'a%s%s' % ( a.dtype.str, a.shape ) ).encode() )
+		h.update( a.tobytes() )
+	elif isinstance( part, ( list, tuple ) ):
+		h.update( b'(' )
+		for p in part:
+			_feed( h, p )
+		h.update( b')' )
+	elif isinstance( part, dict ):
+		_feed( h, sorted( part.items() ) )
+	elif isinstance( part, ( bool, np.bool_ ) ) or part is None or isinstance( part, str ):
+		h.update( ( '%r,' % ( part, ) ).encode() )
+	else:
+		# Numbers: 45, 45.0 and np.float64( 45 ) are the same parameter.
+		h.update( ( '%r,' % float( part ) ).encode() )
+
+
+def cached( cache, key, fn ):
+	'''
+	The tuple of arrays returned by fn, loaded from cache under key when there (no cache: fn is just called).
+	'''
+	if cache is None:
+		return fn()
+	arrays = cache.get( key )
+	if arrays is None:
+		arrays = tuple( np.asarray( a ) for a in fn() )
+		cache.put( key, arrays )
+	return arrays
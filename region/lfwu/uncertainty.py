@@ -0,0 +1,144 @@
+'''
+Confidence intervals of the fitted lobes.
+
+measured_lobe() fits A.1/r^3 on 6 points per angle and only reports the standard errors of A. Here the fit is
+repeated on thousands of resampled data sets and every replicate goes through the same decay_inv() (and, for the
+band of the figure, the same spline) as the lobe itself, so that the intervals are those of the lobe:
+* 'residuals': the fitted curve plus the residuals of the block drawn with replacement (default).
+* 'pairs': the (distance, value) points of the block drawn with replacement.
+* 'parametric': A drawn from a normal with the fitted standard error (perr).
+All the replicates of a chunk are one array computation: fit_decay() takes a leading replicate axis. The chunks
+have their own random streams, spawned from the seed, so the result does not depend on how many processes run
+them.
+
+The simulated guar_lobe has no fit of its own: its threshold is the field at the last line, which stands for the
+value measured at max_dist_m. That value comes from the 0 deg fit, so each replicate moves the threshold by the
+ratio of its A to the fitted one, and all these thresholds go through a single lobe_curve().
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from .engine import field_module_angle, rotate_reader, lobe_curve
+from .fitting import decay, decay_inv, fit_decay
+from .measurement import ANGLES_N, BLOCK_N
+
+
+METHODS = ( 'residuals', 'pairs', 'parametric' )
+
+
+# estimate: 	Value of the fit on the data. Shape (...,)
+# low, high: 	Bounds of the confidence interval (percentiles of the replicates). Shape (...,)
+# std: 			Standard deviation of the replicates. Shape (...,)
+Interval = namedtuple( 'Interval', [ 'estimate', 'low', 'high', 'std' ] )
+
+# lobe: 		Interval of the normalized lobe (norm_Vth_dist_m). Shape (angle,)
+# th_max_dist: 	Interval of the value at max_dist_m of the 0 deg fit (Vth_max_dist).
+# A: 			Fitted coefficients of every replicate. Shape (n, angle)
+# spline: 		( X_, low, high ): band of the smoothed lobe (see plots.lobe_polar()), or None.
+LobeBootstrap = namedtuple( 'LobeBootstrap', [ 'lobe', 'th_max_dist', 'A', 'spline' ] )
+
+
+def interval( estimate, replicates, level = 0.95 ):
+	'''
+	The percentile Interval of replicates (leading axis) around estimate.
+	'''
+	( low, high ) = np.quantile( replicates, [ ( 1 - level ) / 2, ( 1 + level ) / 2 ], axis = 0 )
+	return Interval( estimate, low, high, replicates.std( axis = 0 ) )
+
+
+##############################################
+#### RESAMPLING ##############################
+##############################################
+
+def _replicate_fits( x, y, A, perr, method, n, seed ):
+	# n fits of every block of x, y (shape (angle, m)). Returns shape (n, angle).
+	rng = np.random.default_rng( seed )
+	if method == 'parametric':
+		return A + perr*rng.standard_normal( ( n, ) + A.shape )
+
+	draw = rng.integers( 0, x.shape[-1], ( n, ) + x.shape )
+	rows = np.arange( x.shape[0] )[:, None]
+	if method == 'pairs':
+		return fit_decay( x[rows, draw], y[rows, draw] )[0]
+	fitted = A[:, None]*x**-3.
+	return fit_decay( x, fitted + ( y - fitted )[rows, draw] )[0]
+
+def _replicate_chunk( args ):
+	return _replicate_fits( *args )
+
+def bootstrap_fits( x, y, n = 10000, method = 'residuals', seed = None, chunk = 2000, workers = 1 ):
+	'''
+	The coefficients A of n resampled fits of each block of x, y (shape (angle, m)). Returns shape (n, angle).
+	The chunks of at most chunk replicates go through a pool of workers processes when workers > 1.
+	'''
+	if method not in METHODS:
+		raise ValueError( "method must be one of %s" % ( METHODS, ) )
+	( x, y ) 	= ( np.asarray( x, dtype = float ), np.asarray( y, dtype = float ) )
+	( A, perr ) = fit_decay( x, y )
+	sizes 		= [ min( chunk, n - start ) for start in range( 0, n, chunk ) ]
+	seeds 		= np.random.SeedSequence( seed ).spawn( len( sizes ) )
+	tasks 		= [ ( x, y, A, perr, method, size, s ) for ( size, s ) in zip( sizes, seeds ) ]
+
+	if workers > 1 and len( tasks ) > 1:
+		from concurrent.futures import ProcessPoolExecutor
+		with ProcessPoolExecutor( max_workers = workers ) as pool:
+			return np.concatenate( list( pool.map( _replicate_chunk, tasks ) ) )
+	return np.concatenate([ _replicate_chunk( task ) for task in tasks ])
+
+
+##############################################
+#### INTERVALS ###############################
+##############################################
+
+def bootstrap_lobe( distances_m, module, max_dist_m = 5, angles_n = ANGLES_N, block_n = BLOCK_N, skip = 1, n = 10000, method = 'residuals',
+		level = 0.95, spline_n = 0, seed = None, chunk = 2000, workers = 1 ):
+	'''
+	Confidence intervals of measured_lobe() (same arguments, but skip must be a number of rows), from n resampled
+	fits. With spline_n the band of the lobe smoothed over spline_n angles is computed too (scipy is then
+	imported). Returns a LobeBootstrap.
+	'''
+	if skip is None:
+		raise ValueError( "the bootstrap needs a fixed skip" )
+	distances_m = np.asarray( distances_m, dtype = float )
+	module 		= np.asarray( module, dtype = float )
+	blocks 		= np.arange( angles_n )[:, None]*block_n + np.arange( skip, block_n - 1 )
+	( x, y ) 	= ( distances_m[blocks], module[blocks] )
+
+	( A, _ ) 	= fit_decay( x, y )
+	A_rep 		= bootstrap_fits( x, y, n, method, seed, chunk, workers )
+	norm 		= distances_m.max() / max_dist_m
+
+	# The same steps as measured_lobe(), with a leading replicate axis.
+	th_max_dist 	= decay( max_dist_m, A[0] )
+	th_rep 			= decay( max_dist_m, A_rep[:, 0] )
+	lobe 			= decay_inv( th_max_dist, A ) * norm
+	lobe_rep 		= decay_inv( th_rep[:, None], A_rep ) * norm
+
+	spline = None
+	if spline_n:
+		from .plots import lobe_basis
+		( X_, basis ) 	= lobe_basis( np.linspace( 0, np.pi/2, angles_n ), spline_n )
+		band 			= interval( basis @ lobe, lobe_rep @ basis.T, level )
+		spline 			= ( X_, band.low, band.high )
+
+	return LobeBootstrap( interval( lobe, lobe_rep, level ), interval( th_max_dist, th_rep, level ), A_rep, spline )
+
+
+def bootstrap_guar_lobe( field, A_rep, A_0, lines_n = 100, phis_d = ( 0, 45, 90 ), Bth = None, level = 0.95 ):
+	'''
+	Interval of the guar_lobe of the FieldSet field (as max_guaranteed_region/main.py computes it, in simulation
+	units) when the threshold moves with the replicates A_rep of the 0 deg fit (shape (n,)), A_0 being the fit
+	on the data. Bth = None is main.py's threshold.
+	'''
+	thetas_d 		= list( field.thetas_d )
+	r_m 			= np.asarray( field.r[-1][:lines_n] )
+	( B, gamma_r ) 	= field_module_angle( np.asarray( field.B_et[:, :lines_n] ), np.asarray( field.B_er[:, :lines_n] ) )
+	if Bth is None:
+		Bth = B[ thetas_d.index( 0 ) ][lines_n -1]
+	( B_rot, gamma_rot_r ) = rotate_reader( B, gamma_r, thetas_d, thetas_d )
+
+	guar_lobe 	= lobe_curve( B_rot, gamma_rot_r, r_m, phis_d, [ Bth ] ).guar_lobe[0]
+	replicates 	= lobe_curve( B_rot, gamma_rot_r, r_m, phis_d, Bth * np.asarray( A_rep ) / A_0 ).guar_lobe
+	return interval( guar_lobe, replicates, level )
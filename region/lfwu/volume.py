@@ -0,0 +1,225 @@
+'''
+3D guaranteed wake-up volume.
+
+The planar model only has tags in the plane of the reader's swing, oriented in that plane. Here the tag can be
+anywhere around the reader and its coil's axis can point anywhere on the sphere, using the axisymmetric field of
+the RotationTable (see rotation.py).
+
+Geometry (lab frame, the reader at alpha = 0):
+* x is the reader's axis, the swing turns it about z towards y (so z = 0 is the plane of the planar model).
+* A tag position is (r, theta, psi): theta from the axis (0 to 180 deg) and psi about it, from y towards z.
+* The swing is the one of rotation.py: the reader turns alpha about a pivot pivot_m behind its coil's center.
+* A tag with the unit axis n gets the flux |B.n|, and wakes up when it is above Bth.
+
+The guaranteed volume is star-shaped: along each direction (theta, psi), r_max is the last distance where every
+orientation gets above Bth at some time step. This is the planar pipeline (last crossing, max over time, min over
+orientations) with one more angle for the position and the orientation on the sphere. It is evaluated in chunks
+of directions (and orientations) so that the arrays never exceed max_bytes, whatever the grid density.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from numpy import pi
+
+from .engine import deg_2_rad, last_crossing
+from .profiling import stage
+from .rotation import rotation_table, field_at
+
+
+# thetas_d, psis_d: 	Directions of the tag positions, in degrees. Shapes (theta,) and (psi,)
+# r_max: 				Guaranteed distance along each direction, in the units of r_m. Shape (theta, psi)
+# normals: 			Tag orientations (unit axes) used. Shape (N, 3)
+# worst_normal: 		Index in normals of the orientation giving r_max. Shape (theta, psi)
+# volume: 				Volume inside r_max, in the units of r_m cubed (psis_d must cover the full circle evenly).
+Volume = namedtuple( 'Volume', [ 'thetas_d', 'psis_d', 'r_max', 'normals', 'worst_normal', 'volume' ] )
+
+
+##############################################
+#### GRIDS ###################################
+##############################################
+
+def orientation_grid( step_d = 10, max_tilt_d = 90 ):
+	'''
+	Unit axes of tag orientations about every step_d degrees over the half sphere (n and -n get the same flux):
+	polar angles from the z axis every step_d, each ring with as many azimuths as fit its circumference (on the
+	equator, half of them). Shape (N, 3)
+	With max_tilt_d < 90 only the axes within max_tilt_d of the swing plane are kept (the equator is the planar
+	model's orientations). A tag whose axis is along z never sees the field in that plane, so over the whole
+	sphere the guaranteed volume is empty at psi = 0 and 180.
+	'''
+	normals = []
+	for beta_d in np.linspace( 0, 90, int( round( 90 / step_d ) ) + 1 ):
+		if beta_d < 90 - max_tilt_d:
+			continue
+		beta 	= beta_d * deg_2_rad
+		span 	= 180 if beta_d == 90 else 360
+		n 		= max( 1, int( round( span * np.sin( beta ) / step_d ) ) )
+		chis 	= np.arange( n ) * span / n * deg_2_rad
+		normals.append( np.column_stack([ np.sin( beta )*np.cos( chis ), np.sin( beta )*np.sin( chis ), np.full( n, np.cos( beta ) ) ]) )
+	return np.vstack( normals )
+
+def solid_angles( thetas_d, psis_d ):
+	'''
+	Solid angle of the cell around each direction, with the theta cells bounded halfway between the given
+	angles (and by 0 and 180 deg), and psis_d taken as an even split of the full circle. Shape (theta, psi)
+	'''
+	thetas 	= np.asarray( thetas_d, dtype = float ) * deg_2_rad
+	edges 	= np.concatenate([ [ 0 ], ( thetas[1:] + thetas[:-1] ) / 2, [ pi ] ])
+	band 	= 2*pi*( np.cos( edges[:-1] ) - np.cos( edges[1:] ) )
+	return np.repeat( band[:, None] / len( psis_d ), len( psis_d ), axis = 1 )
+
+
+##############################################
+#### FIELD IN 3D #############################
+##############################################
+
+def field_vectors( table, q ):
+	'''
+	Field vectors in the reader's frame at the reader-frame points q (x along the coil's axis). Shape of q, (..., 3).
+	The table covers the quadrant in front of the coil: the rest is unfolded with its symmetries, as in
+	rotate_reader_continuous().
+	'''
+	x 		= q[..., 0]
+	rho 	= np.hypot( q[..., 1], q[..., 2] )
+	r 		= np.hypot( x, rho )
+	theta 	= np.arctan2( rho, x ) 		# From the axis, in [0, pi]
+	behind 	= theta > pi/2
+
+	( B_er, B_et ) = field_at( table, r, np.where( behind, pi - theta, theta ) )
+	B_er = np.where( behind, -B_er, B_er )
+
+	# Unit vectors e_r and e_theta of the meridian plane through q. On the axis (up to rounding: sin( pi ) is not
+	# 0) any meridian will do, and the field is along it: the table's B_et there is the exports' noise, which
+	# must not go in any direction.
+	on_axis = rho <= 1e-12*r
+	B_et 	= np.where( on_axis, 0, B_et )
+	rho_y 	= np.where( on_axis, 1, q[..., 1] / np.where( on_axis, 1, rho ) )
+	rho_z 	= np.where( on_axis, 0, q[..., 2] / np.where( on_axis, 1, rho ) )
+	( cos_t, sin_t ) = ( np.cos( theta ), np.where( on_axis, 0, np.sin( theta ) ) )
+
+	B = np.empty( q.shape )
+	B[..., 0] = B_er*cos_t - B_et*sin_t
+	B[..., 1] = ( B_er*sin_t + B_et*cos_t )*rho_y
+	B[..., 2] = ( B_er*sin_t + B_et*cos_t )*rho_z
+	return B
+
+def swept_field( table, r_m, thetas_r, psis_r, alphas_d, pivot_m = 0 ):
+	'''
+	Lab-frame field at the positions ( r_m x directions ) for every time step of the swing.
+	thetas_r and psis_r are the directions, in radians, shape (D,). Returns shape (D, alpha, r, 3).
+	'''
+	r 		= np.asarray( r_m, dtype = float )[None, :, None]
+	P 		= np.stack([ np.cos( thetas_r ), np.sin( thetas_r )*np.cos( psis_r ), np.sin( thetas_r )*np.sin( psis_r ) ], axis = -1 )
+	P 		= P[:, None, :] * r 		# (D, r, 3)
+
+	B = np.empty( ( len( thetas_r ), len( alphas_d ), P.shape[1], 3 ) )
+	for ( k, alpha ) in enumerate( np.asarray( alphas_d, dtype = float ) * deg_2_rad ):
+		( c, s ) = ( np.cos( alpha ), np.sin( alpha ) )
+		# Into the reader's frame: turned back alpha about z, and relative to the displaced coil's center.
+		q = np.empty( P.shape )
+		q[..., 0] = c*P[..., 0] + s*P[..., 1] - pivot_m*( 1 - c )
+		q[..., 1] = -s*P[..., 0] + c*P[..., 1] - pivot_m*s
+		q[..., 2] = P[..., 2]
+		B_rd = field_vectors( table, q )
+		# And the field back to the lab frame.
+		B[:, k, :, 0] = c*B_rd[..., 0] - s*B_rd[..., 1]
+		B[:, k, :, 1] = s*B_rd[..., 0] + c*B_rd[..., 1]
+		B[:, k, :, 2] = B_rd[..., 2]
+	return B
+
+
+##############################################
+#### GUARANTEED VOLUME #######################
+##############################################
+
+def guaranteed_volume( table, r_m, thetas_d, psis_d, alphas_d, normals, Bth, pivot_m = 0, max_bytes = 1 << 28 ):
+	'''
+	The Volume of the tag positions r_m x thetas_d x psis_d where every tag orientation of normals (shape (N, 3),
+	see orientation_grid()) gets a flux above Bth at some time step alphas_d (in degrees) of the swing.
+	r_m must be increasing and in the units of the table, as pivot_m.
+	The directions (and if needed the orientations) are evaluated in chunks of at most about max_bytes.
+	'''
+	r_m 		= np.asarray( r_m, dtype = float )
+	normals 	= np.asarray( normals, dtype = float )
+	( T, P ) 	= ( len( thetas_d ), len( psis_d ) )
+	( A, R, N ) = ( len( alphas_d ), len( r_m ), len( normals ) )
+
+	( thetas_r, psis_r ) = np.meshgrid( np.asarray( thetas_d, dtype = float ) * deg_2_rad, np.asarray( psis_d, dtype = float ) * deg_2_rad, indexing = 'ij' )
+	( thetas_r, psis_r ) = ( thetas_r.ravel(), psis_r.ravel() )
+
+	# A tag wakes up at r if the flux is above Bth at any time step, so the last crossing of the time-flattened
+	# flux is the time-flattened last crossing and the time axis is reduced first.
+	# Bytes per direction: the field (3 floats) and, per orientation, the flux at every time step (a float).
+	per_normal 	= A*R*8
+	n_chunk 	= int( min( N, max( 1, ( max_bytes - A*R*24 ) // per_normal ) ) )
+	d_chunk 	= int( max( 1, max_bytes // ( A*R*24 + per_normal*n_chunk ) ) )
+
+	r_max 	= np.empty( T*P )
+	worst 	= np.empty( T*P, dtype = int )
+	for start in range( 0, T*P, d_chunk ):
+		stop 	= min( start + d_chunk, T*P )
+		B 		= swept_field( table, r_m, thetas_r[start:stop], psis_r[start:stop], alphas_d, pivot_m )
+		B 		= B.transpose( 0, 2, 1, 3 ) 		# (D, r, alpha, 3)
+		# No orientation gets more than the module, so the distances past its last crossing are left out.
+		reach 	= last_crossing( np.linalg.norm( B, axis = -1 ).max( axis = 2 ), Bth ).max() + 1
+		B 		= B[:, :reach]
+		best 	= np.full( stop - start, np.iinfo( np.intp ).max )
+		best_n 	= np.zeros( stop - start, dtype = int )
+		for n_start in range( 0, N, n_chunk ):
+			flux 		= np.abs( B @ normals[n_start:n_start + n_chunk].T ).max( axis = 2 ) 		# (D, r, n)
+			flat_time 	= last_crossing( flux.transpose( 0, 2, 1 ), Bth ) 						# (D, n)
+			lowest 		= flat_time.argmin( axis = 1 )
+			value 		= flat_time[ np.arange( len( lowest ) ), lowest ]
+			lower 		= value < best
+			best[lower] 	= value[lower]
+			best_n[lower] 	= lowest[lower] + n_start
+		r_max[start:stop] = r_m[best]
+		worst[start:stop] = best_n
+
+	r_max 	= r_max.reshape( T, P )
+	volume 	= float( np.sum( r_max**3 / 3 * solid_angles( thetas_d, psis_d ) ) )
+	return Volume( list( thetas_d ), list( psis_d ), r_max, normals, worst.reshape( T, P ), volume )
+
+def field_volume( field, lines_n = 100, max_dist_m = 5, Bth = None, theta_step_d = 10, psi_step_d = 10, tilt_step_d = 15, max_tilt_d = 90,
+		alpha_step_d = 15, pivot_dist_m = 0.5, max_bytes = 1 << 28 ):
+	'''
+	The guaranteed Volume of the FieldSet field (see region.field_set()) with the defaults of guaranteed_region():
+	its first lines_n lines, Bth = None for the field on the axis at the last line, the reader swung from 0 to
+	90 deg (every alpha_step_d) about a pivot pivot_dist_m behind the coil. Tag positions every theta_step_d and
+	psi_step_d, orientations from orientation_grid( tilt_step_d, max_tilt_d ).
+	The result is resized as the planar lobe, with the last line at max_dist_m: r_max in m and volume in m^3.
+	'''
+	r_m 	= np.asarray( field.r[-1][:lines_n] )
+	scale 	= max_dist_m / r_m[lines_n -1]
+	with stage( 'GETTING THE SIMULATED FIELD VALUES' ):
+		table = rotation_table( field.r[:, :lines_n], field.B_et[:, :lines_n], field.B_er[:, :lines_n], list( field.thetas_d ) )
+		if Bth is None:
+			i_axis 	= list( field.thetas_d ).index( 0 )
+			Bth 	= np.sqrt( field.B_et[i_axis][lines_n -1]**2 + field.B_er[i_axis][lines_n -1]**2 )
+
+	with stage( 'GUARANTEED VOLUME' ):
+		thetas_d 	= list( np.linspace( 0, 180, int( round( 180 / theta_step_d ) ) + 1 ) )
+		psis_d 		= list( np.arange( 0, 360, psi_step_d, dtype = float ) )
+		alphas_d 	= list( np.linspace( 0, 90, int( round( 90 / alpha_step_d ) ) + 1 ) )
+		volume 		= guaranteed_volume( table, r_m, thetas_d, psis_d, alphas_d, orientation_grid( tilt_step_d, max_tilt_d ), Bth,
+			pivot_dist_m / scale, max_bytes )
+	return volume._replace( r_max = volume.r_max * scale, volume = volume.volume * scale**3 )
+
+
+def cross_section( volume, psi_d ):
+	'''
+	The meridian section of the Volume through the reader's axis at azimuth psi_d (which must be one of its
+	psis_d, as psi_d + 180 if it is there too). Returns ( angles_d, r_max ), the angles from the axis going through
+	psi_d (0 to 180) and on through psi_d + 180 (180 to 360, each point once: 360 is left out, being 0).
+	'''
+	psis 	= [ p % 360 for p in volume.psis_d ]
+	thetas 	= np.asarray( volume.thetas_d, dtype = float )
+	angles 	= thetas
+	values 	= volume.r_max[:, psis.index( psi_d % 360 )]
+	if ( psi_d + 180 ) % 360 in psis:
+		back 	= volume.r_max[:, psis.index( ( psi_d + 180 ) % 360 )]
+		# Without the back half's 180 deg (already there) and 360 deg (the same point as 0).
+		angles 	= np.concatenate([ angles, 360 - thetas[::-1][1:-1] ])
+		values 	= np.concatenate([ values, back[::-1][1:-1] ])
+	return ( angles, values )
@@ -1,6 +1,20 @@
+import os
+import sys
+
 import numpy as np
-from scipy.interpolate import make_interp_spline
-from scipy.optimize import curve_fit
+
+# The shared compute code lives in region/lfwu
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from lfwu.loader import load_field_profile
+from lfwu.field_cache import load_field_set
+from lfwu.femm import read_ans, mesh_field, field_set_from_ans
+from lfwu.loop_coil import coil_field_set
+from lfwu.engine import rotate_reader, project_on_tag, last_crossing, sweep_from_rotation, phi_grid, lobe_curve
+from lfwu.rotation import rotation_table, rotate_reader_continuous
+from lfwu.fitting import fit_decay, near_field_cutoff
+from lfwu.measurement import measured_lobe
+from lfwu.plots import lobe_polar
+from lfwu import profiling
 
 sim = 'simulated'
 meas = 'measured'
@@ -22,46 +36,17 @@ def decay_inv(y, a):
 #### FUNCTIONS TO GET THE LOBE ###############
 ##############################################
 
-def get_lobe(distances_m, module):
-	A=np.zeros(dists_n)
-
-	skip = 1
-	for i in range(dists_n):
-		start = i*8 + skip
-		end = start + 7 - skip
-		opot, pcov = curve_fit( decay, distances_m[start:end],module[start:end])
-		perr = np.sqrt(np.diag(pcov))
-		A[i] = opot[0]
-	# The Vth that would have been measured at the maximum 
-	# reported Wake-Up-distance.
-	# It was measured with 0 degrees.	
-	th_max_dist = decay( max_dist_m, A[0] )
-	# The distance at which in each direction that voltage is obtained	
-	th_dist_m = np.zeros(dists_n)
-	for i in range(dists_n):
-		th_dist_m[i] = decay_inv( th_max_dist, A[i] )
-	# Normalize those values for representation
-	norm_th_dist_m = th_dist_m * max(r_m) / max_dist_m
-	return (norm_th_dist_m, th_max_dist)
+# skip is the number of distances left out of the fit in each block, or None to find it for each angle with near_field_cutoff(). 
+def get_lobe(distances_m, module, max_dist_m = 5, angles_n = 7, skip = 1):
+	# One block of 8 distances per angle. All the angles are fitted at once (see lfwu/measurement.py).
+	lobe = measured_lobe( distances_m, module, max_dist_m, angles_n, skip = skip )
+	return (lobe.lobe, lobe.th_max_dist)
 
 def get_lobe_polar( distances_m, angles_r, maxs ):
-
-	xls = angles_r
-	yls = np.array( maxs )
-	
-	X_ = np.linspace(xls.min(), xls.max(), 500)
-	X_Y_Spline = make_interp_spline(xls, yls)
-	Y_ = X_Y_Spline(X_)
-	return (X_, Y_)
+	# The spline over the 500 angles is a fixed linear map of the knots, built once (scipy is only imported then).
+	return lobe_polar( angles_r, maxs )
 	
 	
 
 def getValuesFromFile( file_name ):
-	with open( data_dir + file_name + 'deg.txt' ) as f_data:
-		values = np.empty((0,4),int)
-		for line in f_data:
-		    newLine = line.strip().split('\t')
-		    dArray 	= np.array(newLine)
-		    values 	= np.append(values,[dArray],axis=0)
-		    values 	= np.asfarray(values,dtype=float)
-	return values.transpose()
+	return np.array( load_field_profile( data_dir, file_name ) )
@@ -35,6 +35,15 @@ phis_orig		= thetas_d
 
 phis_d = phis_min
 
+# Step (in degrees) of the fine sweep over the tag orientations for the minimum lobe, e.g. 0.1. 
+# When 0, the minimum is only taken over phis_d.
+phi_step_d = 0
+
+# Per-stage timing and memory report (see lfwu/profiling.py), written at exit, e.g. 'profile.json' ('-' for the console). None to disable. 
+profile_file = None
+if profile_file:
+	profiling.enable( profile_file )
+
 
 ''''""""""""""""""""""""""""""""""""""""""""""""""""""""""
  DECLARATION OF GLOBAL VARS 
@@ -44,7 +53,7 @@ phis_d = phis_min
 B 			= {}	# Magnetic field (B) module (in Tesla)
 B_er 		= {}	# Magnetic field (B) on versor e_r (in Tesla)  	
 B_et 		= {}	# Magnetic field (B) on versor e_theta (in Tesla)
-B_rot 		= {}	# Magnetic field resulting from the rotation of the reader (in Tesla)
+B_rot 		= None	# Magnetic field resulting from the rotation of the reader (in Tesla). Shape (alpha, theta, r)
 
 
 
@@ -52,7 +61,7 @@ gamma_r 	= {}	# Angle gamma of B wrt e_r (in radians)
 gamma_d 	= {}	# Angle gamma of B wrt e_r (in degrees)
 gamma_abs_r = {}	# Anlge gamma of B with respect to the horizontal (in radians)
 gamma_abs_d = {}	# Angle gamma of B with respect to the horizontal (in degrees)
-gamma_rot_r = {}	# Angle gamma of B wrt e_r resulting from the rotation of the reader (in radians)  
+gamma_rot_r = None	# Angle gamma of B wrt e_r resulting from the rotation of the reader (in radians). Shape (alpha, theta, r)
 
 r_m			= []	# Distances over e_r in which the simulation obtained values, in meters.
 
@@ -111,19 +120,35 @@ tangential to the traced line. In our case, the line is the versor e_r, so the n
  
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''
 
+profiling.checkpoint( 'GETTING THE SIMULATED FIELD VALUES' )
+
+# The field can also be sampled directly from the FEMM solution, along the same lines but at any angles and distances. 
+ans_file 		= None					# e.g. '../../simulation/model.ans'
+ans_center_m 	= ( 0.0001, 0.0225 )	# Point (r, z) of model.FEM from which the lines were traced: the coil's center.
+ans_length_m 	= 0.4					# Length of the lines.
+# Or computed analytically for an air-core coil, along lines of the same length: ( radius in m, turns, length in m ).
+# e.g. ( 0.0071, 82, 0.045 ) for the coil of model.FEM without its ferrite core.
+analytic_coil 	= None
+
+if ans_file:
+	field = field_set_from_ans( mesh_field( read_ans( ans_file ) ), ans_center_m, thetas_d, np.linspace( 0, ans_length_m, lines_n ) )
+elif analytic_coil:
+	field = coil_field_set( thetas_d, np.linspace( 0, ans_length_m, lines_n ), *analytic_coil )
+else:
+	# The whole angle set is read from the binary cache in data/.cache, which is (re)built from the text files when they change.
+	field = load_field_set( data_dir, thetas_d )
+
 # theta_d will have the angle value in degrees.
 # theta is the string version of it to be used to access dictionaries.
-for theta_d in thetas_d:
+for theta_d, i_theta in zip( thetas_d, range( angles_n ) ):
 	theta = str(theta_d)
 	
 	# Getting the component from e_theta and the position values
-	values 		= getValuesFromFile( "/norm_" + theta )
-	r_m 		= values[0][:lines_n] 
-	B_et[theta] = values[1][:lines_n]
+	r_m 		= field.r[i_theta][:lines_n] 
+	B_et[theta] = field.B_et[i_theta][:lines_n]
 	
 	# Getting the component over e_r. The position values are the same as before.
-	values 		= getValuesFromFile( "/tan_" + theta )
-	B_er[theta] = values[1][:lines_n]
+	B_er[theta] = field.B_er[i_theta][:lines_n]
 
 	# The field module is computed. 
 	B[theta] 	= np.sqrt( B_et[theta]**2 + B_er[theta]**2 )
@@ -193,34 +218,36 @@ e.g.
 Note that this is only valid because the vector B(r,theta) has its angle expressed as relative to the versor e_r. 
 
 
-@ToDo: To replicate a more natural rotation, it should not be done along the reader's coil's center, but rather ~0.5 m behind, simulating the rotation of the arm. 
-This requires a far more complex computation.   
+To replicate a more natural rotation, it should not be done along the reader's coil's center, but rather ~0.5 m behind, simulating the rotation of the arm. 
+This is done with alpha_steps > 0: the field is interpolated from the simulated values at any rotation angle alpha and pivot distance (see lfwu/rotation.py). 
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''
 
+profiling.checkpoint( 'ROTATING theta READER' )
+
 alphas_d = thetas_d # Set of angles that represent each time step of the rotation. 
 
-# alpha_d will have the angle value in degrees.
-# alpha is the string version of it to be used to access dictionaries.
-for alpha_d in alphas_d:
-	alpha = str(alpha_d)
-	
-	B_rot[alpha] 		= {} 	# For each time step (angle alpha), we will have a dictionary representing the magnetic field intesity in the whole space.  
-	gamma_rot_r[alpha] 	= {} 	# Equivalently, for each time step we will have a dictionary for the magnetic field angle wrt e_r. 
-	
-	# theta_d will have the angle value in degrees.
-	# theta is the string version of it to be used to access dictionaries.
-	for theta_d in thetas_d:
-		theta = str(theta_d)
-		
-		# In the initial scenario, for each angle theta there is a set of magnetic field intensity and angle gamma. The swype angle is which of those sets from the original scenario will be loaded into the new set alpha. 
-		# e.g. If we have rotated the reader 30 deg, in the place of theta = 45 deg we will have to place the original values for theta = 45 - 30 deg = 15 deg.   
-		swypeAng = str( abs( theta_d - alpha_d ) )
-		B_rot		[alpha][theta] = B		[ swypeAng ]
-		gamma_rot_r	[alpha][theta] = gamma_r[ swypeAng ]
+# The field module and angle of every theta, stacked in arrays of shape (theta, r).
+B_all 		= np.array([ B[ str(theta_d) ] for theta_d in thetas_d ])
+gamma_r_all = np.array([ gamma_r[ str(theta_d) ] for theta_d in thetas_d ])
+
+# For each time step (angle alpha) we get the magnetic field intensity and angle wrt e_r in the whole space. 
+# In the initial scenario, for each angle theta there is a set of magnetic field intensity and angle gamma. The swype angle |theta - alpha| is which of those sets from the original scenario will be loaded into the new set alpha. 
+# e.g. If we have rotated the reader 30 deg, in the place of theta = 45 deg we will have to place the original values for theta = 45 - 30 deg = 15 deg.   
+( B_rot, gamma_rot_r ) = rotate_reader( B_all, gamma_r_all, thetas_d, alphas_d )
+
+# Continuous rotation: number of time steps for alpha from 0 to 90 deg (0 to keep the index swapping above) and distance from the pivot (the arm) to the coil's center, in meters. 
+alpha_steps 	= 0
+pivot_dist_m 	= 0.5
+
+if alpha_steps:
+	alphas_d 	= list( np.linspace( 0, 90, alpha_steps ) )
+	table 		= rotation_table( field.r[:, :lines_n], field.B_et[:, :lines_n], field.B_er[:, :lines_n], thetas_d )
+	# The pivot distance is brought to the simulation scale, in which Bth is found at the last line instead of at max_dist_m. 
+	( B_rot, gamma_rot_r ) = rotate_reader_continuous( table, r_m, thetas_d, alphas_d, pivot_dist_m * r_m[lines_n -1] / max_dist_m )
 
 if 0:		
 	print(B_rot)	
-	print( gamma_rot_r['0']['0'] )
+	print( gamma_rot_r[0][0] )
 
 
 ''''""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -249,56 +276,18 @@ for each phi:
 
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''	
 
+profiling.checkpoint( 'ROTATING THE TAG' )
+
 
 # Temporarily Bth will be fixed to B(r=40cm) (the B seen at 5m - i.e. the alrgest distance where the tag could WU!- )
 Bth = B['0'][lines_n -1]
 
-B_rot_tag 		= {}
-B_max_rot_tag 	= {}
-r_max_rot_tag 	= {}
-
-B_tgt = np.full( lines_n, Bth )
+# The B through the tag, for each (phi, alpha, theta, r). 
+# The orientation phi affects merely with the sine of the angle between phi and the B direction gamma. 
+B_rot_tag = project_on_tag( B_rot, gamma_rot_r, phis_d )
 
-for phi_d in phis_d:
-	phi = str(phi_d)
-	
-	B_rot_tag[phi] 		= {}
-	B_max_rot_tag[phi] 	= {}
-	r_max_rot_tag[phi] 	= {}
-	
-	for alpha_d in alphas_d:
-		alpha = str(alpha_d)
-		
-		B_max = 0
-		index_max = 0
-		diff = []
-		B_thr_tag_diff = []
-		
-		thisPhi = np.full( lines_n, phi_d )
-		
-		B_rot_tag[phi][alpha] 		= {}
-		B_max_rot_tag[phi][alpha] 	= {}
-		r_max_rot_tag[phi][alpha] 	= {}
-		
-		for theta_d in thetas_d:
-			theta = str(theta_d)
-				
-			diff = abs( thisPhi - gamma_rot_r[alpha][theta]*rad_2_deg )*deg_2_rad
-			
-			factor = np.sin( diff )
-			B_rot_tag[phi][alpha][theta] = B_rot[alpha][theta]*factor
-				
-			B_thr_tag_diff = B_rot_tag[phi][alpha][theta] - B_tgt
-			
-			for i in range(len(B_thr_tag_diff)):
-				if B_thr_tag_diff[i] > 0:
-					index_max = i
-			if 0:
-				print( "phi: ", phi, "\talpha: ", alpha, "\ttheta: ", theta, "\tB: ", B_rot_tag[phi][alpha][theta] ) 
-				print("Diffs: ", B_thr_tag_diff )			
-				print(index_max)
-			
-			r_max_rot_tag[phi][alpha][theta] = r_m[index_max] 
+# The lobe edge is the last distance where the B through the tag is above Bth (r = 0 if it never is). Shape (phi, alpha, theta)
+r_max_rot_tag = r_m[ last_crossing( B_rot_tag, Bth ) ]
 
 if 0:
 	print(r_max_rot_tag)
@@ -311,31 +300,11 @@ Now that we have for each phi and alpha what is the area where the tag would WU!
  
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''
 
-r_max_flat_time = {}
-
-for phi_d in phis_d:
-	phi = str(phi_d)
-	
-	r_max_flat_time[phi] = {}
-
-	for theta_d in thetas_d:
-		theta = str(theta_d)
+profiling.checkpoint( 'TIME FLATTENING' )
 
-		r_maxs_list = []
-		
-		for alpha_d, i in zip( alphas_d, range( len(alphas_d) ) ): 
-			alpha = str(alpha_d)	
-			r_maxs_list.append(r_max_rot_tag[phi][alpha][theta])
-			
-		r_max_flat_time[phi][theta] = max( r_maxs_list )	
-		
-		if 0: 
-			print("r_max_rot_tag[",phi,"][",alpha,"][",theta,"] \t", r_max_rot_tag[phi][alpha][theta])
-			print("r_max_flat_time[",phi,"][",theta,"]\t", r_max_flat_time[phi][theta] )	 
-			print("list: ", r_maxs_list )
-			print("max: ",max( r_maxs_list ) ) 
+# Max over the time steps alpha. Shape (phi, theta)
+r_max_flat_time = r_max_rot_tag.max( axis = 1 )
 			
-		
 if 0:			
 	print( r_max_flat_time )
 
@@ -350,30 +319,36 @@ That is done by taking the minimum lobe edge among the len(phis_d) options for e
  
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''
 
-guar_lobe = np.zeros( angles_n )
+profiling.checkpoint( 'MINIMUM LOBE' )
 
+# Min over the tag orientations phi. Shape (theta)
+guar_lobe = r_max_flat_time.min( axis = 0 )
 
-for theta_d, i_theta in zip( thetas_d, range( angles_n )):
-	theta = str(theta_d)
-	
-	r_mins_list = []
-	
-	for phi_d, i_phi in zip( phis_d, range( len( phis_d ) ) ):
-		phi = str(phi_d)
-		
-		r_mins_list.append(r_max_flat_time[phi][theta])
-		
-	guar_lobe[i_theta] = ( min( r_mins_list ) ) 
+# The fine sweep takes it over every orientation from 0 to 90 deg, dropping each one as soon as it cannot lower the minimum. 
+if phi_step_d:
+	sweep 		= sweep_from_rotation( B_rot, gamma_rot_r, r_m, phi_grid( phi_step_d ), Bth )
+	guar_lobe 	= sweep.guar_lobe
+	print( "Worst tag orientations: ", sweep.worst_phi_d )
 
 if 1:
 	print( "Minimum Guaranteed Lobe: ", guar_lobe )
 
+# The minimum lobe for many thresholds at once, e.g. to see the lobe given by each ASIC sensitivity. 
+# Bth_curve holds the thresholds as multiples of Bth (empty to skip). Row k of guar_lobe_curve is the guar_lobe for Bth_curve[k]*Bth. 
+Bth_curve = [] 	# e.g. np.geomspace( 0.1, 10, 200 )
+
+if len( Bth_curve ):
+	guar_lobe_curve = lobe_curve( B_rot, gamma_rot_r, r_m, phis_d, np.asarray( Bth_curve )*Bth ).guar_lobe
+	print( "Guaranteed lobe at 0 deg vs Bth: ", guar_lobe_curve[:, 0] )
+
 
 ''''""""""""""""""""""""""""""""""""""""""""""""""""""""""
  SETTING THE FIGURE
  
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''	
 
+profiling.checkpoint( 'plotting' )
+
 f = plt.figure()
 axs = f.add_subplot(polar=True)
 #f.text(0.5, 0.01, "Distance (m)", ha='center', fontsize=14)
@@ -392,12 +367,12 @@ This is used to scale up the lobe.
 
 """""""""""""""""""""""""""""""""""""""""""""""""""""""'''	
 
-# A first set of values are skipped to because the magentic field decay can be approximated to A.1/r^3 only after a considerable distance from the coil.
+profiling.checkpoint( 'RESIZING THE LOBE' )
 
-'''
-@ToDo: Compute this skip from the min_dist_m, and not arbitrarily. 
-'''
-skip = 10
+# A first set of values are skipped to because the magentic field decay can be approximated to A.1/r^3 only after a considerable distance from the coil.
+# The skip is the first line from which the A.1/r^3 model fits all the following ones with a relative residual below near_field_tol. 
+near_field_tol 	= 0.05
+skip 			= int( near_field_cutoff( r_m, B['0'], tol = near_field_tol ).index )
 
 A 			= {}
 grow_factor = {}
@@ -406,14 +381,14 @@ guar_lobe_real = []
 scaling_factor = 1 / r_m[ lines_n -1 ] 
 
 # The intesity values are approximated to obtain the coefficient A. 
-opot, pcov = curve_fit( decay, r_m[skip:], B['0'][skip:] )
-A = opot[0]
+( A, _ ) = fit_decay( r_m[skip:], B['0'][skip:] )
 
 # The approximation is used (with the coefficient A) to obtain the magnetic field intensity that the tag let through at the max distance. 
 Bth_real	= decay( max_dist_m, A)
 r_max_real	= decay_inv( Bth_real, A ) # The distance where Bth real is found. 
 	
 print("guar lobe 0: \t\t", guar_lobe[0] )
+print("near field cutoff:\t", r_m[skip] )
 print("scaling factor:\t", scaling_factor )
 print("Bth real: \t\t", Bth_real )
 print("r-max_real: \t\t", r_max_real ) 
@@ -424,7 +399,9 @@ for i_lobe in range( len( thetas_d ) ):
 	guar_lobe_real.append( guar_lobe[i_lobe] * r_max_real * scaling_factor)
 
 
-phi = '0'
+profiling.checkpoint( 'plotting' )
+
+i_phi = phis_d.index( 0 )
 	
 setup_plot( axs )
 colors = cm.rainbow(np.linspace(0, 1, len( alphas_d )))
@@ -432,9 +409,8 @@ colors = cm.rainbow(np.linspace(0, 1, len( alphas_d )))
 scaling_factor = guar_lobe_real / guar_lobe 
 	
 for alpha_d, i_color in zip( alphas_d, range( len( alphas_d ) ) ) :
-	alpha = str(alpha_d)
 
-	values = np.array( list ( r_max_rot_tag[ phi ][alpha].values() ))			
+	values = r_max_rot_tag[ i_phi ][ i_color ]
 	
 	# resacling the values
 	values = values * scaling_factor
@@ -443,11 +419,9 @@ for alpha_d, i_color in zip( alphas_d, range( len( alphas_d ) ) ) :
 
 	
 
-for phi_d in phis_d:
-	phi = str( phi_d ) 
-		
+for phi_d, i_phi in zip( phis_d, range( len( phis_d ) ) ):
 
-	values = np.array( list ( r_max_flat_time[ phi ].values() ))
+	values = r_max_flat_time[ i_phi ]
 
 	# resacling the values
 	values = values * scaling_factor
@@ -474,25 +448,23 @@ plot_small_lobes = 1
 
 if 1: 
 
-	phi = '0'
+	i_phi = phis_d.index( 0 )
 		
 	setup_plot( axs )
 	colors = cm.rainbow(np.linspace(0, 1, len( alphas_d )))
 		
 	if plot_color_lobes:	
 		for alpha_d, i_color in zip( alphas_d, range( len( alphas_d ) ) ) :
-			alpha = str(alpha_d)
 
-			values = np.array( list ( r_max_rot_tag[ phi ][alpha].values() ))			
+			values = r_max_rot_tag[ i_phi ][ i_color ]
 			
 			plot_lobe( axs, values, colors[i_color] )	
 
 	if plot_small_lobes:
 	#### Plot each time-flattened lobe contour	
-		for phi_d in phis_d:
-			phi = str( phi_d ) 
+		for phi_d, i_phi in zip( phis_d, range( len( phis_d ) ) ):
 				
-			values = np.array( list ( r_max_flat_time[ phi ].values() ))
+			values = r_max_flat_time[ i_phi ]
 
 			setup_plot 		( axs)
 			plot_lobe_edge	( axs, values, w=1, s=':' )
@@ -509,8 +481,10 @@ if 0:
 ##############################################
 #############  SAVE IMG ##############
 ##############################################
+profiling.checkpoint( 'saving svg' )
 if 1:
 	f.savefig("imgs/plot.svg",format = 'svg',transparent=True)
+profiling.checkpoint( None )
 
 
 
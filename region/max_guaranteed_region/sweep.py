@@ -0,0 +1,42 @@
+'''
+Sweep of the guaranteed lobe over a grid of the parameters main.py fixes as constants.
+Every combination is evaluated over a process pool (see lfwu/runner.py) and the results are written to one table.
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# The shared compute code lives in region/lfwu
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from lfwu.runner import param_grid, run_grid, write_table
+
+
+data_dirs 	= [ 'data' ]								# Directories with the FEMM exports, one per geometry.
+lines_ns 	= [ 60, 80, 100 ]							# Number of lines used from the simulated values.
+phis_ds 	= [ [ 0, 45, 90 ], [ 0, 15, 30, 45, 60, 75, 90 ] ]	# Sets of tag orientations, in degrees.
+Bths 		= [ None ] + list( np.geomspace( 1e-6, 1e-5, 50 ) )	# Thresholds, in Tesla. None is B['0'][lines_n -1], as in main.py.
+max_dists_m = [ 4, 5, 6 ]								# Max distance at which the tag woke up, to resize the lobe.
+
+workers 	= None			# Processes, None for every core.
+table_file 	= 'sweep.csv'
+
+# One figure per combination of the above but Bth, with the lobes of every Bth (see render_sweep() in lfwu/plots.py).
+figures_dir 	= None		# e.g. 'sweep_figs', None for no figures.
+figures_format 	= 'png'		# 'png' is blitted over a pre-rendered axis, 'svg' is vector.
+
+
+if __name__ == '__main__':
+	grid 	= param_grid( data_dirs, lines_ns, phis_ds, Bths, max_dists_m )
+	start 	= time.perf_counter()
+	table 	= run_grid( grid, workers = workers )
+	print( "%d combinations in %.2f s" % ( len( grid ), time.perf_counter() - start ) )
+	write_table( table_file, table )
+
+	if figures_dir:
+		from lfwu.plots import render_sweep
+		start 	= time.perf_counter()
+		paths 	= render_sweep( table, figures_dir, figures_format )
+		print( "%d figures in %.2f s" % ( len( paths ), time.perf_counter() - start ) )
@@ -1,8 +1,16 @@
+import os
+import sys
+
 import numpy as np
 from numpy import pi
 from matplotlib import pyplot as plt
-from scipy.interpolate import make_interp_spline
-from scipy.optimize import curve_fit
+
+# The shared compute code lives in region/lfwu
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from lfwu.loader import load_measured, load_simulated
+from lfwu.measurement import measured_lobe
+from lfwu.plots import lobe_polar
+from lfwu.uncertainty import bootstrap_lobe
 
 max_dist_m 	= 5
 dists_n 	= 7
@@ -33,39 +41,23 @@ def decay_inv(v, a):
 	return (a/v)**(1/3)
 
 
-def get_lobe(distances_m, module_T):
-	A=np.zeros(dists_n)
-
-	skip = 1
-	for i in range(dists_n):
-		start = i*8 + skip
-		end = start + 7 - skip
-		opot, pcov = curve_fit( decay, distances_m[start:end],module_T[start:end])
-		perr = np.sqrt(np.diag(pcov))
-		print(perr)
-		A[i] = opot[0]
-	# The Vth that would have been measured at the maximum 
-	# reported Wake-Up-distance.
-	# It was measured with 0 degrees.	
-	Vth_max_dist_vpp = decay( max_dist_m, A[0] )
-	# The distance at which in each direction that voltage is obtained	
-	Vth_dist_m = np.zeros(dists_n)
-	for i in range(dists_n):
-		Vth_dist_m[i] = decay_inv( Vth_max_dist_vpp, A[i] )
-	# Normalize those values for representation
-	norm_Vth_dist_m = Vth_dist_m * max(r_m) / max_dist_m
-	return (norm_Vth_dist_m, Vth_max_dist_vpp)
-
-def get_lobe_polar( distances_m, modules_T,  ):
+# skip is the number of distances left out of the fit in each block, or None to find it for each angle with near_field_cutoff(). 
+def get_lobe(distances_m, module_T, skip = 1):
+	# One block of 8 distances per angle. All the angles are fitted at once (see lfwu/measurement.py).
+	# The Vth is the one that would have been measured at the maximum reported Wake-Up-distance, with 0 degrees.
+	# The lobe is the distance at which each direction gets that voltage, normalized for representation.
+	lobe = measured_lobe( distances_m, module_T, max_dist_m, angles_n, skip = skip )
+	print(lobe.perr)
+	return (lobe.lobe, lobe.th_max_dist)
+
+def get_lobe_polar( distances_m, modules_T, skip = 1 ):
 
 	xls = np.array([0, 15, 30, 45, 60, 75, 90])*pi/180
-	X_ = np.linspace(xls.min(), xls.max(), 500)
 	
-	(norm_Vth_dist_m, Vth_max_dist_vpp) = get_lobe( distances_m, modules_T )
-	yls = np.array(norm_Vth_dist_m)
+	(norm_Vth_dist_m, Vth_max_dist_vpp) = get_lobe( distances_m, modules_T, skip )
 	
-	X_Y_Spline = make_interp_spline(xls, yls)
-	Y_ = X_Y_Spline(X_)
+	# The spline over the 500 angles is a fixed linear map of the knots, built once for both lobes.
+	(X_, Y_) = lobe_polar( xls, norm_Vth_dist_m )
 	return (X_, Y_, Vth_max_dist_vpp)
 
 
@@ -73,15 +65,7 @@ def get_lobe_polar( distances_m, modules_T,  ):
 #### GETTING MEASURED VALUES ################
 ##############################################
 
-with open(meas + '.csv') as data:
-    values = np.empty((0,4),int)
-    for line in data:
-        newLine = line.strip().split(',')
-        miArray = np.array(newLine)
-        values = np.append(values,[miArray],axis=0)
-        values = np.asfarray(values,dtype=float)
-
-values = values.transpose()
+values = load_measured( meas + '.csv' )
 
 ## GETTING AXIS AND X,Y PAIRS
 r_m = values[0]*0.01
@@ -92,8 +76,7 @@ u = values[3]
 m = np.sqrt(u**2 + v**2)
 a = np.arctan(u/v)
 ## NORMALIZATION
-for i in range(len(u)):
-    u[i] = np.cos(a[i]) if t[i] <= a[i] else -np.cos(a[i]) 
+u = np.where(t <= a, np.cos(a), -np.cos(a))
 v = np.sin(a)
 
 
@@ -101,15 +84,7 @@ v = np.sin(a)
 ######### GETTING SIMULATED VALUES ###########
 ##############################################
 
-with open( sim + '.csv') as data:
-    values = np.empty((0,3),int)
-    for line in data:
-        newLine = line.strip().split(',')
-        miArray = np.array(newLine)
-        values = np.append(values,[miArray],axis=0)
-        values = np.asfarray(values,dtype=float)
-
-values = values.transpose()
+values = load_simulated( sim + '.csv' )
 ## GETTING AXIS AND X,Y PAIRS
 r_sim = values[0]*0.01
 t_sim = values[1]*pi/180
@@ -153,6 +128,13 @@ ax.plot(x_lobe,y_lobe_meas,'k:')
 ax.plot(x_lobe, y_lobe_sim, 'k--')
 ax.fill_between(x_lobe,0,y_lobe_sim, alpha=0.075, zorder=0,color='k')
 
+# 95% band of the measured lobe from resampled fits (see lfwu/uncertainty.py), e.g. 10000 replicates. 0 to disable. 
+bootstrap_n = 0
+if bootstrap_n:
+	boot = bootstrap_lobe( r_m, m, max_dist_m, angles_n, n = bootstrap_n, spline_n = len( x_lobe ) )
+	print( "measured lobe, 95% interval:", boot.lobe.low, boot.lobe.high )
+	ax.fill_between(boot.spline[0], boot.spline[1], boot.spline[2], alpha=0.15, zorder=0, color='k')
+
 ##############################################
 ############# TEXT FOR THE LOBE ##############
 ##############################################